@@ -4,12 +4,21 @@
 import logging
 import os
 
-from sanji.core import Sanji
-from sanji.core import Route
-from sanji.connection.mqtt import Mqtt
-from voluptuous import Schema
-from voluptuous import Any, Required, Optional, Length, REMOVE_EXTRA
-from route import IPRoute
+from ip import netcalc
+from ip import process
+
+# fork the command spawner while the interpreter is still small
+if __name__ == "__main__" and "0" != os.getenv("ROUTE_SPAWNER", "1"):
+    process.start_spawner()
+
+from sanji.core import Sanji  # noqa: E402
+from sanji.core import Route  # noqa: E402
+from sanji.connection.mqtt import Mqtt  # noqa: E402
+from voluptuous import Schema  # noqa: E402
+from voluptuous import Any, All, Required, Optional, Length, Range  # noqa
+from voluptuous import Match  # noqa: E402
+from voluptuous import REMOVE_EXTRA  # noqa: E402
+from route import IPRoute  # noqa: E402
 
 
 class Index(Sanji):
@@ -19,6 +28,11 @@ class Index(Sanji):
         Optional("interface"): Any(str, unicode, Length(1, 255)),
         Optional("gateway"): Any(str, unicode, Length(1, 255)),
         Optional("actualIface"): Any(str, unicode, Length(1, 255)),
+        Optional("ipv6"): {
+            Optional("interface"): Any(str, unicode, Length(1, 255)),
+            Optional("gateway"): Any(str, unicode, Length(1, 255)),
+            Optional("actualIface"): Any(str, unicode, Length(1, 255))
+        },
         Required("priorityList"): [Any(str, unicode, Length(1, 255))]
     }, extra=REMOVE_EXTRA)
 
@@ -26,6 +40,63 @@ class Index(Sanji):
         Required("priorityList"): [Any(str, unicode, Length(1, 255))]
     }, extra=REMOVE_EXTRA)
 
+    # interface name, at most IFNAMSIZ - 1 characters
+    IFNAME = Match(r"^[A-Za-z0-9_.-]{1,15}\Z")
+
+    # "source" and "iif" are written to the stdin of "ip -batch", newlines
+    # or spaces would add commands
+    PUT_POLICIES_SCHEMA = Schema([{
+        Required("table"): All(int, Range(1, 252)),
+        Optional("source"): All(Any(str, unicode), netcalc.cidr),
+        Optional("iif"): All(Any(str, unicode), IFNAME),
+        Optional("priority"): All(int, Range(1, 32765)),
+        Required("priorityList"): [Any(str, unicode, Length(1, 255))]
+    }], extra=REMOVE_EXTRA)
+
+    PUT_METRICS_SCHEMA = Schema({
+        Optional("enable"): bool,
+        Optional("reset"): bool
+    }, extra=REMOVE_EXTRA)
+
+    PUT_QUALITY_SCHEMA = Schema({
+        Optional("enable"): bool,
+        Optional("target"): Any(str, unicode, Length(0, 255)),
+        Optional("interval"): All(int, Range(1, 3600)),
+        Optional("timeout"): All(int, Range(1, 60)),
+        Optional("window"): All(int, Range(1, 1024)),
+        Optional("alpha"): All(Any(int, float), Range(0, 1)),
+        Optional("tolerance"): All(Any(int, float), Range(0)),
+        Optional("weights"): {
+            Optional("rtt"): All(Any(int, float), Range(0)),
+            Optional("jitter"): All(Any(int, float), Range(0)),
+            Optional("loss"): All(Any(int, float), Range(0))
+        }
+    }, extra=REMOVE_EXTRA)
+
+    PUT_DRIFT_SCHEMA = Schema({
+        Required("policy"): Any("enforce", "adopt", "alert")
+    }, extra=REMOVE_EXTRA)
+
+    PUT_FAILBACK_SCHEMA = Schema({
+        Optional("mode"): Any("immediate", "graceful"),
+        Optional("timeout"): All(int, Range(1, 86400))
+    }, extra=REMOVE_EXTRA)
+
+    SIMULATION_CONFIG_SCHEMA = Schema({
+        Optional("priorityList"): [Any(str, unicode, Length(1, 255))],
+        Optional("interfaces"): {
+            Any(str, unicode): {
+                Optional("status"): bool,
+                Optional("wan"): bool,
+                Optional("gateway"): Any(str, unicode, Length(0, 255))
+            }
+        },
+        Optional("available"): [Any(str, unicode, Length(1, 255))]
+    }, extra=REMOVE_EXTRA)
+
+    POST_SIMULATION_SCHEMA = Schema(
+        Any([SIMULATION_CONFIG_SCHEMA], SIMULATION_CONFIG_SCHEMA))
+
     EVENT_IFACE_SCHEMA = Schema({
         Required("name"): Any(str, unicode, Length(1, 255)),
         Optional("actualIface"): Any(str, unicode, Length(0, 255)),
@@ -38,6 +109,7 @@ class Index(Sanji):
         Optional("netmask"): Any(str, unicode, Length(0, 255)),
         Optional("broadcast"): Any(str, unicode, Length(0, 255)),
         Optional("gateway"): Any(str, unicode, Length(0, 255)),
+        Optional("gateway6"): Any(str, unicode, Length(0, 255)),
         Optional("dns"): [Any(str, unicode, Length(0, 255))]
     }, extra=REMOVE_EXTRA)
 
@@ -46,8 +118,21 @@ class Index(Sanji):
 
         self.route = IPRoute(
             name="route",
-            path=path_root)
+            path=path_root,
+            engine=os.getenv("ROUTE_ENGINE", "thread"),
+            history=os.getenv("ROUTE_HISTORY_FILE"),
+            drift=os.getenv("ROUTE_DRIFT_POLICY", "enforce"),
+            conntrack="1" == os.getenv("ROUTE_CONNTRACK_FLUSH"),
+            failback=os.getenv("ROUTE_FAILBACK", "immediate"),
+            resolv_conf=os.getenv("ROUTE_RESOLV_CONF", "/etc/resolv.conf"))
         self.route.set_wan_event_cb(self.update_wan_info)
+        self.route.set_delta_event_cb(self.publish_delta)
+
+    def run(self):
+        self.route.run()
+
+    def before_stop(self):
+        self.route.stop()
 
     def update_wan_info(self, interface, actual_iface=None):
         """
@@ -66,13 +151,38 @@ class Index(Sanji):
             timeout=5,
             data={"data": interface})
 
+    def publish_delta(self, delta):
+        """
+        Publish changes of interfaces and default route.
+
+        Args:
+            delta: dict format with "seq" and "changes"
+        """
+        self.publish.event.put("/network/routes/delta", data=delta)
+
+    def _conditional(self, message, response, get_data):
+        """
+        Reply the view built by "get_data". If the request carries a
+        "version" query, reply with the version attached, or with 304 if the
+        client's version is still current.
+        """
+        if "version" not in message.query:
+            return response(data=get_data())
+
+        version = self.route.get_version()
+        if str(message.query["version"]) == str(version):
+            return response(code=304, data={"version": version})
+        return response(data={"version": version, "data": get_data()})
+
     @Route(methods="get", resource="/network/routes/default")
     def get_default(self, message, response):
-        data = self.route.get_default()
-        if data is None:
-            data = {}
-        data["priorityList"] = self.route.get_priority_list()
-        return response(data=Index.GET_DEFAULT_SCHEMA(data))
+        def _get_default():
+            data = self.route.get_default()
+            if data is None:
+                data = {}
+            data["priorityList"] = self.route.get_priority_list()
+            return Index.GET_DEFAULT_SCHEMA(data)
+        return self._conditional(message, response, _get_default)
 
     @Route(methods="put", resource="/network/routes/default")
     def put_default(self, message, response,
@@ -91,6 +201,33 @@ class Index(Sanji):
 
         return response(data=data)
 
+    @Route(methods="get", resource="/network/routes/policies")
+    def _get_policies(self, message, response):
+        return response(data=self.route.get_policies())
+
+    @Route(methods="put", resource="/network/routes/policies")
+    def _put_policies(self, message, response, schema=PUT_POLICIES_SCHEMA):
+        """
+        Update the policy routing, each policy has its own default route in
+        a routing table for packets from "source" and/or "iif".
+        """
+        try:
+            data = self.route.set_policies(message.data)
+        except Exception as e:
+            return response(code=400, data={"message": str(e)})
+        return response(data=data)
+
+    @Route(methods="post", resource="/network/routes/simulation")
+    def _post_simulation(self, message, response,
+                         schema=POST_SIMULATION_SCHEMA):
+        """
+        Dry run: the default route of each configuration, the kernel is not
+        touched.
+        """
+        if isinstance(message.data, list):
+            return response(data=self.route.simulate(message.data))
+        return response(data=self.route.simulate([message.data])[0])
+
     @Route(methods="put", resource="/network/routes/db")
     def _update_db(self, message, response):
         """
@@ -108,7 +245,73 @@ class Index(Sanji):
 
     @Route(methods="get", resource="/network/routes/db")
     def _get_db(self, message, response):
-        return response(data=self.route.get_iface_db())
+        return self._conditional(message, response, self.route.get_iface_db)
+
+    @Route(methods="get", resource="/network/routes/snapshot")
+    def _get_snapshot(self, message, response):
+        return response(data=self.route.get_snapshot())
+
+    @Route(methods="get", resource="/network/routes/metrics")
+    def _get_metrics(self, message, response):
+        fmt = message.query.get("format", "json")
+        if fmt not in ["json", "prometheus"]:
+            return response(code=400,
+                            data={"message": "Unsupported format."})
+        return response(data=self.route.get_metrics(fmt))
+
+    @Route(methods="put", resource="/network/routes/metrics")
+    def _put_metrics(self, message, response, schema=PUT_METRICS_SCHEMA):
+        return response(data=self.route.set_metrics(
+            message.data.get("enable"), message.data.get("reset", False)))
+
+    @Route(methods="get", resource="/network/routes/quality")
+    def _get_quality(self, message, response):
+        return response(data=self.route.get_quality())
+
+    @Route(methods="put", resource="/network/routes/quality")
+    def _put_quality(self, message, response, schema=PUT_QUALITY_SCHEMA):
+        return response(data=self.route.set_quality(message.data))
+
+    @Route(methods="get", resource="/network/routes/drift")
+    def _get_drift(self, message, response):
+        return response(data=self.route.get_drift())
+
+    @Route(methods="put", resource="/network/routes/drift")
+    def _put_drift(self, message, response, schema=PUT_DRIFT_SCHEMA):
+        return response(data=self.route.set_drift(message.data["policy"]))
+
+    @Route(methods="get", resource="/network/routes/failback")
+    def _get_failback(self, message, response):
+        return response(data=self.route.get_failback())
+
+    @Route(methods="put", resource="/network/routes/failback")
+    def _put_failback(self, message, response, schema=PUT_FAILBACK_SCHEMA):
+        return response(data=self.route.set_failback(
+            message.data.get("mode"), message.data.get("timeout")))
+
+    @Route(methods="get", resource="/network/routes/history")
+    def _get_history(self, message, response):
+        try:
+            limit = int(message.query.get("limit", 0)) or None
+            since = message.query.get("since")
+            since = float(since) if since is not None else None
+            until = message.query.get("until")
+            until = float(until) if until is not None else None
+        except (TypeError, ValueError):
+            return response(code=400,
+                            data={"message": "Invalid limit, since or until."})
+        return response(data=self.route.get_history(since, until, limit))
+
+    @Route(methods="get", resource="/network/routes/trace")
+    def _get_trace(self, message, response):
+        try:
+            limit = int(message.query.get("limit", 0)) or None
+            since = message.query.get("since")
+            since = float(since) if since is not None else None
+        except (TypeError, ValueError):
+            return response(code=400,
+                            data={"message": "Invalid limit or since."})
+        return response(data=self.route.get_trace(limit, since))
 
     @Route(methods="put", resource="/network/interfaces/:name")
     def _event_update_db(self, message):
@@ -118,18 +321,18 @@ class Index(Sanji):
 
     @Route(methods="get", resource="/network/status")
     def _get_all_iface_status(self, message, response):
-        return response(data=self.route.get_iface_db())
+        return self._conditional(message, response, self.route.get_iface_db)
 
     @Route(methods="get", resource="/network/status/:iface")
     def _get_iface_status(self, message, response):
         iface = message.param["iface"]
-        return response(data=self.route.get_iface(iface))
+        return self._conditional(
+            message, response, lambda: self.route.get_iface(iface))
 
 
 if __name__ == "__main__":
     FORMAT = '%(asctime)s - %(levelname)s - %(lineno)s - %(message)s'
     logging.basicConfig(level=0, format=FORMAT)
-    logging.getLogger("sh").setLevel(logging.WARN)
     index = Index(connection=Mqtt())
     index.start()
 
@@ -1,2 +1,6 @@
 import addr
+import conntrack
+import neigh
+import ping
 import route
+import rule
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
-import sh
-import netifaces
-import ipcalc
+import os
 import copy
+import errno
 import logging
+import netifaces
+
+import netcalc
+import process
+import route
 
 # https://www.kernel.org/doc/Documentation/ABI/testing/sysfs-class-net
 
@@ -12,11 +16,8 @@ import logging
 # setuptools
 #   https://pypi.python.org/pypi/setuptools
 #
-# ipcalc.py
-#   https://github.com/tehmaze/ipcalc/
-#
-# sh.py
-#   https://pypi.python.org/pypi/sh
+# netifaces
+#   https://pypi.python.org/pypi/netifaces
 
 
 _logger = logging.getLogger("sanji.ethernet.ip.addr")
@@ -60,7 +61,11 @@ def ifaddresses(iface):
              "ip": "",
              "netmask": "",
              "subnet": "",
-             "broadcast": ""}]}
+             "broadcast": ""}],
+         "inet6": [{
+             "ip": "",
+             "netmask": "",
+             "scope": "global"}]}
 
     Raises:
         ValueError: You must specify a valid interface name.
@@ -83,6 +88,17 @@ def ifaddresses(iface):
     except:
         info["link"] = False
 
+    info["inet6"] = []
+    for ip in full.get(netifaces.AF_INET6, []):
+        if "addr" not in ip:
+            continue
+        addr = ip["addr"].split("%")[0]
+        info["inet6"].append({
+            "ip": addr,
+            "netmask": ip.get("netmask", "").split("/")[0],
+            "scope": "link" if addr.lower().startswith("fe80:") else "global"
+        })
+
     info["inet"] = []
     if netifaces.AF_INET not in full:
         return info
@@ -91,8 +107,7 @@ def ifaddresses(iface):
         item = copy.deepcopy(ip)
         if "addr" in item:
             item["ip"] = item.pop("addr")
-            net = ipcalc.Network("%s/%s" % (item["ip"], item["netmask"]))
-            item["subnet"] = str(net.network())
+            item["subnet"] = netcalc.network(item["ip"], item["netmask"])
         info["inet"].append(item)
 
     return info
@@ -111,33 +126,187 @@ def ifupdown(iface, up):
     if not up:
         dhclient(iface, False)
     try:
-        sh.ip("link", "set", iface, "up" if up else "down")
+        process.run("ip", "link", "set", iface, "up" if up else "down")
     except:
         raise ValueError("Cannot update the link status for \"%s\"."
                          % iface)
 
 
+# scripts of the dhcp clients started by dhclient()
+_dhclient_scripts = {}
+
+
+def _pid_file(iface):
+    return "/var/run/dhclient-{}.pid".format(iface)
+
+
+def dhclient_running(iface):
+    """Check if the dhcp client of the interface is alive by its pid file.
+    """
+    try:
+        with open(_pid_file(iface)) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (IOError, ValueError):
+        return False
+    except OSError as e:
+        return errno.EPERM == e.errno
+    return True
+
+
+def _dhclient_stop(iface):
+    _dhclient_scripts.pop(iface, None)
+    try:
+        process.run("dhclient", "-r", "-pf", _pid_file(iface), iface)
+    except Exception as e:
+        _logger.info("Failed to stop dhclient: %s" % e)
+
+
+def _dhclient_start(iface, script=None):
+    if script:
+        process.run("dhclient", "-pf", _pid_file(iface), "-nw", "-sf", script,
+                    iface)
+    else:
+        process.run("dhclient", "-pf", _pid_file(iface), "-nw", iface)
+    _dhclient_scripts[iface] = script
+
+
 def dhclient(iface, enable, script=None):
     # Enable/0Disable the dhcp client and flush interface
     # dhclient -pf /var/run/dhclient-<iface>.pid <iface>
     # dhclient -r -pf /var/run/dhclient-<iface>.pid <iface>
-    pid_file = "/var/run/dhclient-{}.pid".format(iface)
+    _dhclient_stop(iface)
+    if enable:
+        _dhclient_start(iface, script)
+
+
+def _parse_addresses(lines):
+    """Parse "ip -4 -o addr show" to a dict of IPv4 addresses by label.
+    Aliases (e.g. "eth0:1") are listed under their own labels.
+    """
+    addrs = {}
+    for line in lines:
+        fields = line.split("\\")[0].split()
+        if "inet" not in fields:
+            continue
+        ip, _, prefix = fields[fields.index("inet")+1].partition("/")
+        addrs.setdefault(fields[-1], []).append({
+            "ip": ip,
+            "prefix": int(prefix) if prefix else 32,
+            "dynamic": "dynamic" in fields})
+    return addrs
+
+
+def addresses(iface=None):
+    """List the IPv4 addresses labeled with the interface.
+
+    Args:
+        iface: interface name, all interfaces if not given.
+
+    Returns:
+        A list of addresses for an interface, or a dict of lists by label
+        for all interfaces. For example:
+
+        [{"ip": "192.168.31.36", "prefix": 24, "dynamic": False}]
+
+    Raises:
+        ValueError
+    """
+    args = ["ip", "-4", "-o", "addr", "show"]
+    if iface:
+        args += ["dev", iface]
+    try:
+        output = process.run(*args)
+    except process.CommandError as e:
+        if 1 == e.exit_code:
+            raise ValueError("Device \"%s\" does not exist." % iface)
+        raise ValueError("Unknown error for \"%s\"." % iface)
+    except:
+        raise ValueError("Unknown error for \"%s\"." % iface)
+
+    addrs = _parse_addresses(output)
+    return addrs.get(iface, []) if iface else addrs
+
+
+def _plan(iface, dhcpc, ip, netmask, script, current, running):
+    """Compare the requested configuration with the current one.
+
+    Args:
+        current: addresses of the interface, see addresses().
+        running: if the dhcp client of the interface is alive.
+
+    Returns:
+        A tuple of (stop dhclient, "ip" commands, start dhclient), nothing
+        to do if all are empty.
+    """
+    if dhcpc:
+        if running and _dhclient_scripts.get(iface) == script:
+            return False, [], False
+        # static addresses are left only if the client was not running
+        flush = [["-4", "addr", "flush", "label", iface]] \
+            if current and not running else []
+        return running, flush, True
+
+    desired = None
+    if ip:
+        _, _, broadcast, prefix = netcalc.calc(ip, netmask)
+        desired = (ip, prefix)
+    if running:
+        # the leased addresses are removed by "dhclient -r"
+        current = [addr for addr in current if not addr["dynamic"]]
+    # a leftover lease would expire, it is replaced by a static one
+    keep = [addr for addr in current if not addr["dynamic"] and
+            (addr["ip"], addr["prefix"]) == desired]
+    stale = [addr for addr in current if addr not in keep]
+
+    commands = []
+    if stale and not keep:
+        commands.append(["-4", "addr", "flush", "label", iface])
+    else:
+        for addr in stale:
+            commands.append(["addr", "del", "%s/%d" % (
+                addr["ip"], addr["prefix"]), "dev", iface])
+    if desired and not keep:
+        commands.append(["addr", "add", "%s/%d" % desired, "broadcast",
+                         broadcast, "dev", iface])
+    return running, commands, False
+
+
+def _apply(plans):
+    """Apply the plans of _plan() by interface, "ip" commands of all
+    interfaces are run in one batch.
+
+    Returns:
+        A dict of interface names and if anything was changed.
+    """
+    commands = []
+    for iface, (stop, cmds, _, _) in plans.iteritems():
+        if stop:
+            _dhclient_stop(iface)
+        commands += cmds
+
     try:
-        sh.dhclient("-r", "-pf", pid_file, iface)
+        if 1 == len(commands):
+            process.run("ip", *commands[0])
+        elif commands:
+            route.batch(commands)
     except Exception as e:
-        _logger.info("Failed to stop dhclient: %s" % e)
-        pass
+        _logger.info("Failed to configure addresses: %s" % e)
+        raise ValueError("Cannot update the addresses for \"%s\"."
+                         % "\", \"".join(sorted(plans.keys())))
 
-    if enable:
-        if script:
-            sh.dhclient("-pf", pid_file, "-nw", "-sf", script, iface)
-        else:
-            sh.dhclient("-pf", pid_file, "-nw", iface)
+    for iface, (_, _, start, script) in plans.iteritems():
+        if start:
+            _dhclient_start(iface, script)
+    return dict((iface, any(plan[:3])) for iface, plan in plans.iteritems())
 
 
 def ifconfig(iface, dhcpc, ip="", netmask="24", gateway="", script=None):
     """Set the interface to static IP or dynamic IP (by dhcpclient).
 
+    Only the difference from the current addresses and dhcp client is
+    applied: nothing is done if the interface is already configured.
+
     Args:
         iface: interface name.
         dhcpc: True for using dynamic IP and False for static.
@@ -145,33 +314,49 @@ def ifconfig(iface, dhcpc, ip="", netmask="24", gateway="", script=None):
         netmask:
         gateway:
 
+    Returns:
+        True if the interface was changed.
+
     Raises:
         ValueError
     """
-    # TODO(aeluin) catch the exception?
-    # Check if interface exist
-    try:
-        sh.ip("addr", "show", iface)
-    except sh.ErrorReturnCode_1:
-        raise ValueError("Device \"%s\" does not exist." % iface)
-    except:
-        raise ValueError("Unknown error for \"%s\"." % iface)
+    plan = _plan(iface, dhcpc, ip, netmask, script, addresses(iface),
+                 dhclient_running(iface))
+    return _apply({iface: plan + (script,)})[iface]
 
-    # Disable the dhcp client and flush interface
-    dhclient(iface, False)
 
-    try:
-        sh.ip("-4", "addr", "flush", "label", iface)
-    except:
-        raise ValueError("Unknown error for \"%s\"." % iface)
+def ifconfig_batch(configs):
+    """Configure many interfaces with one "ip" command for the addresses.
 
-    if dhcpc:
-        dhclient(iface, True, script)
-    else:
-        if ip:
-            net = ipcalc.Network("%s/%s" % (ip, netmask))
-            sh.ip("addr", "add", "%s/%s" % (ip, net.netmask()), "broadcast",
-                  net.broadcast(), "dev", iface)
+    Args:
+        configs: a list of dict with the arguments of ifconfig(), for
+            example:
+
+            [{"iface": "eth0", "dhcpc": True},
+             {"iface": "eth1", "dhcpc": False, "ip": "192.168.4.127",
+              "netmask": "255.255.255.0"}]
+
+    Returns:
+        A dict of interface names and if the interface was changed.
+
+    Raises:
+        ValueError
+    """
+    ifaces = interfaces()
+    for config in configs:
+        if config["iface"] not in ifaces:
+            raise ValueError("Device \"%s\" does not exist." % config["iface"])
+
+    current = addresses()
+    plans = {}
+    for config in configs:
+        iface = config["iface"]
+        script = config.get("script")
+        plans[iface] = _plan(
+            iface, config["dhcpc"], config.get("ip", ""),
+            config.get("netmask", "24"), script, current.get(iface, []),
+            dhclient_running(iface)) + (script,)
+    return _apply(plans)
 
 
 if __name__ == "__main__":
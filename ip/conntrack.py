@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import re
+
+import process
+
+
+_count_regex = re.compile(r"(\d+) flow entries have been")
+
+# seconds allowed to delete the entries of a large table
+TIMEOUT = 30
+
+
+def _family(family):
+    return "ipv6" if 6 == family else "ipv4"
+
+
+def _count(result):
+    match = _count_regex.search(result.stderr)
+    return int(match.group(1)) if match else 0
+
+
+def delete(reply_dst, family=4):
+    """Delete the connection tracking entries whose reply direction is
+    destined to "reply_dst", i.e. the flows masqueraded to the address.
+    Entries are matched and deleted through ctnetlink by conntrack(8), the
+    other entries are left as is.
+
+    Args:
+        reply_dst: address of the reply direction.
+        family: 4 for IPv4 and 6 for IPv6.
+
+    Returns:
+        Number of deleted entries.
+    """
+    return _count(process.run(
+        "conntrack", "-D", "-f", _family(family), "--reply-dst", reply_dst,
+        timeout=TIMEOUT, ok=(0, 1)))
+
+
+def _masked(value):
+    """Match or set only the bits of "value", the other bits of the mark
+    are left to other users.
+    """
+    return "%#x/%#x" % (value, value)
+
+
+def mark(reply_dst, value, family=4):
+    """Set the bits "value" of the connection mark of the entries whose
+    reply direction is destined to "reply_dst".
+
+    Returns:
+        Number of updated entries.
+    """
+    return _count(process.run(
+        "conntrack", "-U", "-f", _family(family), "--reply-dst", reply_dst,
+        "--mark", _masked(value), timeout=TIMEOUT, ok=(0, 1)))
+
+
+def count(value, family=4):
+    """Number of the entries with the bits "value" of the connection mark.
+    """
+    return _count(process.run(
+        "conntrack", "-L", "-f", _family(family), "--mark", _masked(value),
+        timeout=TIMEOUT, ok=(0, 1)))
+
+
+def _restore_rule(chain, iface, value):
+    rule = ["!", "-i", iface] if "PREROUTING" == chain else []
+    return rule + ["-j", "CONNMARK", "--restore-mark", "--mask", "%#x" % value]
+
+
+def restore_mark(enable, iface, value):
+    """Add or remove the iptables rules copying the bits "value" of the
+    connection mark to the packets (forwarded and local), so that they can
+    be routed by fwmark.
+
+    Packets entering from "iface" are not marked: the replies of the marked
+    flows are de-NATed to the LAN clients there, and must be routed by the
+    main table instead of back through "iface".
+    """
+    for chain in ["PREROUTING", "OUTPUT"]:
+        rule = _restore_rule(chain, iface, value)
+        if enable:
+            process.run("iptables", "-t", "mangle", "-I", chain, "1", *rule)
+        else:
+            # exit code 1 if the rule does not exist
+            process.run("iptables", "-t", "mangle", "-D", chain, *rule,
+                        ok=(0, 1))
+
+
+def clear_restore_mark(value):
+    """Remove the rules of restore_mark() for "value" of any interface,
+    e.g. left by a crash.
+
+    Returns:
+        Number of removed rules.
+    """
+    removed = 0
+    for chain in ["PREROUTING", "OUTPUT"]:
+        for line in process.run("iptables", "-t", "mangle", "-S", chain):
+            rule = line.split()
+            if rule[:2] != ["-A", chain] or "--restore-mark" not in rule or \
+                    "%#x" % value not in rule:
+                continue
+            process.run("iptables", "-t", "mangle", "-D", *rule[1:],
+                        ok=(0, 1))
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    print delete("192.0.2.1")
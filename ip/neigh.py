@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import process
+
+
+# states the kernel sends packets with at once, without waiting on ARP
+USABLE_STATES = ["PERMANENT", "NOARP", "REACHABLE", "DELAY", "PROBE"]
+
+
+def show(dev=None):
+    """List IPv4 neighbor entries.
+
+    Args:
+        dev: interface name, all interfaces if not given.
+
+    Returns:
+        A list of dict for each entry. For example:
+
+        [
+            {"ip": "192.168.3.254",
+                "dev": "eth0",
+                "lladdr": "00:0c:29:00:00:01",
+                "state": "REACHABLE"}
+        ]
+    """
+    args = ["ip", "-4", "neigh", "show"]
+    if dev:
+        args += ["dev", dev]
+    entries = []
+    for line in process.run(*args):
+        fields = line.split()
+        if not fields:
+            continue
+        entry = {"ip": fields[0], "dev": dev or "", "lladdr": "",
+                 "state": fields[-1]}
+        if "dev" in fields:
+            entry["dev"] = fields[fields.index("dev")+1]
+        if "lladdr" in fields:
+            entry["lladdr"] = fields[fields.index("lladdr")+1]
+        entries.append(entry)
+    return entries
+
+
+def usable(entry):
+    """Check if a neighbor entry is resolved and not stale.
+    """
+    return bool(entry) and entry["state"] in USABLE_STATES
+
+
+if __name__ == "__main__":
+    print show()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import socket
+import struct
+
+# IPv4 address math on packed 32-bit integers, used instead of ipcalc on the
+# hot paths of ip.addr.
+
+_CACHE_SIZE = 1024
+_cache = {}
+
+
+def ip2int(ip):
+    """Convert dotted IPv4 address to integer.
+
+    Raises:
+        ValueError: invalid IPv4 address.
+    """
+    try:
+        return struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0]
+    except (socket.error, TypeError):
+        raise ValueError("Invalid IPv4 address \"%s\"." % ip)
+
+
+def int2ip(value):
+    """Convert integer to dotted IPv4 address.
+    """
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def prefix2netmask(prefix):
+    """Convert prefix length to netmask in integer.
+
+    Raises:
+        ValueError: invalid prefix length.
+    """
+    prefix = int(prefix)
+    if prefix < 0 or prefix > 32:
+        raise ValueError("Invalid prefix length \"%s\"." % prefix)
+    return (0xffffffff << (32 - prefix)) & 0xffffffff
+
+
+def netmask2prefix(netmask):
+    """Convert netmask in integer to prefix length.
+
+    Raises:
+        ValueError: non-contiguous netmask.
+    """
+    inverted = ~netmask & 0xffffffff
+    if inverted & (inverted + 1):
+        raise ValueError("Invalid netmask \"%s\"." % int2ip(netmask))
+    return 32 - bin(inverted).count("1")
+
+
+def to_netmask(netmask):
+    """Convert netmask in prefix length or dotted format to integer.
+    """
+    netmask = str(netmask)
+    if "." in netmask:
+        value = ip2int(netmask)
+        netmask2prefix(value)
+        return value
+    return prefix2netmask(netmask)
+
+
+def cidr(value):
+    """Validate an IPv4 address with an optional prefix length, e.g.
+    "192.168.10.0/24".
+
+    Raises:
+        ValueError: invalid address or prefix length.
+    """
+    ip, sep, prefix = str(value).partition("/")
+    ip2int(ip)
+    if not sep:
+        return ip
+    if not prefix.isdigit():
+        raise ValueError("Invalid prefix length \"%s\"." % prefix)
+    prefix2netmask(prefix)
+    return "%s/%d" % (ip, int(prefix))
+
+
+def calc(ip, netmask):
+    """Calculate the subnet information, results are memoized.
+
+    Args:
+        ip: IPv4 address.
+        netmask: netmask in prefix length or dotted format.
+
+    Returns:
+        A tuple of (network, netmask, broadcast, prefix). For example:
+
+        ("192.168.31.0", "255.255.255.0", "192.168.31.255", 24)
+
+    Raises:
+        ValueError
+    """
+    key = (ip, netmask)
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+
+    addr = ip2int(ip)
+    mask = to_netmask(netmask)
+    net = addr & mask
+    result = (int2ip(net), int2ip(mask), int2ip(net | (~mask & 0xffffffff)),
+              netmask2prefix(mask))
+
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    _cache[key] = result
+    return result
+
+
+def network(ip, netmask):
+    return calc(ip, netmask)[0]
+
+
+def broadcast(ip, netmask):
+    return calc(ip, netmask)[2]
+
+
+def contains(ip, netmask, addr):
+    """Check if "addr" is in the subnet of "ip" and "netmask".
+    """
+    mask = to_netmask(netmask)
+    return (ip2int(ip) & mask) == (ip2int(addr) & mask)
+
+
+if __name__ == "__main__":
+    print calc("192.168.31.36", "255.255.255.0")
+    print calc("10.0.0.1", "8")
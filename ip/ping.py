@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import re
+
+import process
+
+
+_rtt_regex = re.compile(r"time[=<]([\d.]+) ?ms")
+
+
+def ping(iface, target, timeout=1):
+    """Send one ICMP echo request through the interface.
+
+    The socket is bound to the interface: a target without a route through
+    the interface is taken as on-link by the kernel.
+
+    Args:
+        iface: interface name to send the request from.
+        target: address to be probed.
+        timeout: seconds to wait for the reply.
+
+    Returns:
+        Round-trip time in milliseconds, None if lost.
+    """
+    try:
+        output = process.run("ping", "-n", "-c", "1", "-W", int(timeout),
+                             "-I", iface, target, timeout=timeout + 1)
+    except process.CommandError:
+        return None
+
+    match = _rtt_regex.search(str(output))
+    if not match:
+        return None
+    return float(match.group(1))
+
+
+if __name__ == "__main__":
+    print ping("lo", "127.0.0.1")
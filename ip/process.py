@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+import signal
+import logging
+import subprocess
+from threading import Lock
+from threading import Timer
+from time import time
+
+import spawn
+
+
+_logger = logging.getLogger("sanji.route.ip.process")
+
+# default deadline of a command in seconds
+TIMEOUT = 5
+
+_lock = Lock()
+# { "ip route": [count, errors, timeouts, total seconds, max seconds] }
+_stats = {}
+# commands are forked from the spawner if started
+_spawner = None
+
+
+class Result(object):
+    """Result of a finished command.
+
+    Like the output of "sh", str() gives stdout and iterating gives the lines
+    of stdout.
+    """
+
+    def __init__(self, args, exit_code, stdout="", stderr="", duration=0,
+                 timed_out=False):
+        self.args = args
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+
+    def __str__(self):
+        return self.stdout
+
+    def __iter__(self):
+        return iter(self.stdout.splitlines())
+
+    def to_dict(self):
+        return {
+            "args": self.args,
+            "exitCode": self.exit_code,
+            "stderr": self.stderr,
+            "duration": round(self.duration * 1000, 3),
+            "timedOut": self.timed_out
+        }
+
+
+class CommandError(Exception):
+    """The command exited with an unexpected code, see "result".
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.exit_code = result.exit_code
+        self.stderr = result.stderr
+        super(CommandError, self).__init__(self._message())
+
+    def _message(self):
+        return "\"{}\" exited with {}: {}".format(
+            " ".join(self.result.args), self.exit_code, self.stderr.strip())
+
+
+class CommandTimeout(CommandError):
+    """The command was killed after its deadline.
+    """
+
+    def _message(self):
+        return "\"{}\" timed out after {:.3f}s".format(
+            " ".join(self.result.args), self.result.duration)
+
+
+def _name(args):
+    """Statistics key of a command: the program, with the object for "ip",
+    e.g. "ip route".
+    """
+    name = os.path.basename(args[0])
+    if "ip" == name:
+        for arg in args[1:]:
+            if not arg.startswith("-"):
+                return "ip " + arg
+    return name
+
+
+def _record(name, duration, error, timed_out):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = [0, 0, 0, 0.0, 0.0]
+            _stats[name] = stat
+        stat[0] += 1
+        stat[1] += 1 if error else 0
+        stat[2] += 1 if timed_out else 0
+        stat[3] += duration
+        stat[4] = max(stat[4], duration)
+
+
+def _kill(proc, killed):
+    """Kill the process group of the command, so that the children (e.g. a
+    pipeline of "sh -c") are also stopped.
+    """
+    killed.append(True)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _execute(args, data, timeout):
+    """Fork and wait for the command, kill its process group after
+    "timeout" seconds.
+
+    Returns:
+        (exit code, stdout, stderr, duration, timed out)
+    """
+    start = time()
+    proc = subprocess.Popen(
+        args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+
+    killed = []
+    timer = Timer(timeout, _kill, [proc, killed])
+    timer.daemon = True
+    timer.start()
+    try:
+        stdout, stderr = proc.communicate(data)
+    finally:
+        timer.cancel()
+    return proc.returncode, stdout, stderr, time() - start, bool(killed)
+
+
+def start_spawner():
+    """Fork the spawner, commands are launched from it afterwards. Call it
+    before importing the heavy modules to keep the spawner small.
+    """
+    global _spawner
+    if _spawner is None:
+        _spawner = spawn.Spawner(_execute)
+        _spawner.start()
+
+
+def stop_spawner():
+    global _spawner
+    if _spawner is not None:
+        _spawner.stop()
+        _spawner = None
+
+
+def run(*args, **kwargs):
+    """Run a command and wait for at most "timeout" seconds.
+
+    Args:
+        args: the command and its arguments.
+        timeout: deadline in seconds, TIMEOUT if not given.
+        input: data written to stdin.
+        ok: exit codes considered successful, (0,) if not given.
+        name: key of the statistics, see _name() if not given.
+
+    Returns:
+        Result
+
+    Raises:
+        CommandTimeout: killed after the deadline.
+        CommandError: exited with a code not in "ok", or the spawner
+            exited with the command in progress (exit code -1).
+        OSError: failed to start the command.
+    """
+    timeout = kwargs.get("timeout", TIMEOUT)
+    ok = kwargs.get("ok", (0,))
+    data = kwargs.get("input")
+    args = [str(arg) for arg in args]
+    name = kwargs.get("name") or _name(args)
+
+    start = time()
+    try:
+        spawner = _spawner
+        if spawner is None:
+            exit_code, stdout, stderr, _, timed_out = \
+                _execute(args, data, timeout)
+        else:
+            try:
+                exit_code, stdout, stderr, _, timed_out = \
+                    spawner.execute(args, data, timeout)
+            except spawn.SpawnerError as e:
+                # not delivered, the command did not run
+                _logger.warning("{}, fork directly.".format(e))
+                exit_code, stdout, stderr, _, timed_out = \
+                    _execute(args, data, timeout)
+    except OSError:
+        _record(name, time() - start, True, False)
+        raise
+    except spawn.SpawnerLost as e:
+        # the command may have run, never run it twice
+        duration = time() - start
+        _record(name, duration, True, False)
+        raise CommandError(Result(args, -1, "", str(e), duration))
+    duration = time() - start
+
+    result = Result(args, exit_code, stdout, stderr, duration, timed_out)
+    error = timed_out or exit_code not in ok
+    _record(name, duration, error, timed_out)
+    if timed_out:
+        _logger.warning("Command killed after {}s: {}".format(
+            timeout, " ".join(args)))
+        raise CommandTimeout(result)
+    if error:
+        raise CommandError(result)
+    return result
+
+
+def stream(*args):
+    """Run a long-lived command and yield the lines of its stdout until it
+    exits. The process group is killed when the generator is closed.
+    """
+    args = [str(arg) for arg in args]
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=devnull, close_fds=True,
+            preexec_fn=os.setsid)
+    try:
+        for line in iter(proc.stdout.readline, ""):
+            yield line.rstrip("\n")
+    finally:
+        if proc.poll() is None:
+            _kill(proc, [])
+        proc.wait()
+
+
+def stats():
+    """Latency statistics per command.
+
+    Returns:
+        dict format of statistics in milliseconds, for example:
+
+        {"ip route": {"count": 3, "errors": 0, "timeouts": 0,
+                      "avg": 1.52, "max": 2.01}}
+    """
+    with _lock:
+        items = [(name, list(stat)) for name, stat in _stats.iteritems()]
+    data = {}
+    for name, (count, errors, timeouts, total, longest) in items:
+        data[name] = {
+            "count": count,
+            "errors": errors,
+            "timeouts": timeouts,
+            "avg": round(total / count * 1000, 3) if count else 0,
+            "max": round(longest * 1000, 3)
+        }
+    return data
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+if __name__ == "__main__":
+    print run("ip", "route", "show").to_dict()
+    print stats()
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
-import sh
+import process
 
 
-def show():
+def show(table=None, family=4):
     """List all routing rules.
 
+    Args:
+        table: routing table ID, "main" table if not given.
+        family: 4 for IPv4 and 6 for IPv6.
+
     Returns:
         A list of dict for each routing rule.
 
@@ -18,7 +22,11 @@ def show():
         ]
     """
     rules = []
-    routes = sh.ip("route", "show")
+    args = ["-6"] if 6 == family else []
+    args += ["route", "show"]
+    if table:
+        args += ["table", table]
+    routes = process.run("ip", *args)
     for route in routes:
         rule = dict()
         route = route.split()
@@ -27,6 +35,8 @@ def show():
             if "via" in route:
                 rule["default"] = route[route.index("via")+1]
             rule["dev"] = route[route.index("dev")+1]
+            if "metric" in route:
+                rule["metric"] = int(route[route.index("metric")+1])
         else:
             rule["dest"] = route[0]
             rule["dev"] = route[route.index("dev")+1]
@@ -42,42 +52,160 @@ def show():
     return rules
 
 
-def add(dest, dev="", src=""):
-    """Add a routing rule.
+def command(action, dest, dev="", src="", table=None, family=4,
+            metric=None):
+    """Arguments of "ip" for a routing rule.
 
     Args:
+        action: "add", "replace" or "del".
         dest: destination for the routing rule, default for default route.
         dev: routing device, could be empty
         src: source for the routing rule, fill "gateway" if dest is "default"
+        table: routing table ID, "main" table if not given.
+        family: 4 for IPv4 and 6 for IPv6.
+        metric: route metric, kernel default if not given.
 
-    Raises:
-        FIXME
+    Returns:
+        A list of arguments. For example:
+
+        ["route", "add", "default", "dev", "eth0", "via", "192.168.3.254"]
     """
+    args = ["-6"] if 6 == family else []
+    args += ["route", action, dest]
     if "" == src:
-        sh.ip("route", "add", dest, "dev", dev)
+        if dev:
+            args += ["dev", dev]
     elif "default" == dest:
         if dev:
-            sh.ip("route", "add", dest, "dev", dev, "via", src)
-        else:
-            sh.ip("route", "add", dest, "via", src)
+            args += ["dev", dev]
+        args += ["via", src]
     else:
-        sh.ip("route", "add", dest, "dev", dev, "proto", "kernel", "scope",
-              "link", "src", src)
+        args += ["dev", dev, "proto", "kernel", "scope", "link", "src", src]
+    if table:
+        args += ["table", str(table)]
+    if metric:
+        args += ["metric", str(metric)]
+    return args
+
+
+def add(dest, dev="", src="", table=None, family=4):
+    """Add a routing rule.
+
+    Args:
+        dest: destination for the routing rule, default for default route.
+        dev: routing device, could be empty
+        src: source for the routing rule, fill "gateway" if dest is "default"
+        table: routing table ID, "main" table if not given.
+        family: 4 for IPv4 and 6 for IPv6.
+
+    Raises:
+        FIXME
+    """
+    process.run("ip", *command("add", dest, dev, src, table, family))
+
 
+def replace(dest, dev="", src="", table=None, family=4, metric=None):
+    """Add a routing rule, or replace the one with the same destination
+    (and metric).
 
-def delete(network="default"):
+    Args: see command().
+    """
+    process.run("ip", *command("replace", dest, dev, src, table, family,
+                               metric))
+
+
+def delete(network="default", table=None, family=4, metric=None):
     """Delete a routing rule.
 
     Args:
         network: destination of the routing rule to be delete
+        table: routing table ID, "main" table if not given.
+        family: 4 for IPv4 and 6 for IPv6.
+        metric: only the rule with the metric if given.
 
     Raises:
         FIXME
     """
+    args = ["-6"] if 6 == family else []
+    args += ["route", "del", network]
+    if table:
+        args += ["table", table]
+    if metric:
+        args += ["metric", str(metric)]
+    # exit code 2 if the route does not exist
+    process.run("ip", *args, ok=(0, 2))
+
+
+def batch(commands):
+    """Run routing/rule/address commands in one "ip -batch" session. All
+    commands are tried even if some of them failed.
+
+    Args:
+        commands: a list of "ip" arguments. For example:
+
+        [["route", "replace", "default", "via", "192.168.3.254",
+          "table", "100"],
+         ["rule", "add", "from", "192.168.10.0/24", "table", "100"]]
+
+    Raises:
+        ValueError: an argument is empty or has whitespace, which would
+            split or add commands of the batch, or some of the commands
+            failed.
+    """
+    if not commands:
+        return
+    commands = [[str(arg) for arg in cmd] for cmd in commands]
+    for cmd in commands:
+        for arg in cmd:
+            if not arg or len(arg.split()) != 1 or arg.strip() != arg:
+                raise ValueError("Invalid batch argument %r." % arg)
+    lines = "\n".join(" ".join(cmd) for cmd in commands)
     try:
-        sh.ip("route", "del", network)
-    except sh.ErrorReturnCode_2:
-        pass
+        process.run("ip", "-force", "-batch", "-", input=lines + "\n")
+    except process.CommandError as e:
+        raise ValueError("Batch failed: %s" % (e.stderr.strip() or e))
+
+
+def parse_event(line):
+    """Parse a line of "ip monitor route" for default routes of "main" table.
+
+    Returns:
+        None if not a default route of "main" table, or a dict:
+
+        {"action": "add", "family": 4, "default": "192.168.3.254",
+            "dev": "eth0"}
+    """
+    route = line.split()
+    action = "add"
+    if route and "Deleted" == route[0]:
+        action = "del"
+        route = route[1:]
+    if not route or "default" != route[0]:
+        return None
+    if "table" in route and "main" != route[route.index("table")+1]:
+        return None
+
+    event = {"action": action, "family": 4, "default": "", "dev": ""}
+    if "via" in route:
+        event["default"] = route[route.index("via")+1]
+        if ":" in event["default"]:
+            event["family"] = 6
+    if "dev" in route:
+        event["dev"] = route[route.index("dev")+1]
+    return event
+
+
+def monitor():
+    """Watch changes of default routes in "main" table, block until the
+    monitor exits.
+
+    Yields:
+        Events from parse_event().
+    """
+    for line in process.stream("ip", "monitor", "route"):
+        event = parse_event(line)
+        if event:
+            yield event
 
 
 if __name__ == "__main__":
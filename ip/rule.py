@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import process
+
+
+def show():
+    """List all routing policy rules.
+
+    Returns:
+        A list of dict for each rule.
+
+        [
+            {"priority": 0, "from": "all", "table": "local"},
+            {"priority": 1000,
+                "from": "192.168.10.0/24",
+                "iif": "eth2",
+                "table": "100"}
+        ]
+    """
+    rules = []
+    for line in process.run("ip", "rule", "show"):
+        line = line.split()
+        if not line:
+            continue
+        rule = {"priority": int(line[0].rstrip(":"))}
+        for key, value in zip(line[1:], line[2:]):
+            if key in ["from", "to", "iif", "oif", "fwmark"]:
+                rule[key] = value
+            elif key in ["lookup", "table"]:
+                rule["table"] = value
+        rules.append(rule)
+    return rules
+
+
+def command(action, table, priority=None, src=None, iif=None, fwmark=None,
+            oif=None):
+    """Arguments of "ip" for a routing policy rule.
+
+    Args:
+        action: "add" or "del".
+        table: routing table ID for the matched packets.
+        priority: rule priority, assigned by kernel if not given.
+        src: source prefix, "all" if not given.
+        iif: incoming interface.
+        fwmark: firewall mark.
+        oif: outgoing interface, matched by the sockets bound to it.
+
+    Returns:
+        A list of arguments. For example:
+
+        ["rule", "add", "from", "192.168.10.0/24", "table", "100"]
+    """
+    args = ["rule", action, "from", src if src else "all"]
+    if iif:
+        args += ["iif", iif]
+    if oif:
+        args += ["oif", oif]
+    if fwmark:
+        args += ["fwmark", str(fwmark)]
+    if priority:
+        args += ["priority", str(priority)]
+    args += ["table", str(table)]
+    return args
+
+
+def add(table, priority=None, src=None, iif=None, fwmark=None, oif=None):
+    """Add a routing policy rule.
+
+    Raises:
+        FIXME
+    """
+    process.run("ip", *command("add", table, priority, src, iif, fwmark,
+                               oif))
+
+
+def delete(table, priority=None, src=None, iif=None, fwmark=None, oif=None):
+    """Delete a routing policy rule, ignore if not exist.
+    """
+    process.run("ip", *command("del", table, priority, src, iif, fwmark,
+                               oif), ok=(0, 2))
+
+
+if __name__ == "__main__":
+    print show()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import os
+import json
+import fcntl
+import socket
+import logging
+from itertools import count
+from threading import Event
+from threading import Lock
+from threading import Thread
+from threading import Timer
+
+
+_logger = logging.getLogger("sanji.route.ip.spawn")
+
+
+class SpawnerError(Exception):
+    """The request was not delivered to the server, the command did not
+    run.
+    """
+    pass
+
+
+class SpawnerLost(Exception):
+    """The request was delivered but no reply came back, the command may
+    have run.
+    """
+    pass
+
+
+class Spawner(object):
+    """
+    Fork server for external commands.
+
+    Forking the bundle for each command copies the page tables of the whole
+    interpreter (sanji, paho-mqtt, voluptuous...). start() forks a small
+    server process once, ideally before the heavy imports, and the commands
+    are forked from the server instead.
+
+    The server is only reachable through a socket pair created before the
+    fork, no other process can connect to it. Requests and replies are lines
+    of JSON tagged by an "id", served concurrently; the server exits when
+    the bundle closes its end.
+
+    Args:
+        execute: function(args, input, timeout) run by the server, returns
+            (exit code, stdout, stderr, duration, timed out).
+    """
+
+    # seconds to wait for the server over the command deadline
+    GRACE = 1
+
+    def __init__(self, execute):
+        self._execute = execute
+        self.pid = None
+        self._sock = None
+        self._ids = count(1)
+        # { id: [Event, reply] }
+        self._pending = {}
+        self._lock = Lock()
+        self._send_lock = Lock()
+
+    def running(self):
+        return self._sock is not None
+
+    def start(self):
+        sock, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        # not inherited by the commands forked from the bundle
+        flags = fcntl.fcntl(sock.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+        pid = os.fork()
+        if 0 == pid:
+            sock.close()
+            try:
+                self._serve(server)
+            finally:
+                os._exit(0)
+
+        server.close()
+        self.pid = pid
+        self._sock = sock
+        receiver = Thread(target=self._receive, args=(sock,))
+        receiver.daemon = True
+        receiver.start()
+
+    def stop(self):
+        sock = self._sock
+        if sock is None:
+            return
+        self._closed(sock)
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = None
+
+    def _closed(self, sock):
+        """Stop using the socket, the server exits on EOF; the pending
+        requests are woken up without reply.
+        """
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+            pending = self._pending.values()
+            self._pending = {}
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        for waiter in pending:
+            waiter[0].set()
+
+    def execute(self, args, input=None, timeout=None):
+        """Run a command by the server, see "execute" of the constructor.
+
+        Raises:
+            SpawnerError: the server is unavailable, the command did not
+                run.
+            SpawnerLost: no reply from the server, the command may have run.
+            OSError: failed to start the command.
+        """
+        request_id = next(self._ids)
+        waiter = [Event(), None]
+        with self._lock:
+            sock = self._sock
+            if sock is None:
+                raise SpawnerError("Spawner is not running.")
+            self._pending[request_id] = waiter
+        request = json.dumps({"id": request_id, "args": args, "input": input,
+                              "timeout": timeout})
+        try:
+            # the server runs a request only once its newline is received
+            with self._send_lock:
+                sock.sendall(request + "\n")
+        except socket.error as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise SpawnerError("Spawner failed: {}".format(e))
+
+        # Event.wait(timeout) polls on Python 2, a timer wakes it up instead
+        timer = None
+        if timeout:
+            timer = Timer(timeout + self.GRACE, waiter[0].set)
+            timer.daemon = True
+            timer.start()
+        waiter[0].wait()
+        if timer:
+            timer.cancel()
+        with self._lock:
+            self._pending.pop(request_id, None)
+        reply = waiter[1]
+        if reply is None:
+            raise SpawnerLost("No reply from spawner: {}".format(
+                " ".join(args)))
+        if "errno" in reply:
+            raise OSError(reply["errno"], reply["error"])
+        if "error" in reply:
+            raise SpawnerLost("Spawner failed: {}".format(reply["error"]))
+        return (reply["exitCode"], reply["stdout"].encode("utf-8"),
+                reply["stderr"].encode("utf-8"), reply["duration"],
+                reply["timedOut"])
+
+    def _receive(self, sock):
+        """Dispatch the replies to the waiting requests until EOF.
+        """
+        try:
+            for line in iter(sock.makefile("r").readline, ""):
+                reply = json.loads(line)
+                with self._lock:
+                    waiter = self._pending.get(reply.get("id"))
+                if waiter:
+                    waiter[1] = reply
+                    waiter[0].set()
+        except Exception as e:
+            _logger.warning("Spawner connection failed: {}".format(e))
+        self._closed(sock)
+        sock.close()
+
+    def _serve(self, sock):
+        lock = Lock()
+        for line in iter(sock.makefile("r").readline, ""):
+            if not line.endswith("\n"):
+                break
+            handler = Thread(target=self._handle, args=(sock, lock, line))
+            handler.daemon = True
+            handler.start()
+
+    def _handle(self, sock, lock, line):
+        try:
+            request = json.loads(line)
+            data = request["input"]
+            try:
+                exit_code, stdout, stderr, duration, timed_out = \
+                    self._execute([str(arg) for arg in request["args"]],
+                                  data.encode("utf-8") if data else data,
+                                  request["timeout"])
+                reply = {
+                    "exitCode": exit_code,
+                    "stdout": stdout.decode("utf-8", "replace"),
+                    "stderr": stderr.decode("utf-8", "replace"),
+                    "duration": duration,
+                    "timedOut": timed_out
+                }
+            except OSError as e:
+                reply = {"errno": e.errno, "error": e.strerror}
+            except Exception as e:
+                reply = {"error": str(e)}
+            reply["id"] = request["id"]
+            with lock:
+                sock.sendall(json.dumps(reply) + "\n")
+        except Exception as e:
+            _logger.warning("Failed to serve a command: {}".format(e))
@@ -2,64 +2,449 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import copy
 import logging
+from contextlib import contextmanager
+from itertools import count
+from multiprocessing.pool import ThreadPool
+from threading import Event
 from threading import Lock
+from threading import RLock
+from threading import Thread
+from threading import Timer
+from threading import local
 from time import sleep
+from time import time
 from sanji.model import Model
 import json
 import re
-import sh
 
 import ip
+import decision
+import resolv
+from engine import EventLoop
+from history import History
+from metrics import Metrics
+from quality import LinkQuality
+from ratelimit import Backoff
+from ratelimit import TokenBucket
+from tracing import Tracer
 
 
 _logger = logging.getLogger("sanji.route")
-_update_default_lock = Lock()
 
 
 class IPRouteError(Exception):
     pass
 
 
+# fields of an interface record that may change the routing decision
+ROUTING_FIELDS = ("gateway", "gateway6", "status", "wan", "alias")
+
+
+def _fingerprint(record):
+    """Routing relevant content of an interface record, None if empty.
+    """
+    if not record:
+        return None
+    return tuple(record.get(field) for field in ROUTING_FIELDS)
+
+
+def _diff(old, new):
+    """Field-level difference between two records.
+
+    Returns:
+        changes: dict format with changed "set" fields and "unset" field
+                 names, empty if nothing changed.
+                 {
+                   "set": {"gateway": "192.168.7.254"},
+                   "unset": ["dns"]
+                 }
+    """
+    changes = {}
+    _set = dict((k, v) for k, v in new.iteritems()
+                if k not in old or old[k] != v)
+    unset = [k for k in old if k not in new]
+    if _set:
+        changes["set"] = _set
+    if unset:
+        changes["unset"] = unset
+    return changes
+
+
+def _differs(current, default):
+    """Whether the default route "current" is not "default".
+    """
+    return current.get("interface", "") != default.get("interface", "") or \
+        current.get("gateway", "") != default.get("gateway", "")
+
+
 class IPRoute(Model):
     """
     A model to handle IP Route configuration.
 
     Attributes:
         model: database with json format.
+
+    Args:
+        engine: "thread" to converge in the caller's thread serialized by a
+                lock, or "loop" to converge in a single event loop thread.
+        history: file to append the default route transitions to, kept in
+                 memory only if not given.
+        drift: what to do if the default route is changed by others,
+               "enforce" to restore it, "adopt" to keep the change until the
+               interfaces or the priority list are changed, or "alert" to
+               report only.
+        conntrack: delete the conntrack entries of the previous WAN after a
+                   switch if True.
+        failback: "immediate" to move all flows to a recovered WAN with the
+                  default route, or "graceful" to keep the established flows
+                  on the previous WAN until they drain.
+        resolv_conf: resolver configuration file to write the DNS servers of
+                     the default WAN to, not managed if not given.
     """
 
+    DRIFT_POLICIES = ["enforce", "adopt", "alert"]
+    FAILBACK_MODES = ["immediate", "graceful"]
+
     UPDATE_INTERVAL = 60
+    # priority of policy rules is RULE_PRIORITY + table if not given
+    RULE_PRIORITY = 1000
+    # seconds a kernel default route read is reused before "ip route show"
+    # is forked again
+    DEFAULT_TTL = 5
+    # kernel default route mutations allowed per second and in a burst, and
+    # the backoff in seconds after failures
+    MUTATION_RATE = 1.0
+    MUTATION_BURST = 5
+    BACKOFF_BASE = 1
+    BACKOFF_MAX = 60
+    # interface names are resolved by mapping commands concurrently in up to
+    # MAPPING_WORKERS threads, each command is killed after MAPPING_TIMEOUT
+    # seconds
+    MAPPING_WORKERS = 4
+    MAPPING_TIMEOUT = 10
+    # seconds between refreshes of the standby WAN gateway neighbor entries
+    NEIGH_INTERVAL = 15
+    # graceful failback: flows of the previous WAN are marked by
+    # FAILBACK_MARK and routed by table FAILBACK_TABLE (rule priority
+    # FAILBACK_PRIORITY), until none is left or the timeout; checked every
+    # FAILBACK_CHECK seconds
+    FAILBACK_MARK = 0x100
+    FAILBACK_TABLE = 1000
+    FAILBACK_PRIORITY = 900
+    FAILBACK_TIMEOUT = 600
+    FAILBACK_CHECK = 10
+    # the quality "target" is probed through the gateway of each link by a
+    # table of the link from PROBE_TABLE, looked up after the main table by
+    # the probes bound to the link (rule priority PROBE_PRIORITY)
+    PROBE_TABLE = 1100
+    PROBE_PRIORITY = 40000
+    # metric of the IPv6 default route installed by the bundle, preferred
+    # over the ones learned from router advertisements (1024)
+    DEFAULT6_METRIC = 512
 
     def __init__(self, *args, **kwargs):
+        engine = kwargs.pop("engine", "thread")
+        history = kwargs.pop("history", None)
+        drift = kwargs.pop("drift", "enforce")
+        conntrack = kwargs.pop("conntrack", False)
+        failback = kwargs.pop("failback", "immediate")
+        resolv_conf = kwargs.pop("resolv_conf", None)
         super(IPRoute, self).__init__(*args, **kwargs)
 
         self._path = kwargs["path"]
 
-        """interface info. database
+        """interface info. database, replaced as a whole on update so that
+        readers can use it without lock
         {
           "interface": "wwan0",
           "actualIface": "ppp0",
           "gateway": "192.168.7.254",
+          "gateway6": "fe80::1",
           "status": true,
           "wan": true
         }
         """
         self._interfaces = {}
+        # IPv4 addresses of the interfaces seen by list_interfaces(), kept
+        # after the interface is down
+        # { "eth0": ["192.168.3.127"] }
+        self._addresses = {}
 
         # alias and real name mappings for interfaces
         # { "ppp0": "wwan0" }
         self._alias = {}
 
+        # serialize the writers of _interfaces
+        self._db_lock = Lock()
+        # serialize the kernel default route read-compare-write; the version
+        # of state applied by the latest convergence
+        self._lock = Lock()
+        self._applied_version = 0
+
         # find correct interface if shell command is required
         self._load_mappings(self._path)
         self._cmd_regex = re.compile(r"\$\(([\S\s]+)\)")
+        self._loop = EventLoop() if engine == "loop" else None
+        self._routes_dirty = False
+        self._metrics = Metrics()
+        self._tracer = Tracer()
+        self._history = History(path=history)
+        # trigger of the convergence running in the thread
+        self._context = local()
+
+        """policy routing, each policy has its own default route in table
+        [{
+          "table": 100,
+          "source": "192.168.10.0/24",
+          "priorityList": ["wwan0", "eth0"]
+        }]
+        """
+        self._policy = Model(name="policy", path=self._path)
+        # [(policy, ["ppp0", "eth0"])]
+        self._policy_routes = []
+        # applied default route per table: { 100: ("eth0", "192.168.3.254") }
+        self._policy_defaults = {}
+
+        """link quality mode, WAN links are probed periodically and the
+        default route is chosen by score if enabled; "target" is probed
+        through the gateway of each link (the main table routes it only
+        through the default WAN), the gateway itself if "target" is empty
+        {
+          "enable": false,
+          "target": "",
+          "interval": 10,
+          "timeout": 1,
+          "window": 16,
+          "alpha": 0.3,
+          "tolerance": 10,
+          "weights": {"rtt": 1, "jitter": 2, "loss": 5}
+        }
+        """
+        self._quality = Model(name="quality", path=self._path)
+        self._links = LinkQuality(**self._link_settings())
+        # probe route applied per link: { "eth1": (1100, "192.168.4.254") }
+        self._probe_routes = {}
+        self._stopped = Event()
+
+        """neighbor entries of the standby WAN gateways, refreshed by
+        _neigh_loop; replaced as a whole on update
+        {
+          "eth1": {
+            "gateway": "192.168.4.254",
+            "lladdr": "00:0c:29:00:00:01",
+            "state": "REACHABLE"
+          }
+        }
+        """
+        self._neighbors = {}
+        # wake _neigh_loop early when the gateways may have changed
+        self._neigh_wake = Event()
+
         self._routes = self._get_priority_list()
+        if self._policy.model.db:
+            try:
+                self._install_policy_rules(
+                    self._policy.model.db, self._policy.model.db)
+            except Exception as e:
+                _logger.warning("Failed to install policy rules: {}".format(e))
         self._wan_event_cb = None
+        self._delta_event_cb = None
+
+        # sequence number of published delta events
+        self._seq = 0
+        self._seq_lock = RLock()
+
+        # state version, increased whenever a served view may change; views
+        # are cached per version
+        # { ("iface", "eth0"): (3, {...}) }
+        self._version = 0
+        self._views = {}
+        self._version_lock = Lock()
+        self._default = None
+        self._default_ts = 0
+        # reads of the default route are numbered before forking, a slow
+        # read never overwrites the result of a later one
+        self._default_reads = count(1)
+        self._default_seq = 0
+        # IPv6 default route observed by the latest convergence
+        self._default6 = None
+        # available interfaces found by the latest convergence
+        self._available = None
+
+        # default route applied by the latest convergence, None before the
+        # first one; (interfaces, routes) the adopted default route is kept
+        # for; (route, interfaces, routes) the alerted route is left for
+        self._desired = None
+        self._adopted = None
+        self._alerted = None
+        if drift not in self.DRIFT_POLICIES:
+            raise IPRouteError("Invalid drift policy \"{}\".".format(drift))
+        self._drift_policy = drift
+        self._drift = {"detected": 0, "enforced": 0, "deferred": 0,
+                       "adopted": 0, "alerted": 0, "interfaces": {},
+                       "last": None}
+
+        # budget of kernel default route mutations; a convergence is deferred
+        # until the budget is available, with the latest state by then
+        self._bucket = TokenBucket(self.MUTATION_RATE, self.MUTATION_BURST)
+        self._backoff = Backoff(self.BACKOFF_BASE, self.BACKOFF_MAX)
+        self._deferred = None
+        self._defer_lock = Lock()
+
+        # delete the conntrack entries of the previous WAN after a switch
+        self._flush_conntrack = conntrack
+
+        """flows kept on the previous WAN by a graceful failback, None if
+        not in progress
+        {
+          "interface": "eth1",
+          "gateway": "192.168.4.254",
+          "since": 1500000000.0,
+          "flows": 12
+        }
+        """
+        if failback not in self.FAILBACK_MODES:
+            raise IPRouteError(
+                "Invalid failback mode \"{}\".".format(failback))
+        self._failback_mode = failback
+        self._failback_timeout = self.FAILBACK_TIMEOUT
+        self._grace = None
+        self._grace_timer = None
+        self._grace_lock = Lock()
+        self._clear_leftover()
+
+        # resolver configuration following the default WAN, and the content
+        # written by the latest update
+        self._resolv_conf = resolv_conf
+        self._resolv_content = None
+        self._resolv_lock = Lock()
 
     def set_wan_event_cb(self, cb):
         self._wan_event_cb = cb
 
+    def set_delta_event_cb(self, cb):
+        self._delta_event_cb = cb
+
+    def _publish_delta(self, changes):
+        """Publish field-level changes with a sequence number.
+
+        Args:
+            changes: array of changes, for example:
+                [{
+                  "type": "iface",
+                  "name": "wwan0",
+                  "set": {"status": false}
+                }]
+        """
+        with self._seq_lock:
+            self._seq += 1
+            if not self._delta_event_cb:
+                return
+            try:
+                with self._metrics.timer(
+                        "route_publish_seconds", event="delta"):
+                    self._delta_event_cb(
+                        {"seq": self._seq, "changes": changes})
+            except Exception as e:
+                _logger.debug("Failed to publish delta: {}".format(e))
+
+    def get_snapshot(self):
+        """Full state for clients to resync their mirrors.
+        """
+        with self._seq_lock:
+            default = self.get_default()
+            return {
+                "seq": self._seq,
+                "default": default,
+                "interfaces": self.get_iface_db()
+            }
+
+    def _bump_version(self):
+        # bumped from the handler, watch, neighbor and convergence threads
+        with self._version_lock:
+            self._version += 1
+            self._views = {}
+
+    def get_version(self):
+        """Current state version, refresh the default route if expired.
+        """
+        self._current_default()
+        return self._version
+
+    def _cached_view(self, key, build):
+        """Return a copy of the view built by "build" for current version.
+        """
+        version = self._version
+        view = self._views.get(key)
+        if view is None or view[0] != version:
+            view = (version, build())
+            self._views[key] = view
+        return copy.deepcopy(view[1])
+
+    def _observe_default6(self, default):
+        if default != self._default6:
+            prev = self._default6
+            self._default6 = default
+            self._bump_version()
+            if prev is not None:
+                changes = _diff(self._alias_default(prev),
+                                self._alias_default(default))
+                changes["type"] = "default6"
+                self._publish_delta([changes])
+
+    def _read_default(self):
+        """Read the default route from kernel.
+
+        Returns:
+            (sequence of the read, default route) for _observe_default().
+        """
+        seq = next(self._default_reads)
+        return seq, self._get_default()
+
+    def _refresh_default(self):
+        seq, default = self._read_default()
+        self._observe_default(default, seq)
+        return default
+
+    def _observe_default(self, default, seq=None):
+        """Record the default route read from kernel, ignored if a later
+        read has been recorded already.
+
+        Args:
+            seq: sequence from _read_default(), a new one if the route is
+                known without reading, e.g. just written by the bundle.
+        """
+        if seq is None:
+            seq = next(self._default_reads)
+        with self._version_lock:
+            if seq < self._default_seq:
+                return
+            self._default_seq = seq
+            self._default_ts = time()
+            prev = self._default
+            if default == prev:
+                return
+            self._default = default
+            self._version += 1
+            self._views = {}
+        if prev is not None:
+            changes = _diff(self._alias_default(prev),
+                            self._alias_default(default))
+            changes["type"] = "default"
+            self._publish_delta([changes])
+
+    def _expire_default(self):
+        self._default_ts = 0
+        self._bump_version()
+
+    def _current_default(self):
+        if self._default is None or \
+                time() - self._default_ts > self.DEFAULT_TTL:
+            self._refresh_default()
+        return self._default
+
     def _load_mappings(self, path):
         with open(os.path.join(path, "config", "mapping.json")) as f:
             self._mappings = json.load(f)
@@ -67,6 +452,18 @@ class IPRoute(Model):
         for mapping in self._mappings:
             mapping["regex"] = re.compile(mapping["pattern"])
 
+    def _mapping_command(self, name):
+        """The mapping command to resolve "name", None if not required.
+        """
+        for mapping in self._mappings:
+            match = mapping["regex"].match(name)
+            if not match:
+                continue
+            match = self._cmd_regex.match(
+                mapping["name"].format(*match.groups()))
+            return match.group(1) if match else None
+        return None
+
     def _get_iface_name(self, name):
         for mapping in self._mappings:
             match = mapping["regex"].match(name)
@@ -79,40 +476,145 @@ class IPRoute(Model):
                 return _iface
 
             try:
-                with open("{}/iface_cmd.sh".format(
-                        os.path.join(self._path, "config")), "w") as f:
-                    f.write(match.group(1))
-                _iface = str(sh.sh("{}/iface_cmd.sh".format(
-                    os.path.join(self._path, "config")))).rstrip()
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="mapping"):
+                    _iface = str(ip.process.run(
+                        "sh", "-c", match.group(1), name="mapping",
+                        timeout=self.MAPPING_TIMEOUT)).rstrip()
                 if _iface == "":
                     return None
                 return _iface
             except Exception as e:
-                _logger.debug(e)
+                _logger.debug("Failed to resolve {}: {}".format(name, e))
                 return None
         return name
 
-    def _get_priority_list(self):
-        """Get priority list with real interface name for default route
-        """
-        routes = []
-        for iface in self.model.db:
-            name = self._get_iface_name(iface)
-            if name and name != "":
-                if name != iface:
-                    self._alias[name] = iface
-                routes.append(name)
+    def _resolve_names(self, ifaces):
+        """
+        Resolve interface names, the ones require mapping commands are
+        resolved concurrently; it takes as long as the slowest command.
+
+        Returns:
+            dict format of names and resolved names (None if failed).
+        """
+        names = {}
+        pending = []
+        for iface in ifaces:
+            if iface in names or iface in pending:
                 continue
+            if self._mapping_command(iface) is None:
+                names[iface] = self._get_iface_name(iface)
+            else:
+                pending.append(iface)
+
+        if len(pending) > 1:
+            pool = ThreadPool(min(len(pending), self.MAPPING_WORKERS))
+            try:
+                results = pool.map(self._get_iface_name, pending)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._get_iface_name(iface) for iface in pending]
+        names.update(zip(pending, results))
+        return names
+
+    def _get_priority_list(self):
+        """Get priority list with real interface name for default route, the
+        priority lists of policies are also resolved.
+        """
+        names = self._resolve_names(
+            list(self.model.db) +
+            [iface for policy in self._policy.model.db
+             for iface in policy["priorityList"]])
+
+        def _resolve(ifaces):
+            routes = []
+            for iface in ifaces:
+                name = names[iface]
+                if name and name != "":
+                    if name != iface:
+                        aliases[name] = iface
+                    routes.append(name)
+            return routes
+
+        aliases = dict(self._alias)
+        routes = _resolve(self.model.db)
+        self._policy_routes = [
+            (policy, _resolve(policy["priorityList"]))
+            for policy in self._policy.model.db]
+        self._alias = aliases
         return routes
 
     def run(self):
+        for target in [self._probe_loop, self._watch_loop, self._neigh_loop]:
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+        if self._loop:
+            self._loop.call_every(self.UPDATE_INTERVAL, self._converge, "run")
+            self._loop.run()
+            return
+
         while True:
             sleep(self.UPDATE_INTERVAL)
             try:
-                self.try_update_default(self._routes)
+                with self._tracer.span("run"), self._triggered("run"):
+                    self.try_update_default(self._routes)
             except Exception as e:
                 _logger.debug(e)
 
+    def stop(self):
+        self._stopped.set()
+        self._neigh_wake.set()
+        self._end_grace()
+        self._clear_probe_routes()
+        with self._defer_lock:
+            if self._deferred and not self._loop:
+                self._deferred.cancel()
+            self._deferred = None
+        if self._loop:
+            self._loop.stop()
+
+    @contextmanager
+    def _triggered(self, trigger):
+        prev = getattr(self._context, "trigger", None)
+        self._context.trigger = trigger
+        try:
+            yield
+        finally:
+            self._context.trigger = prev
+
+    def _converge(self, trigger):
+        with self._tracer.span(trigger), self._triggered(trigger):
+            if self._routes_dirty:
+                self._routes_dirty = False
+                self._routes = self._get_priority_list()
+                self._bump_version()
+            self.try_update_default(self._routes)
+
+    def _request_convergence(self, trigger, refresh=False):
+        """Converge now, or queue it to the event loop (coalesced with the
+        pending one, it always uses the latest state when it runs).
+
+        Args:
+            refresh: resolve the priority list again before converging.
+        """
+        if self._loop:
+            if refresh:
+                self._routes_dirty = True
+            self._loop.post(self._converge, trigger, key="convergence")
+            return
+
+        if refresh:
+            # aliases are replaced too, drop the views cached since the
+            # caller's bump
+            self._routes = self._get_priority_list()
+            self._bump_version()
+        with self._triggered(trigger):
+            self.try_update_default(self._routes)
+
     def save(self):
         """
         Save and backup the configuration.
@@ -120,32 +622,59 @@ class IPRoute(Model):
         self.model.save_db()
         self.model.backup_db()
 
-    def list_interfaces(self):
+    def list_interfaces(self, candidates=None, ipv6=False):
         """
-        List available interfaces.
+        List available interfaces among the candidates.
+
+        Only the candidates with "status" and "wan" set in database are
+        inspected, other interfaces of the system are never enumerated.
+        IPv6 capable ones, with a global address, are collected in the same
+        pass.
+
+        Args:
+            candidates: interface names, all interfaces in database if not
+                        given.
+            ipv6: return (interfaces, IPv6 capable interfaces) if True.
         """
-        # retrieve all interfaces
-        try:
-            ifaces = ip.addr.interfaces()
-        except:
-            return {}
+        interfaces = self._interfaces
+        if candidates is None:
+            candidates = interfaces.keys()
 
         # list connected interfaces
         data = []
-        for iface in ifaces:
+        data6 = []
+        addresses = {}
+        seen = set()
+        for iface in candidates:
+            info = interfaces.get(iface)
+            if not info or info.get("status") is not True or \
+                    info.get("wan") is not True or iface in seen:
+                continue
+            seen.add(iface)
             try:
-                iface_info = ip.addr.ifaddresses(iface)
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="ip.addr.ifaddresses"):
+                    iface_info = ip.addr.ifaddresses(iface)
             except:
                 continue
             if iface_info["link"] is True:
                 inet_ip = [inet["ip"]
                            for inet in iface_info["inet"]
                            if "" != inet["ip"]]
-                if len(inet_ip) and \
-                        (iface in self._interfaces.keys() and
-                         self._interfaces[iface]["status"] is True and
-                         self._interfaces[iface]["wan"] is True):
+                if len(inet_ip):
                     data.append(iface)
+                    addresses[iface] = inet_ip
+                inet6_ip = [inet["ip"]
+                            for inet in iface_info.get("inet6", [])
+                            if "global" == inet["scope"]]
+                if len(inet6_ip):
+                    data6.append(iface)
+        if addresses:
+            merged = dict(self._addresses)
+            merged.update(addresses)
+            self._addresses = merged
+        if ipv6:
+            return data, data6
         return data
 
     def get_priority_list(self):
@@ -159,18 +688,34 @@ class IPRoute(Model):
         self.model.db = priority_list
         self.save()
 
-        self._routes = self._get_priority_list()
-        self.try_update_default(self._routes)
+        with self._tracer.span("set_priority_list",
+                               priorityList=list(priority_list)):
+            self._bump_version()
+            self._request_convergence("set_priority_list", refresh=True)
         return self.model.db
 
-    def _get_default(self):
+    def _get_default(self, family=4):
         """
         Retrieve current default gateway
 
+        Args:
+            family: 4 for IPv4 and 6 for IPv6.
+
         Return:
             default: dict format with "interface" and/or "gateway"
         """
-        gws = ip.route.show()
+        with self._metrics.timer(
+                "route_command_seconds", cmd="ip.route.show"):
+            if 6 == family:
+                gws = ip.route.show(family=6)
+            else:
+                gws = ip.route.show()
+        return self._parse_default(gws)
+
+    @staticmethod
+    def _parse_default(gws):
+        """The first default route of "ip route show" output.
+        """
         default = {}
         for gw in gws:
             if "default" in gw:
@@ -185,14 +730,25 @@ class IPRoute(Model):
         return default
 
     def get_default(self):
-        default = self._get_default()
+        self._current_default()
+        return self._cached_view(("default",), self._build_default)
+
+    def _build_default(self):
+        default = self._alias_default(self._default)
+        if self._default6:
+            default["ipv6"] = self._alias_default(self._default6)
+        return default
+
+    def _alias_default(self, default):
+        default = copy.deepcopy(default)
+        aliases = self._alias
         _iface = default.get("interface")
-        if _iface and _iface in self._alias:
-            default["interface"] = self._alias[_iface]
+        if _iface and _iface in aliases:
+            default["interface"] = aliases[_iface]
             default["actualIface"] = _iface
         return default
 
-    def _update_default(self, default):
+    def _update_default(self, default, family=4):
         """
         Update default gateway. If updated failed, should recover to previous
         one.
@@ -208,8 +764,15 @@ class IPRoute(Model):
                   "status": true,
                   "wan": true
                 }
+            family: 4 for IPv4 and 6 for IPv6.
         """
-        ip.route.delete("default")
+        if 6 == family:
+            return self._update_default6(default)
+
+        with self._metrics.timer(
+                "route_command_seconds", cmd="ip.route.delete"):
+            ip.route.delete("default")
+        self._expire_default()
 
         iface = None
         gateway = None
@@ -226,82 +789,1068 @@ class IPRoute(Model):
         # FIXME: only "gateway" without interface is also available
         # FIXME: add "secondary" default route rule
         if iface:
-            if gateway:
-                ip.route.add("default", iface, gateway)
-            else:
-                ip.route.add("default", iface)
-
-            if iface and self._wan_event_cb:
-                if iface not in self._alias:
-                    self._wan_event_cb(iface)
+            with self._metrics.timer(
+                    "route_command_seconds", cmd="ip.route.add"):
+                if gateway:
+                    ip.route.add("default", iface, gateway)
                 else:
-                    self._wan_event_cb(self._alias[iface], iface)
+                    ip.route.add("default", iface)
         elif gateway:
-            ip.route.add("default", "", gateway)
+            with self._metrics.timer(
+                    "route_command_seconds", cmd="ip.route.add"):
+                ip.route.add("default", "", gateway)
         else:
             raise IPRouteError("Invalid default route.")
 
+    def _update_default6(self, default):
+        """
+        Replace or delete the IPv6 default route of the bundle, the one with
+        DEFAULT6_METRIC. Default routes learned from router advertisements
+        are left as is, so their gateways are still known after a switch.
+        """
+        iface = default.get("interface")
+        if not iface:
+            _logger.info("Delete IPv6 default route.")
+            with self._metrics.timer(
+                    "route_command_seconds", cmd="ip.route.delete"):
+                ip.route.delete("default", family=6,
+                                metric=self.DEFAULT6_METRIC)
+            return
+        with self._metrics.timer(
+                "route_command_seconds", cmd="ip.route.replace"):
+            ip.route.replace("default", iface, default.get("gateway", ""),
+                             family=6, metric=self.DEFAULT6_METRIC)
+
+    def _publish_wan(self, iface):
+        if not self._wan_event_cb:
+            return
+        aliases = self._alias
+        with self._metrics.timer("route_publish_seconds", event="wan"):
+            if iface not in aliases:
+                self._wan_event_cb(iface)
+            else:
+                self._wan_event_cb(aliases[iface], iface)
+
+    @contextmanager
+    def _mutation(self):
+        """Hold the instance lock for the kernel default route update.
+        """
+        start = time()
+        with self._lock:
+            wait = time() - start
+            self._metrics.observe("route_lock_wait_seconds", wait)
+            with self._tracer.span("mutation", lockWait=round(wait * 1000, 3)):
+                yield
+
     def _try_update_default(self, routes):
         """
         Try to update the default gateway.
 
+        The decision is made without lock from a snapshot of the interface
+        database; only the kernel default route read-compare-write holds the
+        instance lock, and is skipped if a convergence of a newer snapshot has
+        been applied already.
+
         Args:
             routes: array format of default gateway list with priority.
                     For example:
                     ["wwan0", "eth0"]
         """
-        ifaces = self.list_interfaces()
+        version = self._version
+        interfaces = self._interfaces
+        candidates = list(routes)
+        for _, policy_routes in self._policy_routes:
+            candidates += policy_routes
+        with self._tracer.span("list_interfaces") as span:
+            ifaces, ifaces6 = self.list_interfaces(candidates, ipv6=True)
+            span.set(interfaces=list(ifaces), interfaces6=list(ifaces6))
+
+        # IPv6 is converged from the same snapshot, only if any interface
+        # is IPv6 capable or an IPv6 default route has been seen
+        if ifaces6 or self._default6:
+            self._try_update_default6(routes, ifaces6, interfaces, version)
+
         if not ifaces:
             # FIXME: keep or clean?
             # self._update_default({})
             raise IPRouteError("Interfaces should be UP.")
 
-        default = {}
+        if self._policy_routes:
+            with self._mutation():
+                self._try_update_policies(ifaces, interfaces)
+
+        self._available = ifaces
+        if self._quality.model.db.get("enable"):
+            with self._tracer.span("rank_links") as span:
+                default = decision.choose_default(
+                    routes, ifaces, interfaces,
+                    self._links.scores(routes), self._links.tolerance)
+                span.set(interface=default.get("interface"))
+        else:
+            default = decision.choose_default(routes, ifaces, interfaces)
+
+        adopted = self._adopted
+        if adopted and adopted[0] is interfaces and adopted[1] == routes:
+            return "adopted"
+        self._adopted = None
+        alerted = self._alerted
+        if alerted and alerted[1] is interfaces and alerted[2] == routes:
+            return "alerted"
+        self._alerted = None
+
+        if not default:
+            with self._mutation():
+                if version < self._applied_version:
+                    return "superseded"
+                self._applied_version = version
+                if not self._allow_mutation():
+                    return "deferred"
+                start = time()
+                with self._tracer.span("update_default", default={}):
+                    self._update_default({})
+                duration = time() - start
+                self._desired = {}
+            if self._default:
+                self._record(self._default, {}, duration)
+            self._observe_default({})
+            return "deleted"
+
+        # marking the flows may take long on a large conntrack table, it is
+        # done before the lock from the observed default route
+        observed = self._current_default()
+        graceful = False
+        if _differs(observed, default):
+            graceful = self._prepare_failback(observed, default, routes,
+                                              ifaces)
+
+        with self._mutation():
+            if version < self._applied_version:
+                return "superseded"
+            self._applied_version = version
+            with self._tracer.span("get_default") as span:
+                seq, current = self._read_default()
+                span.set(current=current)
+            updated = _differs(current, default)
+            deferred = updated and not self._allow_mutation()
+            failed = None
+            if updated and not deferred:
+                start = time()
+                with self._tracer.span("update_default", default=default):
+                    try:
+                        self._update_default(default)
+                    except Exception as e:
+                        failed = e
+                duration = time() - start
+                self._mutated(failed)
+            if not failed and not deferred:
+                self._desired = {"interface": default["interface"],
+                                 "gateway": default.get("gateway", "")}
+
+        # the flows were kept for a switch that is not made
+        if graceful and (deferred or failed or not updated or
+                         current.get("interface") !=
+                         observed.get("interface")):
+            self._end_grace()
+            graceful = False
+        if deferred:
+            return "deferred"
+        if failed:
+            self._refresh_default()
+            return "failed"
+        self._observe_default(current, seq)
+        if not updated:
+            return "unchanged"
+        self._record(current, default, duration)
+        self._publish_wan(default["interface"])
+        self._refresh_default()
+        previous = current.get("interface")
+        if self._flush_conntrack and previous and not graceful and \
+                previous != default["interface"]:
+            self._background(self.flush_flows, previous)
+        return "updated"
+
+    def _try_update_default6(self, routes, ifaces6, interfaces, version):
+        """
+        Update the IPv6 default route, "gateway6" of the interface is used
+        if given, otherwise the gateway of the default route learned by the
+        interface from router advertisements. An interface without both is
+        skipped, unless it is point-to-point: a default route bound only to
+        a broadcast link breaks IPv6 there.
+
+        Only the IPv6 default route of the bundle is managed, see
+        _update_default6().
+        """
+        with self._mutation():
+            if version < self._applied_version:
+                return
+            with self._tracer.span("get_default6") as span:
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="ip.route.show"):
+                    routes6 = [gw for gw in ip.route.show(family=6)
+                               if "default" in gw]
+                current = self._parse_default(routes6)
+                span.set(current=current)
+            default = self._choose_default6(routes, ifaces6, interfaces,
+                                            routes6)
+            applied = [gw for gw in routes6
+                       if self.DEFAULT6_METRIC == gw.get("metric")]
+            if not default:
+                updated = bool(applied)
+            else:
+                updated = not applied or \
+                    applied[0]["dev"] != default["interface"] or \
+                    applied[0]["default"] != default.get("gateway", "")
+            if updated and not self._allow_mutation():
+                updated = False
+            failed = None
+            if updated:
+                start = time()
+                with self._tracer.span("update_default6", default=default):
+                    try:
+                        self._update_default(default, family=6)
+                    except Exception as e:
+                        failed = e
+                duration = time() - start
+                self._mutated(failed)
+
+        if updated:
+            if not failed:
+                self._record(current, default, duration, family=6)
+            current = self._get_default(family=6)
+        self._observe_default6(current)
+
+    def _choose_default6(self, routes, ifaces6, interfaces, routes6):
+        """
+        The IPv6 default route for the first usable interface in "routes".
+
+        Args:
+            routes6: IPv6 default routes in the kernel.
+        """
         for iface in routes:
-            if iface in ifaces:
-                default["interface"] = iface
-                break
+            if iface not in ifaces6:
+                continue
+            gateway = interfaces.get(iface, {}).get("gateway6")
+            if not gateway:
+                gateway = next((gw["default"] for gw in routes6
+                                if iface == gw["dev"] and gw["default"]), "")
+            if not gateway and not self._point_to_point(iface):
+                continue
+            default = {"interface": iface}
+            if gateway:
+                default["gateway"] = gateway
+            return default
+        return {}
+
+    def _point_to_point(self, iface):
+        """Links without link-layer address (e.g. PPP) have no neighbors, a
+        default route bound to the link is enough.
+        """
+        try:
+            return not ip.addr.ifaddresses(iface)["mac"]
+        except Exception:
+            return False
+
+    def _watch_loop(self):
+        """Watch default route changes, restart the monitor if it exits.
+        """
+        while not self._stopped.is_set():
+            try:
+                for event in ip.route.monitor():
+                    if self._stopped.is_set():
+                        return
+                    if 4 != event["family"]:
+                        continue
+                    if self._loop:
+                        self._loop.post(self._check_drift, key="drift")
+                    else:
+                        self._check_drift()
+            except Exception as e:
+                _logger.debug("Route monitor exited: {}".format(e))
+            self._stopped.wait(1)
+
+    def _check_drift(self):
+        """
+        Compare the kernel default route with the applied one, and enforce,
+        adopt or report the change by the drift policy.
+
+        Changes by the bundle itself are always done under the instance lock,
+        so they are complete when the lock is acquired here. While a failed
+        write of the bundle is backing off, the kernel default route is not
+        compared: the deferred convergence retries it, and it is not a
+        change by others.
+
+        An alerted route is reported once, and left as is until the
+        interfaces or the priority list change, as an adopted one.
+        """
+        if self._desired is None:
+            return
+        with self._tracer.span("drift") as span, self._triggered("drift"):
+            with self._mutation():
+                if self._backoff.failures:
+                    return
+                desired = self._desired
+                alerted = self._alerted
+                seq, current = self._read_default()
+                # reported already if alerted
+                if not _differs(current, desired) or \
+                        (alerted and not _differs(current, alerted[0])):
+                    self._observe_default(current, seq)
+                    return
+                policy = self._drift_policy
+                span.set(current=current, desired=desired, policy=policy)
+                action = {"enforce": "enforced", "adopt": "adopted",
+                          "alert": "alerted"}[policy]
+                start = time()
+                if "enforce" == policy:
+                    # out of budget, the deferred convergence restores it
+                    if not self._allow_mutation():
+                        action = "deferred"
+                    else:
+                        try:
+                            self._update_default(desired)
+                        except Exception as e:
+                            self._mutated(e)
+                            raise
+                        self._mutated()
+                elif "adopt" == policy:
+                    self._desired = {"interface": current.get("interface", ""),
+                                     "gateway": current.get("gateway", "")}
+                    self._adopted = (self._interfaces, self._routes)
+                else:
+                    self._alerted = (current, self._interfaces, self._routes)
+                duration = time() - start
+
+            iface = self._alias.get(current.get("interface"),
+                                    current.get("interface", ""))
+            with self._seq_lock:
+                self._drift["detected"] += 1
+                self._drift[action] += 1
+                self._drift["interfaces"][iface] = \
+                    self._drift["interfaces"].get(iface, 0) + 1
+                self._drift["last"] = {
+                    "time": time(),
+                    "current": self._alias_default(current),
+                    "desired": self._alias_default(desired),
+                    "action": action
+                }
+            self._metrics.inc("route_drift_total", action=action)
+            _logger.warning("Default route changed by others: {} ({})".format(
+                current, action))
+            self._publish_delta([{
+                "type": "drift",
+                "action": action,
+                "set": self._alias_default(current),
+                "desired": self._alias_default(desired)}])
+
+            if "enforced" == action:
+                self._record(current, desired, duration)
+                self._refresh_default()
+            else:
+                self._observe_default(current, seq)
+                if "adopt" == policy:
+                    self._record(desired, current, duration)
+                    if current.get("interface"):
+                        self._publish_wan(current["interface"])
+                    # the DNS servers follow the adopted default route
+                    self._update_resolv()
+
+    def _allow_mutation(self):
+        """
+        Take a token of the mutation budget. If none is left or backing off
+        from failures, a convergence is deferred until the budget is
+        available.
+        """
+        delay = self._backoff.delay()
+        if not delay and self._bucket.take():
+            return True
+        delay = max(delay, self._bucket.delay())
+        self._metrics.inc("route_mutation_limited_total")
+        with self._tracer.span("deferred", delay=round(delay, 3)):
+            self._defer(delay)
+        return False
+
+    def _mutated(self, error=None):
+        """Record the result of a mutation, retry later with backoff if
+        failed.
+        """
+        if not error:
+            self._backoff.success()
+            return
+        delay = self._backoff.failure()
+        self._metrics.inc("route_mutation_failures_total")
+        _logger.warning(
+            "Failed to update default route, retry in {}s: {}".format(
+                delay, error))
+        self._defer(delay)
+
+    def _defer(self, delay):
+        """Converge after "delay" seconds, if not deferred already.
+        """
+        with self._defer_lock:
+            if self._deferred or self._stopped.is_set():
+                return
+            if self._loop:
+                self._deferred = self._loop.call_later(
+                    delay, self._run_deferred)
+            else:
+                self._deferred = Timer(delay, self._run_deferred)
+                self._deferred.daemon = True
+                self._deferred.start()
+
+    def _run_deferred(self):
+        with self._defer_lock:
+            self._deferred = None
+            if self._stopped.is_set():
+                return
+        self._request_convergence("deferred")
+
+    def _background(self, func, *args):
+        """Run "func" off the convergence path in a daemon thread, never in
+        the event loop: slow commands (e.g. conntrack on a large table)
+        would block the queued convergences.
+        """
+        thread = Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _wan_addresses(self, iface):
+        """IPv4 addresses of the interface, including the ones seen before it
+        was down.
+        """
+        addresses = set(self._addresses.get(iface, []))
+        address = self._interfaces.get(iface, {}).get("ip")
+        if address:
+            addresses.add(address)
+        return sorted(addresses)
+
+    def flush_flows(self, iface):
+        """
+        Delete the conntrack entries NATed to the addresses of "iface", so
+        that the clients reconnect through the new WAN at once instead of
+        waiting for the flows on the previous one to time out. Only the
+        entries with the reply direction to the addresses are deleted.
+
+        Returns:
+            Number of deleted entries.
+        """
+        addresses = self._wan_addresses(iface)
+        deleted = 0
+        with self._tracer.span("flush_flows", interface=iface,
+                               addresses=addresses) as span:
+            for address in addresses:
+                try:
+                    with self._metrics.timer(
+                            "route_command_seconds",
+                            cmd="ip.conntrack.delete"):
+                        deleted += ip.conntrack.delete(address)
+                except Exception as e:
+                    _logger.warning(
+                        "Failed to delete flows of {}: {}".format(address, e))
+            span.set(deleted=deleted)
+        self._metrics.inc("route_conntrack_deleted_total", deleted)
+        return deleted
+
+    def _schedule(self, delay, func):
+        """Run "func", the next grace period check, after "delay" seconds.
+
+        Returns:
+            The timer, canceled when the grace period ends.
+        """
+        timer = Timer(delay, func)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _prepare_failback(self, current, default, routes, ifaces):
+        """
+        End the grace period of the previous failback, and start one before
+        switching to "default" if it is a graceful failback: the previous WAN
+        is still available and lower in the priority list. Called without
+        the instance lock, the caller ends the grace period if the switch is
+        not made.
+
+        Returns:
+            True if the flows of the previous WAN are kept on it.
+        """
+        self._end_grace()
+        previous = current.get("interface")
+        if "graceful" != self._failback_mode or not previous or \
+                previous not in ifaces or previous not in routes or \
+                default["interface"] not in routes or \
+                routes.index(default["interface"]) > routes.index(previous):
+            return False
+        return self._start_grace(previous, current.get("gateway", ""))
+
+    def _fwmark(self):
+        return "%#x/%#x" % (self.FAILBACK_MARK, self.FAILBACK_MARK)
+
+    def _start_grace(self, iface, gateway):
+        """
+        Mark the established flows of "iface" and route the marked packets
+        through it by a policy rule, so that only the new flows take the new
+        default route. The rule is added before the iptables rules and
+        removed after them, see _clear_failback().
+        """
+        addresses = self._wan_addresses(iface)
+        if not addresses:
+            return False
+        mark = self.FAILBACK_MARK
+        with self._grace_lock:
+            self._grace = {"interface": iface, "gateway": gateway,
+                           "since": time(), "flows": 0}
+            try:
+                with self._tracer.span("start_grace", interface=iface,
+                                       addresses=addresses) as span:
+                    ip.route.replace("default", iface, gateway,
+                                     table=self.FAILBACK_TABLE)
+                    ip.rule.add(self.FAILBACK_TABLE, self.FAILBACK_PRIORITY,
+                                fwmark=self._fwmark())
+                    ip.conntrack.restore_mark(True, iface, mark)
+                    flows = sum(ip.conntrack.mark(address, mark)
+                                for address in addresses)
+                    span.set(flows=flows)
+            except Exception as e:
+                _logger.warning("Failed to keep flows on {}: {}".format(
+                    iface, e))
+                flows = 0
+            if not flows:
+                self._clear_grace()
+                return False
+            self._grace = dict(self._grace, flows=flows)
+            self._grace_timer = self._schedule(
+                self.FAILBACK_CHECK, self._check_grace)
+        self._metrics.inc("route_failback_graceful_total")
+        return True
+
+    def _check_grace(self):
+        """End the grace period if the kept flows are drained or expired.
+        The flows are counted without lock, a convergence never waits on it.
+        """
+        grace = self._grace
+        if not grace:
+            return
+        try:
+            flows = ip.conntrack.count(self.FAILBACK_MARK)
+        except Exception as e:
+            _logger.debug("Failed to count kept flows: {}".format(e))
+            flows = grace["flows"]
+        with self._grace_lock:
+            # ended or replaced meanwhile
+            if self._grace is not grace:
+                return
+            self._grace = dict(grace, flows=flows)
+            if flows and time() - grace["since"] < self._failback_timeout:
+                self._grace_timer = self._schedule(
+                    self.FAILBACK_CHECK, self._check_grace)
+                return
+            self._clear_grace()
+        self._metrics.inc("route_failback_expired_total" if flows
+                          else "route_failback_drained_total")
+
+    def _end_grace(self):
+        with self._grace_lock:
+            if self._grace:
+                self._clear_grace()
+
+    def _clear_grace(self):
+        """End the grace period, the caller holds _grace_lock.
+        """
+        if self._grace_timer:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+        self._clear_failback(self._grace["interface"])
+        self._grace = None
+
+    def _clear_failback(self, iface=None):
+        """
+        Remove the iptables rules, table and rule of graceful failback; the
+        iptables rules of any interface if "iface" is not given, e.g. left by
+        a crash.
+        """
+        if iface:
+            restore = (ip.conntrack.restore_mark,
+                       [False, iface, self.FAILBACK_MARK])
         else:
-            self._update_default({})
+            restore = (ip.conntrack.clear_restore_mark, [self.FAILBACK_MARK])
+        for func, args, kwargs in [
+                restore + ({},),
+                (ip.route.delete, ["default", self.FAILBACK_TABLE], {}),
+                (ip.rule.delete, [self.FAILBACK_TABLE, self.FAILBACK_PRIORITY],
+                 {"fwmark": self._fwmark()})]:
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                _logger.warning("Failed to end failback: {}".format(e))
+
+    def _clear_leftover(self):
+        """Remove the rules (and tables) of graceful failback and link probes
+        left by a crash. The failback rule is added first and removed last.
+        """
+        try:
+            rules = ip.rule.show()
+        except Exception as e:
+            _logger.debug("Failed to list rules: {}".format(e))
             return
+        if any(self.FAILBACK_PRIORITY == rule["priority"] and
+               str(self.FAILBACK_TABLE) == rule.get("table")
+               for rule in rules):
+            _logger.info("Remove the rules of an interrupted failback.")
+            self._clear_failback()
+        for rule in rules:
+            if self.PROBE_PRIORITY == rule["priority"] and rule.get("oif"):
+                self._probe_routes[rule["oif"]] = (int(rule["table"]), None)
+        self._clear_probe_routes()
+
+    def get_failback(self):
+        """Failback mode and the flows kept on the previous WAN, if any.
+        """
+        data = {"mode": self._failback_mode,
+                "timeout": self._failback_timeout,
+                "active": None}
+        grace = self._grace
+        if grace:
+            data["active"] = self._alias_default(grace)
+        return data
 
-        # find gateway by interface
-        default.update(self._interfaces[default["interface"]])
+    def set_failback(self, mode=None, timeout=None):
+        if mode is not None:
+            if mode not in self.FAILBACK_MODES:
+                raise IPRouteError(
+                    "Invalid failback mode \"{}\".".format(mode))
+            self._failback_mode = mode
+            if "immediate" == mode:
+                self._end_grace()
+        if timeout is not None:
+            self._failback_timeout = timeout
+        return self.get_failback()
 
-        current = self._get_default()
-        if current.get("interface", "") != default.get("interface", "") or \
-                current.get("gateway", "") != default.get("gateway", ""):
-            self._update_default(default)
+    def get_drift(self):
+        """Drift policy and counters of default route changes by others.
+        """
+        with self._seq_lock:
+            data = copy.deepcopy(self._drift)
+        data["policy"] = self._drift_policy
+        return data
 
-    def try_update_default(self, routes):
-        with _update_default_lock:
+    def set_drift(self, policy):
+        if policy not in self.DRIFT_POLICIES:
+            raise IPRouteError("Invalid drift policy \"{}\".".format(policy))
+        self._drift_policy = policy
+        if "adopt" != policy and self._adopted or \
+                "alert" != policy and self._alerted:
+            self._adopted = None
+            self._alerted = None
+            self._request_convergence("set_drift")
+        return self.get_drift()
+
+    def simulate(self, configs):
+        """
+        Evaluate candidate configurations against the current state without
+        touching the kernel, see decision.simulate().
+
+        Interfaces available in the latest convergence are used, or all the
+        interfaces in database before the first one.
+        """
+        interfaces = self._interfaces
+        available = self._available
+        if available is None:
+            available = interfaces.keys()
+        snapshot = {
+            "priorityList": self._routes,
+            "available": available,
+            "interfaces": interfaces,
+            "aliases": self._alias
+        }
+        if self._quality.model.db.get("enable"):
+            snapshot["scores"] = self._links.scores(interfaces.keys())
+            snapshot["tolerance"] = self._links.tolerance
+        with self._tracer.span("simulate", configs=len(configs)):
+            return decision.simulate(configs, snapshot)
+
+    def _record(self, old, new, duration, family=4):
+        """Add a default route transition to the history.
+        """
+        self._history.record(
+            self._alias_default(old), self._alias_default(new),
+            getattr(self._context, "trigger", None), duration, family)
+
+    def get_history(self, since=None, until=None, limit=None):
+        return self._history.records(since, until, limit)
+
+    def _try_update_policies(self, ifaces, interfaces):
+        """
+        Update the default route of each policy table, changed ones are
+        applied in one batch.
+
+        Args:
+            ifaces: available interfaces from list_interfaces().
+            interfaces: snapshot of interface database.
+        """
+        commands = []
+        defaults = {}
+        for policy, routes in self._policy_routes:
+            table = policy["table"]
+            target = None
+            for iface in routes:
+                if iface in ifaces:
+                    target = (iface, interfaces[iface].get("gateway", ""))
+                    break
+            defaults[table] = target
+            if self._policy_defaults.get(table, False) == target:
+                continue
+            if target:
+                commands.append(ip.route.command(
+                    "replace", "default", target[0], target[1], table))
+            else:
+                commands.append(["route", "flush", "table", str(table)])
+
+        if not commands:
+            return
+        with self._tracer.span("update_policies", commands=len(commands)):
             try:
-                self._try_update_default(routes)
-            except IPRouteError as e:
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="ip.batch"):
+                    ip.route.batch(commands)
+            except Exception as e:
+                # retry the failed tables next time
+                _logger.warning("Failed to update policy routes: {}".format(e))
+                return
+        self._policy_defaults = defaults
+
+    def _policy_rule(self, action, policy):
+        return ip.rule.command(
+            action, policy["table"],
+            policy.get("priority", self.RULE_PRIORITY + policy["table"]),
+            policy.get("source"), policy.get("iif"))
+
+    def _install_policy_rules(self, old, new):
+        """Replace rules of "old" policies by "new" ones, tables no longer used
+        are flushed.
+        """
+        tables = [policy["table"] for policy in new]
+        cleanup = [self._policy_rule("del", policy) for policy in old + new]
+        cleanup += [["route", "flush", "table", str(policy["table"])]
+                    for policy in old if policy["table"] not in tables]
+        with self._metrics.timer("route_command_seconds", cmd="ip.batch"):
+            try:
+                ip.route.batch(cleanup)
+            except ValueError as e:
+                # rules may not exist
                 _logger.debug(e)
+            ip.route.batch([self._policy_rule("add", policy)
+                            for policy in new])
+
+    def get_policies(self):
+        """Get policy routing settings
+        """
+        return self._policy.model.db
 
-    def _set_default(self, default):
+    def set_policies(self, policies):
         """
-        Update default gateway by given info.
+        Update policy routing settings. Rules of previous policies are
+        replaced and the tables no longer used are flushed, in one batch.
+
+        Args:
+            policies: array format of policies, for example:
+                [{
+                  "table": 100,
+                  "source": "192.168.10.0/24",
+                  "iif": "eth2",
+                  "priority": 1100,
+                  "priorityList": ["wwan0", "eth0"]
+                }]
         """
-        # TODO: unused, remove or keep?
+        tables = [policy["table"] for policy in policies]
+        if len(set(tables)) != len(tables):
+            raise IPRouteError("Duplicated table of policies.")
+
+        with self._mutation():
+            self._install_policy_rules(self._policy.model.db, policies)
+            self._policy_defaults = dict(
+                (table, target)
+                for table, target in self._policy_defaults.iteritems()
+                if table in tables)
+
+        self._policy.model.db = policies
+        self._policy.model.save_db()
+        self._bump_version()
+        self._request_convergence("set_policies", refresh=True)
+        return self._policy.model.db
+
+    def _link_settings(self):
+        settings = self._quality.model.db
+        return {
+            "window": settings.get("window", 16),
+            "alpha": settings.get("alpha", 0.3),
+            "weights": settings.get("weights"),
+            "tolerance": settings.get("tolerance", 10)
+        }
+
+    def _probe_loop(self):
+        while not self._stopped.wait(
+                self._quality.model.db.get("interval", 10)):
+            if not self._quality.model.db.get("enable"):
+                continue
+            try:
+                self.probe_links()
+            except Exception as e:
+                _logger.debug("Failed to probe links: {}".format(e))
+
+    def probe_links(self):
+        """
+        Probe each available WAN link in the priority list once, converge
+        if the best link is changed.
+
+        The "target" is probed through every link, routed through the
+        gateway of the link by _probe_route(), or the gateway of the link if
+        "target" is empty. Links without both are not probed, as well as
+        broadcast links without gateway for a "target".
+        """
+        settings = self._quality.model.db
+        interfaces = self._interfaces
+        routes = self._routes
+        self._links.prune(routes)
+
+        targets = []
+        for iface in routes:
+            info = interfaces.get(iface)
+            if not info or info.get("status") is not True or \
+                    info.get("wan") is not True:
+                continue
+            target = settings.get("target") or info.get("gateway")
+            if not target:
+                continue
+            if settings.get("target"):
+                if info.get("gateway"):
+                    try:
+                        self._probe_route(iface, info["gateway"])
+                    except Exception as e:
+                        _logger.debug("Failed to route the probes of {}: {}"
+                                      .format(iface, e))
+                        continue
+                # a remote target is unreachable by a broadcast link without
+                # gateway
+                elif not self._point_to_point(iface):
+                    continue
+            targets.append((iface, target))
+        candidates = [iface for iface, _ in targets]
+        if not candidates:
+            return
+
+        # rounds are traced only if they trigger a convergence, so that they
+        # do not push the convergence traces out of the ring buffer
+        best = self._links.rank(candidates)[0]
+        rtts = {}
+        for iface, target in targets:
+            try:
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="ip.ping"):
+                    rtt = ip.ping.ping(
+                        iface, target, settings.get("timeout", 1))
+            except Exception as e:
+                _logger.debug("Failed to probe {}: {}".format(iface, e))
+                continue
+            rtts[iface] = rtt
+            self._links.add(iface, rtt)
+
+        ranked = self._links.rank(candidates)[0]
+        if settings.get("enable") and best != ranked:
+            with self._tracer.span("probe_links", interfaces=candidates,
+                                   rtt=rtts, best=ranked):
+                self._request_convergence("probe_links")
+
+    def _probe_route(self, iface, gateway):
+        """
+        Route the probes of "iface" through "gateway" by a table of the
+        link. The rule matches the sockets bound to the link only, and is
+        looked up after the main table: the other traffic, and the probes
+        of the default WAN, are routed as before.
+        """
+        table, applied = self._probe_routes.get(iface, (None, None))
+        if gateway == applied:
+            return
+        if table is None:
+            table = self.PROBE_TABLE + len(self._probe_routes)
+        ip.route.replace("default", iface, gateway, table=table)
+        if applied is None:
+            ip.rule.add(table, self.PROBE_PRIORITY, oif=iface)
+        self._probe_routes[iface] = (table, gateway)
+
+    def _clear_probe_routes(self):
+        probe_routes, self._probe_routes = self._probe_routes, {}
+        for iface, (table, _) in probe_routes.iteritems():
+            for func, args, kwargs in [
+                    (ip.rule.delete, [table, self.PROBE_PRIORITY],
+                     {"oif": iface}),
+                    (ip.route.delete, ["default", table], {})]:
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    _logger.warning(
+                        "Failed to remove the probe route: {}".format(e))
+
+    def _neigh_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh_neighbors()
+            except Exception as e:
+                _logger.debug("Failed to refresh neighbors: {}".format(e))
+            self._neigh_wake.wait(self.NEIGH_INTERVAL)
+            self._neigh_wake.clear()
+
+    def _probe_gateway(self, gateway):
+        iface, target = gateway
         try:
-            self._update_default(default)
+            with self._metrics.timer("route_command_seconds", cmd="ip.ping"):
+                ip.ping.ping(iface, target, 1)
         except Exception as e:
-            # try database if failed
+            _logger.debug("Failed to resolve {}: {}".format(target, e))
+
+    def refresh_neighbors(self):
+        """
+        Resolve the gateways of the standby WAN links in the priority list,
+        so that a switch to one of them never waits on ARP.
+
+        Neighbor entries are read by one "ip neigh show"; only the gateways
+        without a usable entry (missing, stale or failed) are probed by a
+        ping, concurrently. Links without link-layer address (e.g. PPP) do
+        not need it and are reported as "NOARP".
+
+        Returns:
+            dict format of neighbor state by interface, see _neighbors.
+        """
+        interfaces = self._interfaces
+        active = (self._desired or {}).get("interface")
+        gateways = {}
+        neighbors = {}
+        for iface in self._routes:
+            info = interfaces.get(iface)
+            if iface == active or iface in gateways or not info or \
+                    info.get("status") is not True or \
+                    info.get("wan") is not True or not info.get("gateway"):
+                continue
             try:
-                self.try_update_default(self._routes)
-            except IPRouteError as e2:
-                _logger.debug(
-                    "Failed to recover the default gateway: {}".format(e2))
-            error = "Update default gateway failed: {}".format(e)
-            _logger.error(error)
-            raise IPRouteError(error)
+                mac = ip.addr.ifaddresses(iface)["mac"]
+            except Exception:
+                continue
+            if mac:
+                gateways[iface] = info["gateway"]
+            else:
+                neighbors[iface] = {"gateway": info["gateway"], "lladdr": "",
+                                    "state": "NOARP"}
+
+        if gateways:
+            with self._metrics.timer(
+                    "route_command_seconds", cmd="ip.neigh.show"):
+                entries = ip.neigh.show()
+            found = dict(((entry["ip"], entry["dev"]), entry)
+                         for entry in entries)
+            pending = [(iface, gateway) for iface, gateway
+                       in gateways.iteritems()
+                       if not ip.neigh.usable(found.get((gateway, iface)))]
+            if pending:
+                with self._tracer.span(
+                        "refresh_neighbors",
+                        interfaces=[iface for iface, _ in pending]):
+                    pool = ThreadPool(min(len(pending), self.MAPPING_WORKERS))
+                    try:
+                        pool.map(self._probe_gateway, pending)
+                    finally:
+                        pool.close()
+                        pool.join()
+                with self._metrics.timer(
+                        "route_command_seconds", cmd="ip.neigh.show"):
+                    entries = ip.neigh.show()
+                found = dict(((entry["ip"], entry["dev"]), entry)
+                             for entry in entries)
+                self._metrics.inc("route_neigh_probe_total", len(pending))
+
+            for iface, gateway in gateways.iteritems():
+                entry = found.get((gateway, iface), {})
+                neighbors[iface] = {"gateway": gateway,
+                                    "lladdr": entry.get("lladdr", ""),
+                                    "state": entry.get("state", "NONE")}
+
+        if neighbors != self._neighbors:
+            self._neighbors = neighbors
+            self._bump_version()
+        return neighbors
+
+    def get_quality(self):
+        """Link quality settings and the statistics of each link.
+        """
+        data = copy.deepcopy(self._quality.model.db)
+        aliases = self._alias
+        data["links"] = dict(
+            (aliases.get(iface, iface), stats)
+            for iface, stats in self._links.snapshot().iteritems())
+        return data
+
+    def set_quality(self, settings):
+        """Update link quality settings, samples are dropped if the window is
+        changed.
+        """
+        self._quality.model.db.update(settings)
+        self._quality.model.save_db()
+        self._links.configure(**self._link_settings())
+        self._bump_version()
+        self._request_convergence("set_quality")
+        return self.get_quality()
+
+    def try_update_default(self, routes):
+        with self._tracer.span("convergence", routes=list(routes)) as span:
+            try:
+                with self._metrics.timer("route_convergence_seconds"):
+                    span.set(outcome=self._try_update_default(routes))
+            except IPRouteError as e:
+                span.set(outcome="failed", reason=str(e))
+                _logger.debug(e)
+                return
+            self._update_resolv()
+
+    def _update_resolv(self):
+        """
+        Write the DNS servers of the default route interface to the resolver
+        configuration, followed by the ones of the other available WANs in
+        priority order as fallbacks. The file is replaced atomically and only
+        if the content is changed.
+
+        Returns:
+            True if the file was written.
+        """
+        if not self._resolv_conf:
+            return False
+
+        # computed under the lock, a caller with an older state never
+        # overwrites the file written from a newer one
+        with self._resolv_lock:
+            default = (self._default or {}).get("interface")
+            available = self._available
+            routes = [iface for iface in self._routes
+                      if available is None or iface in available]
+            servers = resolv.nameservers(routes, default, self._interfaces)
+            if not servers:
+                return False
+            content = resolv.render(servers)
+            if content == self._resolv_content:
+                return False
+            try:
+                written = resolv.write(self._resolv_conf, content)
+            except (IOError, OSError) as e:
+                _logger.warning("Failed to write {}: {}".format(
+                    self._resolv_conf, e))
+                return False
+            self._resolv_content = content
+        if written:
+            _logger.info("DNS servers: {}".format(", ".join(servers)))
+            self._metrics.inc("route_resolv_write_total")
+        return written
 
     def update_iface_db(self, iface):
         """
         Save the interface name with its gateway and update the default
-        gateway if needed.
+        gateway if needed. The priority list and the default gateway are not
+        checked again if none of ROUTING_FIELDS is changed.
 
         If gateway is not specified, use the previous value. Only delete the
         gateway when gateway attribute is empty.
@@ -330,23 +1879,51 @@ class IPRoute(Model):
             raise IPRouteError(error)
 
         # update the router information
-        if name not in self._interfaces:
-            self._interfaces[name] = {}
         iface.pop("name", None)
         iface.pop("actualIface", None)
-        self._interfaces[name].update(iface)
-        if alias:
-            self._interfaces[name]["alias"] = alias
+        with self._db_lock:
+            prev = self._interfaces.get(name, {})
+            record = dict(prev)
+            record.update(iface)
+            if alias:
+                record["alias"] = alias
+            if prev != record:
+                interfaces = dict(self._interfaces)
+                interfaces[name] = record
+                self._interfaces = interfaces
+                self._bump_version()
 
-        # update interface list
-        self._routes = self._get_priority_list()
+        if prev != record:
+            changes = _diff(prev, record)
+            changes.pop("unset", None)
+            changes["set"].pop("alias", None)
+            changes["type"] = "iface"
+            changes["name"] = alias if alias else prev.get("alias", name)
+            if alias:
+                changes["set"]["actualIface"] = name
+            self._publish_delta([changes])
 
-        # check if the default gateway need to be modified
-        self.try_update_default(self._routes)
+        # nothing to converge if only fields like "mac" or "dns" changed
+        if _fingerprint(prev) == _fingerprint(record):
+            self._metrics.inc("route_iface_noop_total")
+            if prev.get("dns") != record.get("dns"):
+                self._update_resolv()
+            return
+        self._neigh_wake.set()
+
+        with self._tracer.span("update_iface_db", interface=name):
+            # update interface list and check if the default gateway need to
+            # be modified
+            self._request_convergence("update_iface_db", refresh=True)
 
     def get_iface(self, iface):
-        for _iface in self._interfaces.keys():
-            item = self._interfaces[_iface]
+        return self._cached_view(
+            ("iface", iface), lambda: self._build_iface(iface))
+
+    def _build_iface(self, iface):
+        interfaces = self._interfaces
+        for _iface in interfaces.keys():
+            item = interfaces[_iface]
             alias = item.get("alias", None)
             name = alias if alias else _iface
             if iface != name:
@@ -356,13 +1933,58 @@ class IPRoute(Model):
             data.pop("alias", None)
             if alias:
                 data["actualIface"] = _iface
+            neighbor = self._neighbors.get(_iface)
+            if neighbor:
+                data["neighbor"] = dict(neighbor)
             return data
         return {}
 
+    def get_metrics(self, fmt="json"):
+        """Counters and latency histograms of the hot paths, and the latency
+        statistics of external commands in "commands" (see ip.process).
+
+        Args:
+            fmt: "json" or "prometheus" for text exposition format.
+        """
+        commands = ip.process.stats()
+        if fmt == "prometheus":
+            lines = []
+            for key, kind in [("count", "counter"), ("errors", "counter"),
+                              ("timeouts", "counter"), ("max", "gauge")]:
+                name = "route_process_%s" % (
+                    "max_seconds" if "max" == key else key + "_total")
+                lines.append("# TYPE %s %s" % (name, kind))
+                for cmd, stat in sorted(commands.iteritems()):
+                    value = stat[key] / 1000.0 if "max" == key else stat[key]
+                    lines.append("%s{cmd=\"%s\"} %s" % (name, cmd, value))
+            return self._metrics.prometheus() + "\n".join(lines) + "\n"
+        data = self._metrics.snapshot()
+        data["commands"] = commands
+        return data
+
+    def set_metrics(self, enable=None, reset=False):
+        """Turn on/off the instrumentation or reset the collected data.
+        """
+        if enable is not None:
+            self._metrics.enabled = enable
+        if reset:
+            self._metrics.reset()
+            ip.process.reset_stats()
+        return {"enabled": self._metrics.enabled}
+
+    def get_trace(self, limit=None, since=None):
+        """Recorded convergence span trees, the newest first.
+        """
+        return self._tracer.records(limit, since)
+
     def get_iface_db(self):
+        return self._cached_view(("db",), self._build_iface_db)
+
+    def _build_iface_db(self):
         db = {}
-        for iface in self._interfaces.keys():
-            item = self._interfaces[iface].copy()
+        interfaces = self._interfaces
+        for iface in interfaces.keys():
+            item = interfaces[iface].copy()
             alias = item.pop("alias", None)
             name = alias if alias else iface
             db[name] = item
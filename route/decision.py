@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Default route decision without side effects, shared by the convergence and
+the simulation of candidate configurations.
+"""
+
+import copy
+import json
+
+from quality import rank
+
+
+def choose_default(routes, available, interfaces, scores=None, tolerance=0):
+    """
+    Choose the default route.
+
+    Args:
+        routes: priority list of actual interface names.
+        available: interfaces with link, address, and status and wan set.
+        interfaces: interface database indexed by actual name.
+        scores: link quality scores, the priority list only if not given.
+        tolerance: scores within "tolerance" of the best one are tied.
+
+    Returns:
+        The interface record with "interface", empty if no interface is
+        available.
+    """
+    candidates = [iface for iface in routes if iface in available]
+    if not candidates:
+        return {}
+    if scores:
+        candidates = rank(candidates, scores, tolerance)
+
+    default = dict(interfaces.get(candidates[0], {}))
+    default["interface"] = candidates[0]
+    return default
+
+
+def _evaluate(config, snapshot, names):
+    aliases = snapshot.get("aliases", {})
+    interfaces = snapshot.get("interfaces", {})
+    overrides = config.get("interfaces")
+    if overrides:
+        interfaces = dict(interfaces)
+        for iface, fields in overrides.iteritems():
+            iface = names.get(iface, iface)
+            record = dict(interfaces.get(iface, {"status": True, "wan": True}))
+            record.update(fields)
+            interfaces[iface] = record
+
+    available = config.get("available", snapshot.get("available", []))
+    available = set(
+        iface for iface in (names.get(name, name) for name in available)
+        if interfaces.get(iface, {}).get("status") is True and
+        interfaces.get(iface, {}).get("wan") is True)
+    routes = [names.get(name, name) for name in config.get(
+        "priorityList", snapshot.get("priorityList", []))]
+
+    default = choose_default(routes, available, interfaces,
+                             snapshot.get("scores"),
+                             snapshot.get("tolerance", 0))
+    if not default:
+        return {}
+    result = {"interface": default["interface"]}
+    if default["interface"] in aliases:
+        result["interface"] = aliases[default["interface"]]
+        result["actualIface"] = default["interface"]
+    if default.get("gateway"):
+        result["gateway"] = default["gateway"]
+    return result
+
+
+def simulate(configs, snapshot):
+    """
+    Evaluate candidate configurations against a snapshot, identical ones are
+    evaluated once.
+
+    Args:
+        configs: array of configurations, each may replace the
+            "priorityList", update "interfaces" records by name, or replace
+            the "available" interfaces, for example:
+            [{
+              "priorityList": ["wwan0", "eth0"],
+              "interfaces": {"eth0": {"gateway": "192.168.3.254"}},
+              "available": ["eth0"]
+            }]
+        snapshot: state to evaluate against, for example:
+            {
+              "priorityList": ["wwan0", "eth0"],
+              "available": ["ppp0", "eth0"],
+              "interfaces": {"ppp0": {...}, "eth0": {...}},
+              "aliases": {"ppp0": "wwan0"},
+              "scores": {"eth0": 20.5},
+              "tolerance": 10
+            }
+            Interfaces are indexed by actual name; names in "configs" may be
+            either the alias or the actual name.
+
+    Returns:
+        Array of default routes in the order of "configs", each with
+        "interface", "actualIface" and "gateway" as GET
+        /network/routes/default, empty if none is available.
+    """
+    names = dict((alias, actual)
+                 for actual, alias in snapshot.get("aliases", {}).iteritems())
+    memo = {}
+    results = []
+    for config in configs:
+        key = json.dumps(config, sort_keys=True)
+        if key not in memo:
+            memo[key] = _evaluate(config, snapshot, names)
+        results.append(copy.deepcopy(memo[key]))
+    return results
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import heapq
+import logging
+import itertools
+from collections import deque
+from threading import Condition
+from threading import Thread
+from time import time
+
+
+_logger = logging.getLogger("sanji.route.engine")
+
+
+class EventLoop(object):
+    """
+    Single-threaded loop of tasks and timers.
+
+    Tasks posted from any thread run one by one in the loop thread, so
+    the callers never wait on each other. Tasks posted with a "key" are
+    coalesced: a task is dropped if one with the same key is still pending.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._tasks = deque()
+        self._pending = set()
+        # heap of [when, seq, func, args, interval]
+        self._timers = []
+        self._seq = itertools.count()
+        self._running = False
+        self._thread = None
+
+    def post(self, func, *args, **kwargs):
+        """Queue a task, return False if coalesced with a pending one.
+        """
+        key = kwargs.pop("key", None)
+        with self._cond:
+            if key is not None:
+                if key in self._pending:
+                    return False
+                self._pending.add(key)
+            self._tasks.append((key, func, args))
+            self._cond.notify()
+        return True
+
+    def call_later(self, delay, func, *args):
+        """Run "func" after "delay" seconds, return a handle to cancel.
+        """
+        return self._add_timer(delay, func, args, None)
+
+    def call_every(self, interval, func, *args):
+        """Run "func" every "interval" seconds, return a handle to cancel.
+        """
+        return self._add_timer(interval, func, args, interval)
+
+    def _add_timer(self, delay, func, args, interval):
+        timer = [time() + delay, next(self._seq), func, args, interval]
+        with self._cond:
+            heapq.heappush(self._timers, timer)
+            self._cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        with self._cond:
+            timer[2] = None
+
+    def pending(self):
+        with self._cond:
+            return len(self._tasks)
+
+    def _next(self):
+        """Wait for the next task or expired timer.
+        """
+        with self._cond:
+            while self._running:
+                if self._tasks:
+                    key, func, args = self._tasks.popleft()
+                    self._pending.discard(key)
+                    return func, args
+
+                timeout = None
+                while self._timers and self._timers[0][2] is None:
+                    heapq.heappop(self._timers)
+                if self._timers:
+                    timer = self._timers[0]
+                    timeout = timer[0] - time()
+                    if timeout <= 0:
+                        heapq.heappop(self._timers)
+                        if timer[4]:
+                            timer[0] = time() + timer[4]
+                            heapq.heappush(self._timers, timer)
+                        return timer[2], timer[3]
+                self._cond.wait(timeout)
+        return None, None
+
+    def run(self):
+        """Run tasks until stop(), block the calling thread.
+        """
+        self._running = True
+        while True:
+            func, args = self._next()
+            if func is None:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                _logger.warning("Task {} failed: {}".format(func, e))
+
+    def start(self):
+        """Run the loop in a daemon thread.
+        """
+        self._running = True
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
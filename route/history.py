@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import json
+import logging
+from array import array
+from threading import Lock
+from time import time
+
+
+_logger = logging.getLogger("sanji.route.history")
+
+
+class History(object):
+    """
+    Default route transitions in a fixed-size ring buffer.
+
+    Timestamps and durations are kept in arrays, the other fields in a
+    preallocated list of tuples. If "path" is given, each transition is also
+    appended to the file as a line of JSON, the file is rotated to
+    "<path>.1" when it exceeds "max_bytes".
+    """
+
+    SIZE = 256
+    MAX_BYTES = 1024 * 1024
+
+    def __init__(self, size=SIZE, path=None, max_bytes=MAX_BYTES):
+        self._lock = Lock()
+        self._size = size
+        self._times = array("d", [0.0] * size)
+        self._durations = array("f", [0.0] * size)
+        # (family, old interface, old gateway, new interface, new gateway,
+        #  trigger)
+        self._fields = [None] * size
+        self._index = 0
+        self._count = 0
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def record(self, old, new, trigger=None, duration=0, family=4, ts=None):
+        """
+        Add a transition.
+
+        Args:
+            old: previous default route, dict with "interface" and "gateway".
+            new: new default route, empty if deleted.
+            trigger: what caused the convergence, e.g. "update_iface_db".
+            duration: seconds spent to apply the new default route.
+            family: 4 or 6.
+        """
+        ts = time() if ts is None else ts
+        fields = (family, old.get("interface"), old.get("gateway"),
+                  new.get("interface"), new.get("gateway"), trigger)
+        with self._lock:
+            index = self._index
+            self._times[index] = ts
+            self._durations[index] = duration
+            self._fields[index] = fields
+            self._index = (index + 1) % self._size
+            self._count = min(self._count + 1, self._size)
+        if self.path:
+            self._spill(self._to_dict(ts, duration, fields))
+
+    def _spill(self, record):
+        try:
+            if os.path.exists(self.path) and \
+                    os.path.getsize(self.path) > self.max_bytes:
+                os.rename(self.path, self.path + ".1")
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except (IOError, OSError) as e:
+            _logger.warning("Failed to write history: {}".format(e))
+
+    @staticmethod
+    def _to_dict(ts, duration, fields):
+        family, old_iface, old_gw, new_iface, new_gw, trigger = fields
+        return {
+            "time": ts,
+            "family": family,
+            "from": {"interface": old_iface, "gateway": old_gw},
+            "to": {"interface": new_iface, "gateway": new_gw},
+            "trigger": trigger,
+            "duration": round(duration * 1000, 3)
+        }
+
+    def _match(self, ts, since, until):
+        return (since is None or ts >= since) and \
+            (until is None or ts <= until)
+
+    def records(self, since=None, until=None, limit=None):
+        """
+        Return transitions in the time range, the newest first. Older ones
+        are read from the spill file if the buffer does not cover "since".
+
+        Args:
+            since: only transitions at or after the timestamp.
+            until: only transitions at or before the timestamp.
+            limit: max. number of records.
+        """
+        with self._lock:
+            entries = []
+            for i in xrange(self._count):
+                index = (self._index - 1 - i) % self._size
+                entries.append((self._times[index], self._durations[index],
+                                self._fields[index]))
+            full = self._count == self._size
+
+        data = [self._to_dict(*entry) for entry in entries
+                if self._match(entry[0], since, until)]
+        if limit and len(data) >= limit:
+            return data[:limit]
+
+        oldest = entries[-1][0] if entries else None
+        if self.path and full and (since is None or since < oldest):
+            data += self._load(since, min(until, oldest) if until else oldest)
+        return data[:limit] if limit else data
+
+    def _load(self, since, before):
+        """Read the spilled transitions older than "before", newest first.
+        """
+        data = []
+        for path in [self.path, self.path + ".1"]:
+            try:
+                with open(path) as f:
+                    lines = f.readlines()
+            except IOError:
+                continue
+            for line in reversed(lines):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["time"] < before and \
+                        self._match(record["time"], since, None):
+                    data.append(record)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._index = 0
+            self._count = 0
+            self._fields = [None] * self._size
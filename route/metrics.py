@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from bisect import bisect_left
+from threading import Lock
+from time import time
+
+
+# upper bounds of histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._metrics._observe(
+            self._name, self._labels, time() - self._start,
+            "error" if type else None)
+        return False
+
+
+class Metrics(object):
+    """
+    Counters and latency histograms for the hot paths.
+
+    Blocks failed in timer() "<name>_seconds" are also counted in
+    "<name>_errors_total". Set "enabled" to False to make all calls no-op.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = Lock()
+        # { ("route_command_seconds", (("cmd", "ip.route.show"),)): [...] }
+        self._histograms = {}
+        # { ("route_publish_total", (("event", "wan"),)): 3 }
+        self._counters = {}
+
+    def timer(self, name, **labels):
+        """Context manager to observe the duration of the block.
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name, tuple(sorted(labels.items())))
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        self._observe(name, tuple(sorted(labels.items())), seconds, None)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, seconds, error):
+        with self._lock:
+            key = (name, labels)
+            hist = self._histograms.get(key)
+            if hist is None:
+                # [bucket counts..., +Inf count, sum, count]
+                hist = [0] * (len(BUCKETS) + 3)
+                self._histograms[key] = hist
+            hist[bisect_left(BUCKETS, seconds)] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+            if error:
+                key = (name.rsplit("_seconds", 1)[0] + "_errors_total",
+                       labels)
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def snapshot(self):
+        """
+        Return:
+            dict format of counters and histograms, for example:
+            {
+              "enabled": true,
+              "counters": [{"name": "...", "labels": {...}, "value": 1}],
+              "histograms": [{
+                "name": "route_command_seconds",
+                "labels": {"cmd": "ip.route.show"},
+                "buckets": {"0.001": 3, ..., "+Inf": 5},
+                "sum": 0.012,
+                "count": 5
+              }]
+            }
+        """
+        with self._lock:
+            counters = self._counters.items()
+            histograms = [(key, list(hist))
+                          for key, hist in self._histograms.iteritems()]
+
+        data = {"enabled": self.enabled, "counters": [], "histograms": []}
+        for (name, labels), value in sorted(counters):
+            data["counters"].append(
+                {"name": name, "labels": dict(labels), "value": value})
+        for (name, labels), hist in sorted(histograms):
+            buckets = {}
+            total = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), hist[:-2]):
+                total += count
+                buckets[str(bound)] = total
+            data["histograms"].append({
+                "name": name,
+                "labels": dict(labels),
+                "buckets": buckets,
+                "sum": hist[-2],
+                "count": hist[-1]})
+        return data
+
+    def prometheus(self):
+        """Dump in Prometheus text exposition format.
+        """
+        def _labels(labels, extra=None):
+            items = labels.items()
+            if extra:
+                items.append(extra)
+            if not items:
+                return ""
+            return "{%s}" % ",".join(
+                "%s=\"%s\"" % (k, v) for k, v in sorted(items))
+
+        data = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in data["counters"]:
+            if counter["name"] not in typed:
+                typed.add(counter["name"])
+                lines.append("# TYPE %s counter" % counter["name"])
+            lines.append("%s%s %s" % (
+                counter["name"], _labels(counter["labels"]),
+                counter["value"]))
+        for hist in data["histograms"]:
+            name = hist["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s histogram" % name)
+            for bound in BUCKETS + ("+Inf",):
+                lines.append("%s_bucket%s %d" % (
+                    name, _labels(hist["labels"], ("le", str(bound))),
+                    hist["buckets"][str(bound)]))
+            lines.append("%s_sum%s %f" % (
+                name, _labels(hist["labels"]), hist["sum"]))
+            lines.append("%s_count%s %d" % (
+                name, _labels(hist["labels"]), hist["count"]))
+        return "\n".join(lines) + "\n"
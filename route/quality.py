@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from array import array
+from threading import Lock
+
+
+def rank(candidates, scores, tolerance=0):
+    """Order "candidates" (in priority order) by "scores".
+
+    The first one is the highest priority link within "tolerance" of the best
+    score; the others follow by score. Links without score are ranked last in
+    priority order.
+    """
+    scored = sorted((scores[iface], index, iface)
+                    for index, iface in enumerate(candidates)
+                    if scores.get(iface) is not None)
+    if not scored:
+        return list(candidates)
+    unscored = [iface for iface in candidates if scores.get(iface) is None]
+
+    best = scored[0][0]
+    first = min((index, iface) for score, index, iface in scored
+                if score <= best + tolerance)[1]
+    return [first] + [iface for _, _, iface in scored
+                      if iface != first] + unscored
+
+
+class LinkStats(object):
+    """
+    Rolling statistics of one link from probe results.
+
+    The latest "window" samples are kept in fixed-size arrays, and RTT, loss
+    rate and jitter are tracked as EWMA with the factor "alpha", so that the
+    memory is constant however many samples are added.
+    """
+
+    def __init__(self, window=16, alpha=0.3):
+        self.alpha = alpha
+        # RTT in milliseconds and lost flags of the latest samples
+        self._rtts = array("d", [0.0] * window)
+        self._lost = array("B", [0] * window)
+        self._index = 0
+        self._count = 0
+        self._last = None
+        self.rtt = None
+        self.loss = 0.0
+        self.jitter = 0.0
+
+    def add(self, rtt):
+        """Add a probe result, "rtt" in milliseconds or None if lost.
+        """
+        window = len(self._rtts)
+        self._rtts[self._index] = rtt if rtt is not None else 0.0
+        self._lost[self._index] = 1 if rtt is None else 0
+        self._index = (self._index + 1) % window
+        self._count = min(self._count + 1, window)
+
+        alpha = self.alpha
+        if 1 == self._count:
+            self.loss = 1.0 if rtt is None else 0.0
+        else:
+            self.loss += alpha * ((1.0 if rtt is None else 0.0) - self.loss)
+        if rtt is None:
+            return
+
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += alpha * (rtt - self.rtt)
+        if self._last is not None:
+            self.jitter += alpha * (abs(rtt - self._last) - self.jitter)
+        self._last = rtt
+
+    def samples(self):
+        return self._count
+
+    def window_loss(self):
+        """Loss rate of the samples in the window.
+        """
+        if not self._count:
+            return 0.0
+        return float(sum(self._lost)) / self._count
+
+    def window_rtt(self):
+        """(min, max) RTT of the replied samples in the window.
+        """
+        rtts = [self._rtts[i] for i in xrange(self._count)
+                if not self._lost[i]]
+        if not rtts:
+            return None, None
+        return min(rtts), max(rtts)
+
+    def score(self, weights):
+        """Weighted cost of the link, lower is better; None without samples.
+
+        A link that never replied is scored by its loss only.
+        """
+        if not self._count:
+            return None
+        score = weights.get("loss", 0) * self.loss * 100
+        if self.rtt is not None:
+            score += weights.get("rtt", 0) * self.rtt
+            score += weights.get("jitter", 0) * self.jitter
+        return score
+
+    def to_dict(self, weights):
+        rtt_min, rtt_max = self.window_rtt()
+        return {
+            "rtt": self.rtt,
+            "loss": round(self.loss, 4),
+            "jitter": round(self.jitter, 3),
+            "samples": self._count,
+            "windowLoss": round(self.window_loss(), 4),
+            "windowRtt": {"min": rtt_min, "max": rtt_max},
+            "score": self.score(weights)
+        }
+
+
+class LinkQuality(object):
+    """
+    Statistics of all WAN links and the ranking of candidates by score.
+
+    Args:
+        window: number of samples kept per link.
+        alpha: EWMA factor of the new sample.
+        weights: dict format of cost per unit, for example:
+            {"rtt": 1, "jitter": 2, "loss": 5}
+            RTT and jitter are in milliseconds and loss in percent.
+        tolerance: links scored within "tolerance" of the best one are tied,
+            and the tie is broken by the priority list.
+    """
+
+    def __init__(self, window=16, alpha=0.3, weights=None, tolerance=10.0):
+        self._lock = Lock()
+        self._links = {}
+        self.configure(window, alpha, weights, tolerance)
+
+    def configure(self, window=16, alpha=0.3, weights=None, tolerance=10.0):
+        """Apply settings, samples are dropped if the window is changed.
+        """
+        with self._lock:
+            if getattr(self, "window", window) != window:
+                self._links = {}
+            self.window = window
+            self.alpha = alpha
+            self.weights = dict(weights or {"rtt": 1, "jitter": 2, "loss": 5})
+            self.tolerance = tolerance
+            for stats in self._links.itervalues():
+                stats.alpha = alpha
+
+    def add(self, iface, rtt):
+        with self._lock:
+            stats = self._links.get(iface)
+            if stats is None:
+                stats = LinkStats(self.window, self.alpha)
+                self._links[iface] = stats
+            stats.add(rtt)
+
+    def prune(self, ifaces):
+        """Drop the statistics of links not in "ifaces".
+        """
+        with self._lock:
+            for iface in self._links.keys():
+                if iface not in ifaces:
+                    del self._links[iface]
+
+    def score(self, iface):
+        with self._lock:
+            stats = self._links.get(iface)
+            return stats.score(self.weights) if stats else None
+
+    def rank(self, candidates):
+        """Order "candidates" (in priority order) by score, see rank().
+        """
+        return rank(candidates, self.scores(candidates), self.tolerance)
+
+    def scores(self, ifaces):
+        """Scores of the links in "ifaces" which have samples.
+        """
+        with self._lock:
+            return dict((iface, self._links[iface].score(self.weights))
+                        for iface in ifaces if iface in self._links)
+
+    def snapshot(self):
+        with self._lock:
+            return dict((iface, stats.to_dict(self.weights))
+                        for iface, stats in self._links.iteritems())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from threading import Lock
+from time import time
+
+
+class TokenBucket(object):
+    """
+    Allow "rate" operations per second on average with bursts of "burst".
+
+    Args:
+        clock: function returning the current time in seconds.
+    """
+
+    def __init__(self, rate=1.0, burst=5, clock=time):
+        self.rate = float(rate)
+        self.burst = burst
+        self._clock = clock
+        self._lock = Lock()
+        self._tokens = float(burst)
+        self._ts = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def take(self):
+        """Take a token, return False if none is left.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def delay(self):
+        """Seconds until a token is available.
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class Backoff(object):
+    """
+    Exponential backoff after failures: "base" seconds after the first one,
+    doubled on each following one up to "cap", cleared by a success.
+    """
+
+    def __init__(self, base=1.0, cap=60.0, clock=time):
+        self.base = base
+        self.cap = cap
+        self._clock = clock
+        self.failures = 0
+        self._until = 0
+
+    def failure(self):
+        """Record a failure, return the seconds to wait.
+        """
+        delay = min(self.cap, self.base * (2 ** self.failures))
+        self.failures += 1
+        self._until = self._clock() + delay
+        return delay
+
+    def success(self):
+        self.failures = 0
+        self._until = 0
+
+    def delay(self):
+        """Seconds left to wait, 0 if ready.
+        """
+        return max(0.0, self._until - self._clock())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import re
+import socket
+import tempfile
+
+
+HEADER = "# Generated by sanji-bundle-route, do not edit.\n"
+
+_scope_regex = re.compile(r"^[A-Za-z0-9_.-]{1,15}\Z")
+
+
+def valid(server):
+    """Whether "server" is an IPv4 or IPv6 address, with an optional zone
+    index (e.g. "fe80::1%eth0"); anything else may inject resolver lines.
+    """
+    address, _, scope = server.partition("%")
+    if scope and (":" not in address or not _scope_regex.match(scope)):
+        return False
+    for family in [socket.AF_INET, socket.AF_INET6]:
+        try:
+            socket.inet_pton(family, address)
+            return True
+        except (socket.error, TypeError, ValueError, UnicodeError):
+            pass
+    return False
+
+
+def nameservers(routes, default, interfaces):
+    """
+    DNS servers in order: the ones of the default interface first, then the
+    ones of the other interfaces in "routes" as fallbacks, without duplicates.
+    Invalid addresses are skipped.
+
+    Args:
+        routes: interfaces in priority order, e.g. the available WANs.
+        default: interface of the default route.
+        interfaces: interface database with "dns" lists.
+    """
+    servers = []
+    order = [default] if default else []
+    order += [iface for iface in routes if iface != default]
+    for iface in order:
+        for server in interfaces.get(iface, {}).get("dns") or []:
+            if server and server not in servers and valid(server):
+                servers.append(server)
+    return servers
+
+
+def render(servers):
+    return HEADER + "".join("nameserver %s\n" % server for server in servers)
+
+
+def write(path, content):
+    """
+    Replace the file by "content" atomically (a temporary file in the same
+    directory renamed over it), only if the content is different. The target
+    of a symbolic link is replaced.
+
+    Returns:
+        True if the file was written.
+    """
+    path = os.path.realpath(path)
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except IOError:
+        pass
+
+    fd, tmp = tempfile.mkstemp(prefix=".resolv.", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return True
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import threading
+from collections import deque
+from time import time
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, attrs):
+        self._tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+
+    def __enter__(self):
+        self._start = time()
+        self._tracer._push(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._duration = time() - self._start
+        if type:
+            self.attrs["error"] = "{}: {}".format(type.__name__, value)
+        self._tracer._pop(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": self._start,
+            "duration": round(self._duration * 1000, 3),
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+class Tracer(object):
+    """
+    Record span trees of convergence into a fixed-size ring buffer.
+
+    A span opened without a parent in the same thread is a root, it is put
+    into the buffer when it is closed.
+    """
+
+    SIZE = 64
+
+    def __init__(self, size=SIZE, enabled=True):
+        self.enabled = enabled
+        self._records = deque(maxlen=size)
+        self._local = threading.local()
+
+    def span(self, name, **attrs):
+        """Context manager of a span, "set()" to add attributes.
+        """
+        if not self.enabled:
+            return _null_span
+        return _Span(self, name, attrs)
+
+    def _push(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if stack:
+            stack[-1].children.append(span)
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = self._local.stack
+        stack.pop()
+        if not stack:
+            self._records.append(span.to_dict())
+
+    def records(self, limit=None, since=None):
+        """
+        Return recorded root spans, the newest first.
+
+        Args:
+            limit: max. number of records.
+            since: only records started after the timestamp.
+        """
+        data = [record for record in reversed(self._records)
+                if since is None or record["start"] > since]
+        return data[:limit] if limit else data
+
+    def clear(self):
+        self._records.clear()
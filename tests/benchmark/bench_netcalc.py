@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Per-call cost of the subnet calculation in ip.addr, ipcalc versus
+ip.netcalc (cold and memoized).
+
+    python tests/benchmark/bench_netcalc.py [loops]
+"""
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../")
+from ip import netcalc  # noqa
+
+try:
+    import ipcalc
+except ImportError:
+    ipcalc = None
+
+
+ADDRS = [("192.168.%d.%d" % (i / 250, i % 250 + 1), "255.255.255.0")
+         for i in range(1000)]
+
+
+def bench_ipcalc():
+    for ip, netmask in ADDRS:
+        net = ipcalc.Network("%s/%s" % (ip, netmask))
+        str(net.network())
+        str(net.netmask())
+        str(net.broadcast())
+
+
+def bench_netcalc_cold():
+    netcalc._cache.clear()
+    for ip, netmask in ADDRS:
+        netcalc.calc(ip, netmask)
+
+
+def bench_netcalc_cached():
+    for ip, netmask in ADDRS:
+        netcalc.calc(ip, netmask)
+
+
+def main(loops=20):
+    result = {}
+    cases = [("netcalc_cold", bench_netcalc_cold),
+             ("netcalc_cached", bench_netcalc_cached)]
+    if ipcalc:
+        cases.insert(0, ("ipcalc", bench_ipcalc))
+
+    bench_netcalc_cached()
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=loops))
+        result[name] = {"usec_per_call": best * 1e6 / len(ADDRS)}
+    print json.dumps(result, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
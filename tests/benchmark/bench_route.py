@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Route convergence benchmarks against the simulated backend in fakenet.
+
+    python tests/benchmark/bench_route.py [-s SCENARIO] [-o result.json]
+                                          [-c previous.json] [--ip-latency MS]
+
+Each scenario reports latency percentiles per operation, the number of
+simulated commands and syscalls and the objects left allocated, as JSON.
+"""
+
+import os
+import gc
+import sys
+import json
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+from time import time
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../")
+from route import IPRoute  # noqa
+from fakenet import FakeNet  # noqa
+
+ROOT = os.path.abspath(os.path.dirname(__file__) + "/../../")
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    def _register(func):
+        SCENARIOS[name] = func
+        return func
+    return _register
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class Bench(object):
+    """
+    Environment of one scenario: a fake backend and an IPRoute instance
+    with its own data directory.
+    """
+
+    def __init__(self, net, priority_list):
+        self.net = net
+        self.latencies = OrderedDict()
+        self._path = tempfile.mkdtemp(prefix="bench-route-")
+        os.mkdir(os.path.join(self._path, "config"))
+        os.mkdir(os.path.join(self._path, "data"))
+        shutil.copy(os.path.join(ROOT, "config", "mapping.json"),
+                    os.path.join(self._path, "config"))
+        with open(os.path.join(
+                self._path, "data", "route.json.factory"), "w") as f:
+            json.dump(priority_list, f)
+        with open(os.path.join(
+                self._path, "data", "policy.json.factory"), "w") as f:
+            json.dump([], f)
+        shutil.copy(os.path.join(ROOT, "data", "quality.json.factory"),
+                    os.path.join(self._path, "data"))
+        self._patchers = net.patch()
+        self.route = None
+
+    def create(self):
+        self.route = self.measure(
+            "init", lambda: IPRoute(name="route", path=self._path))
+        return self.route
+
+    def measure(self, op, func, *args):
+        start = time()
+        result = func(*args)
+        self.latencies.setdefault(op, []).append((time() - start) * 1000)
+        return result
+
+    def close(self):
+        # cancel the deferred convergences before the real commands are back
+        if self.route:
+            self.route.stop()
+        self.net.unpatch(self._patchers)
+        shutil.rmtree(self._path, ignore_errors=True)
+
+    def report(self):
+        latency = OrderedDict()
+        for op, values in self.latencies.iteritems():
+            latency[op] = OrderedDict([
+                ("count", len(values)),
+                ("p50", percentile(values, 50)),
+                ("p90", percentile(values, 90)),
+                ("p99", percentile(values, 99)),
+                ("max", max(values))])
+        return OrderedDict([
+            ("latency_ms", latency),
+            ("calls", dict(self.net.calls))])
+
+
+def wan_db(name, index, **kwargs):
+    data = {"name": name, "gateway": "192.168.%d.254" % index,
+            "status": True, "wan": True}
+    data.update(kwargs)
+    return data
+
+
+def setup_wans(net, count):
+    for i in xrange(count):
+        net.add_link("eth%d" % i, "192.168.%d.1" % i)
+
+
+@scenario("cold_start")
+def cold_start(net, args):
+    """
+    Construct the bundle, feed every interface once and converge.
+    """
+    setup_wans(net, args.ifaces)
+    net.cell_nodes["wwan0"] = "ppp0"
+    net.add_link("ppp0", "10.64.0.1", "255.255.255.255")
+    bench = Bench(net, ["wwan0"] + ["eth%d" % i for i in xrange(args.ifaces)])
+    try:
+        route = bench.create()
+        for i in xrange(args.ifaces):
+            bench.measure("update_iface_db", route.update_iface_db,
+                          wan_db("eth%d" % i, i))
+        bench.measure("update_iface_db", route.update_iface_db,
+                      wan_db("wwan0", 200, actualIface="ppp0"))
+        bench.measure("try_update_default",
+                      route.try_update_default, route._routes)
+        return bench.report()
+    finally:
+        bench.close()
+
+
+@scenario("wan_flap_storm")
+def wan_flap_storm(net, args):
+    """
+    Primary WAN flaps repeatedly, failover to the secondary and back.
+    """
+    setup_wans(net, max(args.ifaces, 2))
+    bench = Bench(net, ["eth0", "eth1"])
+    try:
+        route = bench.create()
+        for i in xrange(max(args.ifaces, 2)):
+            route.update_iface_db(wan_db("eth%d" % i, i))
+        net.reset_calls()
+        for i in xrange(args.events):
+            up = bool(i % 2)
+            net.set_carrier("eth0", up)
+            bench.measure("update_iface_db", route.update_iface_db,
+                          {"name": "eth0", "status": up})
+        return bench.report()
+    finally:
+        bench.close()
+
+
+@scenario("bulk_db_update")
+def bulk_db_update(net, args):
+    """
+    Update a DB of many interfaces record by record.
+    """
+    setup_wans(net, args.ifaces)
+    bench = Bench(net, ["eth%d" % i for i in xrange(args.ifaces)])
+    try:
+        route = bench.create()
+        net.reset_calls()
+        for loop in xrange(args.events / max(args.ifaces, 1) + 1):
+            for i in xrange(args.ifaces):
+                bench.measure("update_iface_db", route.update_iface_db,
+                              wan_db("eth%d" % i, i, dns=["8.8.%d.8" % loop]))
+        return bench.report()
+    finally:
+        bench.close()
+
+
+@scenario("large_route_table")
+def large_route_table(net, args):
+    """
+    Convergence and default route reads with a large routing table.
+    """
+    setup_wans(net, 2)
+    net.add_routes(args.routes)
+    bench = Bench(net, ["eth0", "eth1"])
+    try:
+        route = bench.create()
+        route.update_iface_db(wan_db("eth0", 0))
+        route.update_iface_db(wan_db("eth1", 1))
+        net.reset_calls()
+        for i in xrange(args.events / 10 + 1):
+            bench.measure("try_update_default",
+                          route.try_update_default, route._routes)
+            bench.measure("_get_default", route._get_default)
+            bench.measure("get_default", route.get_default)
+        return bench.report()
+    finally:
+        bench.close()
+
+
+@scenario("list_interfaces")
+def list_interfaces(net, args):
+    """
+    Interface collection with many non-candidate interfaces.
+    """
+    setup_wans(net, 2)
+    for i in xrange(args.ifaces):
+        net.add_link("vlan%d" % i, "172.16.%d.1" % (i % 256))
+    bench = Bench(net, ["eth0", "eth1"])
+    try:
+        route = bench.create()
+        route.update_iface_db(wan_db("eth0", 0))
+        route.update_iface_db(wan_db("eth1", 1))
+        net.reset_calls()
+        for i in xrange(args.events / 10 + 1):
+            bench.measure("list_interfaces", route.list_interfaces)
+        return bench.report()
+    finally:
+        bench.close()
+
+
+@scenario("candidate_scaling")
+def candidate_scaling(net, args):
+    """
+    Convergence with 10 to 1000 non-candidate VLAN interfaces, half of them
+    known to the database as LAN; the cost should stay flat.
+    """
+    scaling = OrderedDict()
+    latency = OrderedDict()
+    for count in [int(n) for n in args.scale.split(",")]:
+        net = FakeNet(net.latency)
+        setup_wans(net, 2)
+        for i in xrange(count):
+            net.add_link("vlan%d" % i, "172.16.%d.1" % (i % 256))
+        bench = Bench(net, ["eth0", "eth1"])
+        try:
+            route = bench.create()
+            route.update_iface_db(wan_db("eth0", 0))
+            route.update_iface_db(wan_db("eth1", 1))
+            for i in xrange(0, count, 2):
+                route.update_iface_db(
+                    {"name": "vlan%d" % i, "status": True, "wan": False})
+            net.reset_calls()
+            rounds = args.events / 10 + 1
+            for i in xrange(rounds):
+                bench.measure("try_update_default",
+                              route.try_update_default, route._routes)
+            report = bench.report()
+        finally:
+            bench.close()
+        stat = report["latency_ms"]["try_update_default"]
+        latency["try_update_default.%d" % count] = stat
+        scaling[str(count)] = OrderedDict([
+            ("p50", stat["p50"]),
+            ("calls_per_convergence", dict(
+                (cmd, float(calls) / rounds)
+                for cmd, calls in report["calls"].iteritems()))])
+    return OrderedDict([
+        ("latency_ms", latency),
+        ("calls", dict(net.calls)),
+        ("scaling", scaling)])
+
+
+def run(args):
+    latency = {"ip": args.ip_latency / 1000.0,
+               "sh": args.sh_latency / 1000.0,
+               "netifaces": args.netifaces_latency / 1000.0,
+               "sysfs": args.sysfs_latency / 1000.0}
+    results = OrderedDict()
+    for name, func in SCENARIOS.iteritems():
+        if args.scenario and name not in args.scenario:
+            continue
+        gc.collect()
+        objects = len(gc.get_objects())
+        result = func(FakeNet(latency), args)
+        gc.collect()
+        result["objects"] = len(gc.get_objects()) - objects
+        results[name] = result
+
+    with open(os.path.join(ROOT, "bundle.json")) as f:
+        version = json.load(f)["version"]
+    return OrderedDict([
+        ("version", version),
+        ("python", platform.python_version()),
+        ("params", OrderedDict(sorted(vars(args).items()))),
+        ("maxrss_kb", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+        ("scenarios", results)])
+
+
+def compare(previous, current):
+    """Ratio of p50/p99 latency and call counts, current/previous.
+    """
+    diff = OrderedDict()
+    for name, result in current["scenarios"].iteritems():
+        if name not in previous["scenarios"]:
+            continue
+        prev = previous["scenarios"][name]
+        item = OrderedDict()
+        for op, stat in result["latency_ms"].iteritems():
+            if op not in prev["latency_ms"]:
+                continue
+            for key in ("p50", "p99"):
+                base = prev["latency_ms"][op][key]
+                item["%s.%s" % (op, key)] = \
+                    round(stat[key] / base, 3) if base else None
+        for cmd, count in result["calls"].iteritems():
+            base = prev["calls"].get(cmd, 0)
+            item["calls.%s" % cmd] = \
+                round(float(count) / base, 3) if base else None
+        diff[name] = item
+    return diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-s", "--scenario", action="append",
+                        choices=SCENARIOS.keys())
+    parser.add_argument("-o", "--output", help="write result to file")
+    parser.add_argument("-c", "--compare", help="previous result file")
+    parser.add_argument("--ifaces", type=int, default=10)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--routes", type=int, default=10000)
+    parser.add_argument("--scale", default="10,100,1000",
+                        help="non-candidate interfaces of candidate_scaling")
+    parser.add_argument("--ip-latency", type=float, default=0,
+                        help="delay per ip command (ms)")
+    parser.add_argument("--sh-latency", type=float, default=0,
+                        help="delay per mapping command (ms)")
+    parser.add_argument("--netifaces-latency", type=float, default=0)
+    parser.add_argument("--sysfs-latency", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.ERROR)
+    result = run(args)
+    if args.compare:
+        with open(args.compare) as f:
+            result["compare"] = compare(json.load(f), result)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print output
+
+
+if __name__ == "__main__":
+    main()
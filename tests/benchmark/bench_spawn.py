@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Command launch latency: forking the bundle directly vs. the spawner.
+
+    python tests/benchmark/bench_spawn.py [-n COUNT] [--ballast MB]
+                                          [--command "ip route show"]
+                                          [-o result.json]
+
+The spawner is forked before the bundle modules are imported, as index.py
+does; "--ballast" grows the benchmark process further to emulate a larger
+interpreter. The "sh" module path is also measured if it is installed.
+"""
+
+import os
+import sys
+import json
+import argparse
+from time import time
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../../")
+from ip import process  # noqa
+
+process.start_spawner()
+
+import route  # noqa
+import sanji.core  # noqa
+import voluptuous  # noqa
+try:
+    import sh
+except ImportError:
+    sh = None
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(func, count):
+    latencies = []
+    for i in xrange(count):
+        start = time()
+        func()
+        latencies.append((time() - start) * 1000)
+    return OrderedDict([
+        ("count", count),
+        ("p50", percentile(latencies, 50)),
+        ("p90", percentile(latencies, 90)),
+        ("p99", percentile(latencies, 99)),
+        ("max", max(latencies))])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-n", "--count", type=int, default=200)
+    parser.add_argument("--ballast", type=int, default=32,
+                        help="extra memory of the bundle process (MB)")
+    parser.add_argument("--command", default="ip route show")
+    parser.add_argument("-o", "--output", help="write result to file")
+    args = parser.parse_args(argv)
+
+    # touch every page so that fork() has to copy the page tables
+    ballast = bytearray(args.ballast * 1024 * 1024)
+    for i in xrange(0, len(ballast), 4096):
+        ballast[i] = 1
+    command = args.command.split()
+
+    spawner = process._spawner
+    results = OrderedDict()
+    results["spawner"] = measure(lambda: process.run(*command), args.count)
+    process._spawner = None
+    results["direct"] = measure(lambda: process.run(*command), args.count)
+    process._spawner = spawner
+    if sh:
+        program = sh.Command(command[0])
+        results["sh"] = measure(lambda: program(*command[1:]), args.count)
+    process.stop_spawner()
+
+    output = json.dumps(OrderedDict([
+        ("params", OrderedDict(sorted(vars(args).items()))),
+        ("latency_ms", results)]), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print output
+
+
+if __name__ == "__main__":
+    main()
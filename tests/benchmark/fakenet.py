@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Simulated network backend for benchmarks: fake "ip", "sh", "dhclient",
+netifaces and sysfs state with configurable latency. Commands are served in
+place of ip.process.run().
+"""
+
+import re
+import time
+import socket
+from StringIO import StringIO
+
+from mock import patch
+
+from ip import process
+
+
+class FakeNet(object):
+    """
+    In-memory kernel state, all commands are counted in "calls".
+
+    Args:
+        latency: dict format of delay in seconds per command, for example:
+            {"ip": 0.002, "sh": 0.5, "netifaces": 0.0001, "sysfs": 0.00005}
+    """
+
+    AF_LINK = 17
+    AF_INET = socket.AF_INET
+    AF_INET6 = socket.AF_INET6
+
+    def __init__(self, latency=None):
+        self.latency = latency or {}
+        self.calls = {}
+        # { "eth0": {"mac": "", "up": True, "carrier": True, "inet": []} }
+        self.links = {}
+        # lines as "ip route show" output
+        self.routes = []
+        # { "wwan0": "ppp0" } for "cell_mgmt" mapping commands
+        self.cell_nodes = {}
+
+    def _call(self, cmd):
+        self.calls[cmd] = self.calls.get(cmd, 0) + 1
+        delay = self.latency.get(cmd, 0)
+        if delay:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        self.calls = {}
+
+    def add_link(self, name, ip="", netmask="255.255.255.0", up=True,
+                 carrier=True, mac="78:ac:c0:00:00:00"):
+        inet = []
+        if ip:
+            inet.append({"addr": ip, "netmask": netmask})
+        self.links[name] = {
+            "mac": mac, "up": up, "carrier": carrier, "inet": inet}
+
+    def set_carrier(self, name, carrier):
+        self.links[name]["carrier"] = carrier
+
+    def add_routes(self, count, dev="eth0"):
+        for i in xrange(count):
+            self.routes.append(
+                "10.%d.%d.0/24 via 192.168.0.254 dev %s" %
+                (i / 256 % 256, i % 256, dev))
+
+    # netifaces
+    def interfaces(self):
+        self._call("netifaces")
+        return ["lo"] + self.links.keys()
+
+    def ifaddresses(self, iface):
+        self._call("netifaces")
+        if iface not in self.links:
+            raise ValueError("You must specify a valid interface name.")
+        link = self.links[iface]
+        full = {self.AF_LINK: [{"addr": link["mac"]}]}
+        if link["inet"]:
+            full[self.AF_INET] = [dict(inet) for inet in link["inet"]]
+        return full
+
+    # sysfs
+    def open(self, path, *args, **kwargs):
+        self._call("sysfs")
+        match = re.match(r"^/sys/class/net/([^/]+)/(operstate|carrier)$",
+                         path)
+        if not match or match.group(1) not in self.links:
+            raise IOError("No such file or directory: '%s'" % path)
+        link = self.links[match.group(1)]
+        if match.group(2) == "operstate":
+            return StringIO("up\n" if link["up"] else "down\n")
+        return StringIO("1\n" if link["carrier"] else "0\n")
+
+    # commands, return (exit code, stdout)
+    def ip(self, *args):
+        self._call("ip")
+        if args[:2] == ("route", "show"):
+            return 0, "\n".join(self.routes)
+        if args[:2] == ("route", "del"):
+            for route in self.routes:
+                if route.split()[0] == args[2]:
+                    self.routes.remove(route)
+                    return 0, ""
+            return 2, ""
+        if args[:2] == ("route", "add"):
+            route = " ".join(args[2:])
+            if "via" in args and args[2] == "default":
+                route = "default via %s" % args[args.index("via") + 1]
+                if "dev" in args:
+                    route += " dev %s" % args[args.index("dev") + 1]
+            self.routes.insert(0, route)
+            return 0, ""
+        return 0, ""
+
+    def sh(self, *args):
+        self._call("sh")
+        match = re.search(r"cell_mgmt -i (\S+)", args[-1])
+        if match:
+            return 0, self.cell_nodes.get("wwan%s" % match.group(1), "")
+        return 0, ""
+
+    def dhclient(self, *args):
+        self._call("dhclient")
+        return 0, ""
+
+    def run(self, *args, **kwargs):
+        """Fake ip.process.run().
+        """
+        args = tuple(str(arg) for arg in args)
+        handler = getattr(self, args[0]) \
+            if args[0] in ("ip", "sh", "dhclient") else None
+        exit_code, stdout = handler(*args[1:]) if handler else (0, "")
+        result = process.Result(list(args), exit_code, stdout)
+        if exit_code not in kwargs.get("ok", (0,)):
+            raise process.CommandError(result)
+        return result
+
+    def stream(self, *args):
+        return iter([])
+
+    def patch(self):
+        """Patch the bundle to use this backend, return the patchers.
+        """
+        fake_netifaces = _FakeNetifaces(self)
+        patchers = [
+            patch("ip.addr.netifaces", fake_netifaces),
+            patch("ip.addr.open", self.open, create=True),
+            patch("ip.process.run", self.run),
+            patch("ip.process.stream", self.stream)
+        ]
+        for patcher in patchers:
+            patcher.start()
+        return patchers
+
+    @staticmethod
+    def unpatch(patchers):
+        for patcher in reversed(patchers):
+            patcher.stop()
+
+
+class _FakeNetifaces(object):
+
+    def __init__(self, net):
+        self.AF_LINK = net.AF_LINK
+        self.AF_INET = net.AF_INET
+        self.AF_INET6 = net.AF_INET6
+        self.interfaces = net.interfaces
+        self.ifaddresses = net.ifaddresses
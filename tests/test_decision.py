@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route import decision
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestDecision(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = {
+            "priorityList": ["ppp0", "eth0"],
+            "available": ["ppp0", "eth0"],
+            "interfaces": {
+                "ppp0": {"status": True, "wan": True, "alias": "wwan0"},
+                "eth0": {"status": True, "wan": True,
+                         "gateway": "192.168.3.254"},
+                "eth1": {"status": True, "wan": True,
+                         "gateway": "192.168.4.254"}
+            },
+            "aliases": {"ppp0": "wwan0"}
+        }
+
+    def test__choose_default(self):
+        """
+        choose_default: first available interface in the priority list
+        """
+        interfaces = self.snapshot["interfaces"]
+        self.assertEqual(
+            {"interface": "eth0", "status": True, "wan": True,
+             "gateway": "192.168.3.254"},
+            decision.choose_default(["eth1", "eth0"], ["eth0"], interfaces))
+        self.assertEqual(
+            {}, decision.choose_default(["eth1"], ["eth0"], interfaces))
+
+    def test__choose_default__scores(self):
+        """
+        choose_default: rank by scores, tie broken by the priority list
+        """
+        interfaces = self.snapshot["interfaces"]
+        self.assertEqual("eth1", decision.choose_default(
+            ["eth0", "eth1"], ["eth0", "eth1"], interfaces,
+            {"eth0": 100, "eth1": 20}, 10)["interface"])
+        self.assertEqual("eth0", decision.choose_default(
+            ["eth0", "eth1"], ["eth0", "eth1"], interfaces,
+            {"eth0": 25, "eth1": 20}, 10)["interface"])
+
+    def test__simulate(self):
+        """
+        simulate: evaluate each configuration against the snapshot
+        """
+        results = decision.simulate([
+            {},
+            {"priorityList": ["eth0", "wwan0"]},
+            {"interfaces": {"wwan0": {"status": False}}},
+            {"priorityList": ["eth1"], "available": ["eth1"]},
+            {"priorityList": ["eth1"]}
+        ], self.snapshot)
+        self.assertEqual([
+            {"interface": "wwan0", "actualIface": "ppp0"},
+            {"interface": "eth0", "gateway": "192.168.3.254"},
+            {"interface": "eth0", "gateway": "192.168.3.254"},
+            {"interface": "eth1", "gateway": "192.168.4.254"},
+            {}
+        ], results)
+        self.assertTrue(self.snapshot["interfaces"]["ppp0"]["status"])
+
+    @patch("route.decision._evaluate")
+    def test__simulate__memoized(self, mock_evaluate):
+        """
+        simulate: evaluate identical configurations once
+        """
+        mock_evaluate.return_value = {"interface": "eth0"}
+        results = decision.simulate(
+            [{"priorityList": ["eth0"]}] * 1000, self.snapshot)
+        self.assertEqual(1000, len(results))
+        self.assertEqual(1, mock_evaluate.call_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
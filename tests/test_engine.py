@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+from threading import Event
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.engine import EventLoop
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestEventLoopClass(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def test__post(self):
+        """
+        post: run tasks in order, coalesce the pending ones with same key
+        """
+        result = []
+        self.assertTrue(self.loop.post(result.append, 1, key="a"))
+        self.assertFalse(self.loop.post(result.append, 2, key="a"))
+        self.assertTrue(self.loop.post(result.append, 3))
+        self.loop.post(self.loop.stop)
+
+        self.loop.run()
+        self.assertEqual([1, 3], result)
+        self.assertTrue(self.loop.post(result.append, 4, key="a"))
+
+    def test__post__failed(self):
+        """
+        post: a failed task should not stop the loop
+        """
+        result = []
+        self.loop.post(lambda: 1 / 0)
+        self.loop.post(result.append, 1)
+        self.loop.post(self.loop.stop)
+
+        self.loop.run()
+        self.assertEqual([1], result)
+
+    def test__call_later(self):
+        """
+        call_later/call_every: run timers in the loop thread
+        """
+        done = Event()
+        result = []
+
+        def tick():
+            result.append("tick")
+            if len(result) == 3:
+                done.set()
+
+        self.loop.call_every(0.01, tick)
+        timer = self.loop.call_later(0.01, result.append, "cancelled")
+        self.loop.cancel(timer)
+        self.loop.start()
+
+        self.assertTrue(done.wait(5))
+        self.loop.stop()
+        self.assertNotIn("cancelled", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
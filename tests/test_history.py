@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.history import History
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestHistoryClass(unittest.TestCase):
+
+    def setUp(self):
+        self.history = History(size=3)
+
+    def test__record(self):
+        """
+        record: keep the latest transitions, the newest first
+        """
+        for i in xrange(5):
+            self.history.record(
+                {"interface": "eth0", "gateway": "192.168.3.254"},
+                {"interface": "eth%d" % i}, "run", 0.002, ts=i)
+
+        records = self.history.records()
+        self.assertEqual([4, 3, 2], [record["time"] for record in records])
+        self.assertEqual({"interface": "eth4", "gateway": None},
+                         records[0]["to"])
+        self.assertEqual("run", records[0]["trigger"])
+        self.assertEqual(2.0, records[0]["duration"])
+
+    def test__records__range(self):
+        """
+        records: filter by time range and limit
+        """
+        for i in xrange(3):
+            self.history.record({}, {"interface": "eth0"}, ts=i)
+
+        self.assertEqual(
+            [2, 1], [r["time"] for r in self.history.records(since=1)])
+        self.assertEqual(
+            [1, 0], [r["time"] for r in self.history.records(until=1)])
+        self.assertEqual(
+            [2], [r["time"] for r in self.history.records(limit=1)])
+
+
+class TestHistorySpill(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.history = History(
+            size=2, path=os.path.join(self.path, "history"), max_bytes=400)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test__records__spilled(self):
+        """
+        records: read transitions older than the buffer from the file
+        """
+        for i in xrange(5):
+            self.history.record({}, {"interface": "eth%d" % i}, ts=i)
+
+        self.assertTrue(os.path.exists(self.history.path + ".1"))
+        self.assertEqual(
+            [4, 3, 2, 1, 0],
+            [r["time"] for r in self.history.records()])
+        self.assertEqual(
+            [3, 2, 1], [r["time"] for r in self.history.records(1, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
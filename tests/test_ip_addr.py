@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from ip import addr
+    from ip import process
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+SHOW = [
+    "2: eth0    inet 192.168.31.36/24 brd 192.168.31.255 scope global eth0"
+    "\\       valid_lft forever preferred_lft forever",
+    "2: eth0    inet 10.0.0.1/8 scope global eth0:1"
+    "\\       valid_lft forever preferred_lft forever",
+    "3: eth1    inet 192.168.4.10/24 brd 192.168.4.255 scope global dynamic"
+    " eth1\\       valid_lft 85000sec preferred_lft 85000sec"
+]
+
+
+class TestIPAddr(unittest.TestCase):
+
+    def setUp(self):
+        addr._dhclient_scripts.clear()
+        self.commands = []
+
+        def run(*args, **kwargs):
+            self.commands.append(list(args))
+            if list(args[:5]) == ["ip", "-4", "-o", "addr", "show"]:
+                return process.Result(list(args), 0, "\n".join(SHOW))
+            return process.Result(list(args), 0)
+        patcher = patch("ip.addr.process.run", side_effect=run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test__addresses(self):
+        """
+        addresses: parse by label
+        """
+        addrs = addr.addresses()
+        self.assertEqual(
+            [{"ip": "192.168.31.36", "prefix": 24, "dynamic": False}],
+            addrs["eth0"])
+        self.assertEqual("10.0.0.1", addrs["eth0:1"][0]["ip"])
+        self.assertTrue(addrs["eth1"][0]["dynamic"])
+
+    @patch("ip.addr.dhclient_running", return_value=False)
+    def test__ifconfig__unchanged(self, mock_running):
+        """
+        ifconfig: nothing to do if the address is already set
+        """
+        self.assertFalse(addr.ifconfig("eth0", False, "192.168.31.36",
+                                       "255.255.255.0"))
+        self.assertEqual(1, len(self.commands))
+
+    @patch("ip.addr.dhclient_running", return_value=False)
+    def test__ifconfig__replace(self, mock_running):
+        """
+        ifconfig: flush and add a new address, aliases are kept
+        """
+        self.assertTrue(addr.ifconfig("eth0", False, "192.168.31.37", "24"))
+        self.assertEqual(
+            ["ip", "-force", "-batch", "-"], self.commands[1])
+
+    @patch("ip.addr.route.batch")
+    @patch("ip.addr.dhclient_running", return_value=False)
+    def test__ifconfig__dhcp(self, mock_running, mock_batch):
+        """
+        ifconfig: flush static addresses and start dhclient once
+        """
+        self.assertTrue(addr.ifconfig("eth0", True))
+        self.assertEqual(["ip", "-4", "addr", "flush", "label", "eth0"],
+                         self.commands[1])
+        self.assertEqual("dhclient", self.commands[2][0])
+        self.assertNotIn("-r", self.commands[2])
+
+        mock_running.return_value = True
+        del self.commands[:]
+        self.assertFalse(addr.ifconfig("eth0", True))
+        self.assertEqual(1, len(self.commands))
+
+    @patch("ip.addr.dhclient_running")
+    def test__ifconfig__static_from_dhcp(self, mock_running):
+        """
+        ifconfig: stop dhclient and add the address, leases are not deleted
+        """
+        mock_running.return_value = True
+        self.assertTrue(addr.ifconfig("eth1", False, "192.168.4.127", "24"))
+        self.assertEqual(["dhclient", "-r"], self.commands[1][:2])
+        self.assertEqual(
+            ["ip", "addr", "add", "192.168.4.127/24", "broadcast",
+             "192.168.4.255", "dev", "eth1"], self.commands[2])
+
+    @patch("ip.addr.route.batch")
+    @patch("ip.addr.interfaces", return_value=["eth0", "eth1", "eth2"])
+    @patch("ip.addr.dhclient_running", return_value=False)
+    def test__ifconfig_batch(self, mock_running, mock_interfaces,
+                             mock_batch):
+        """
+        ifconfig_batch: one batch for the addresses of all interfaces
+        """
+        changed = addr.ifconfig_batch([
+            {"iface": "eth0", "dhcpc": False, "ip": "192.168.31.36"},
+            {"iface": "eth1", "dhcpc": False, "ip": "192.168.4.10",
+             "netmask": "255.255.255.0"},
+            {"iface": "eth2", "dhcpc": False, "ip": "192.168.5.1"}])
+        self.assertEqual({"eth0": False, "eth1": True, "eth2": True}, changed)
+        self.assertEqual(1, len(self.commands))
+        commands = sorted(mock_batch.call_args[0][0])
+        self.assertEqual([
+            ["-4", "addr", "flush", "label", "eth1"],
+            ["addr", "add", "192.168.4.10/24", "broadcast", "192.168.4.255",
+             "dev", "eth1"],
+            ["addr", "add", "192.168.5.1/24", "broadcast", "192.168.5.255",
+             "dev", "eth2"]], commands)
+
+        with self.assertRaises(ValueError):
+            addr.ifconfig_batch([{"iface": "eth9", "dhcpc": True}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+from mock import call
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from ip import conntrack
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestIPConntrack(unittest.TestCase):
+
+    @patch("ip.conntrack.process.run")
+    def test__mark(self, mock_run):
+        """
+        mark: set and match only the bits of the mark
+        """
+        mock_run.return_value.stderr = \
+            "conntrack v1.4.4 (conntrack-tools): 3 flow entries have been " \
+            "updated.\n"
+        self.assertEqual(3, conntrack.mark("192.168.4.127", 0x100))
+        self.assertEqual(
+            ("conntrack", "-U", "-f", "ipv4", "--reply-dst", "192.168.4.127",
+             "--mark", "0x100/0x100"), mock_run.call_args[0])
+
+        conntrack.count(0x100)
+        self.assertEqual(
+            ("conntrack", "-L", "-f", "ipv4", "--mark", "0x100/0x100"),
+            mock_run.call_args[0])
+
+    @patch("ip.conntrack.process.run")
+    def test__restore_mark(self, mock_run):
+        """
+        restore_mark: not for the replies entering from the interface
+        """
+        conntrack.restore_mark(True, "eth1", 0x100)
+        self.assertEqual([
+            call("iptables", "-t", "mangle", "-I", "PREROUTING", "1",
+                 "!", "-i", "eth1", "-j", "CONNMARK", "--restore-mark",
+                 "--mask", "0x100"),
+            call("iptables", "-t", "mangle", "-I", "OUTPUT", "1",
+                 "-j", "CONNMARK", "--restore-mark", "--mask", "0x100")],
+            mock_run.call_args_list)
+
+        mock_run.reset_mock()
+        conntrack.restore_mark(False, "eth1", 0x100)
+        self.assertEqual([
+            call("iptables", "-t", "mangle", "-D", "PREROUTING",
+                 "!", "-i", "eth1", "-j", "CONNMARK", "--restore-mark",
+                 "--mask", "0x100", ok=(0, 1)),
+            call("iptables", "-t", "mangle", "-D", "OUTPUT",
+                 "-j", "CONNMARK", "--restore-mark", "--mask", "0x100",
+                 ok=(0, 1))],
+            mock_run.call_args_list)
+
+    @patch("ip.conntrack.process.run")
+    def test__clear_restore_mark(self, mock_run):
+        """
+        clear_restore_mark: remove the rules of the mark only
+        """
+        rules = {
+            "PREROUTING": [
+                "-P PREROUTING ACCEPT",
+                "-A PREROUTING ! -i eth1 -j CONNMARK --restore-mark "
+                "--nfmask 0x100 --ctmask 0x100",
+                "-A PREROUTING -j CONNMARK --restore-mark "
+                "--nfmask 0xff --ctmask 0xff"],
+            "OUTPUT": [
+                "-P OUTPUT ACCEPT",
+                "-A OUTPUT -j CONNMARK --restore-mark "
+                "--nfmask 0x100 --ctmask 0x100"]
+        }
+        mock_run.side_effect = \
+            lambda *args, **kwargs: rules[args[4]] if "-S" == args[3] else []
+
+        self.assertEqual(2, conntrack.clear_restore_mark(0x100))
+        self.assertIn(
+            call("iptables", "-t", "mangle", "-D", "PREROUTING", "!", "-i",
+                 "eth1", "-j", "CONNMARK", "--restore-mark", "--nfmask",
+                 "0x100", "--ctmask", "0x100", ok=(0, 1)),
+            mock_run.call_args_list)
+        self.assertEqual(
+            4, len(mock_run.call_args_list))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from ip import route
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestIPRoute(unittest.TestCase):
+
+    def test__command(self):
+        """
+        command: arguments for each family
+        """
+        self.assertEqual(
+            ["route", "add", "default", "dev", "eth0", "via", "192.168.3.254"],
+            route.command("add", "default", "eth0", "192.168.3.254"))
+        self.assertEqual(
+            ["-6", "route", "replace", "default", "dev", "eth0",
+             "via", "fe80::1"],
+            route.command("replace", "default", "eth0", "fe80::1", family=6))
+
+    def test__parse_event(self):
+        """
+        parse_event: default routes of "main" table only
+        """
+        self.assertEqual(
+            {"action": "add", "family": 4, "default": "192.168.3.254",
+             "dev": "eth0"},
+            route.parse_event("default via 192.168.3.254 dev eth0"))
+        self.assertEqual(
+            {"action": "del", "family": 4, "default": "", "dev": "ppp0"},
+            route.parse_event("Deleted default dev ppp0 scope link"))
+        self.assertEqual(
+            6, route.parse_event(
+                "default via fe80::1 dev eth0 proto ra metric 1024")["family"])
+        self.assertIsNone(route.parse_event(
+            "default via 192.168.3.254 dev eth0 table 100"))
+        self.assertIsNone(route.parse_event(
+            "192.168.3.0/24 dev eth0 proto kernel scope link"))
+
+    @patch("ip.route.process.run")
+    def test__batch(self, mock_run):
+        """
+        batch: one command per line, arguments cannot add commands
+        """
+        route.batch([["rule", "add", "from", "192.168.10.0/24", "table",
+                      100]])
+        self.assertEqual("rule add from 192.168.10.0/24 table 100\n",
+                         mock_run.call_args[1]["input"])
+
+        mock_run.reset_mock()
+        for arg in ["eth0\nroute flush table main", "eth0 table 1", ""]:
+            with self.assertRaises(ValueError):
+                route.batch([["rule", "add", "iif", arg, "table", "100"]])
+        mock_run.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.metrics import Metrics
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestMetricsClass(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test__observe(self):
+        """
+        observe: put the latency into cumulative buckets
+        """
+        self.metrics.observe("route_command_seconds", 0.002, cmd="ip")
+        self.metrics.observe("route_command_seconds", 2, cmd="ip")
+
+        hist = self.metrics.snapshot()["histograms"][0]
+        self.assertEqual({"cmd": "ip"}, hist["labels"])
+        self.assertEqual(2, hist["count"])
+        self.assertEqual(0, hist["buckets"]["0.001"])
+        self.assertEqual(1, hist["buckets"]["0.005"])
+        self.assertEqual(2, hist["buckets"]["5.0"])
+        self.assertEqual(2, hist["buckets"]["+Inf"])
+
+    def test__timer__error(self):
+        """
+        timer: count the failed blocks
+        """
+        with self.assertRaises(IOError):
+            with self.metrics.timer("route_command_seconds", cmd="ip"):
+                raise IOError
+
+        counters = self.metrics.snapshot()["counters"]
+        self.assertEqual(
+            [{"name": "route_command_errors_total",
+              "labels": {"cmd": "ip"},
+              "value": 1}],
+            counters)
+
+    def test__disabled(self):
+        """
+        enabled: nothing is collected if disabled
+        """
+        self.metrics.enabled = False
+        with self.metrics.timer("route_convergence_seconds"):
+            pass
+        self.metrics.inc("route_publish_total")
+
+        data = self.metrics.snapshot()
+        self.assertEqual([], data["counters"])
+        self.assertEqual([], data["histograms"])
+
+    def test__prometheus(self):
+        """
+        prometheus: dump in text exposition format
+        """
+        self.metrics.inc("route_drift_total", policy="enforce")
+        self.metrics.observe("route_convergence_seconds", 0.02)
+
+        text = self.metrics.prometheus()
+        self.assertIn("# TYPE route_drift_total counter\n", text)
+        self.assertIn("route_drift_total{policy=\"enforce\"} 1\n", text)
+        self.assertIn("# TYPE route_convergence_seconds histogram\n", text)
+        self.assertIn(
+            "route_convergence_seconds_bucket{le=\"0.05\"} 1\n", text)
+        self.assertIn("route_convergence_seconds_count 1\n", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
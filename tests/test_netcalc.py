@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from ip import netcalc
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestNetcalc(unittest.TestCase):
+
+    def test__calc(self):
+        """
+        calc: subnet information by dotted netmask
+        """
+        self.assertEqual(
+            ("192.168.31.0", "255.255.255.0", "192.168.31.255", 24),
+            netcalc.calc("192.168.31.36", "255.255.255.0"))
+
+    def test__calc__prefix(self):
+        """
+        calc: subnet information by prefix length
+        """
+        self.assertEqual(
+            ("10.0.0.0", "255.0.0.0", "10.255.255.255", 8),
+            netcalc.calc("10.1.2.3", "8"))
+        self.assertEqual(
+            ("10.1.2.3", "255.255.255.255", "10.1.2.3", 32),
+            netcalc.calc("10.1.2.3", 32))
+
+    def test__calc__invalid(self):
+        """
+        calc: invalid address or netmask
+        """
+        with self.assertRaises(ValueError):
+            netcalc.calc("192.168.31", "24")
+        with self.assertRaises(ValueError):
+            netcalc.calc("192.168.31.36", "255.0.255.0")
+        with self.assertRaises(ValueError):
+            netcalc.calc("192.168.31.36", "33")
+
+    def test__prefix2netmask(self):
+        """
+        prefix2netmask/netmask2prefix: convert between both formats
+        """
+        for prefix in range(0, 33):
+            mask = netcalc.prefix2netmask(prefix)
+            self.assertEqual(prefix, netcalc.netmask2prefix(mask))
+        self.assertEqual("255.255.240.0",
+                         netcalc.int2ip(netcalc.prefix2netmask(20)))
+
+    def test__contains(self):
+        """
+        contains: check if address is in the subnet
+        """
+        self.assertTrue(
+            netcalc.contains("192.168.31.0", "24", "192.168.31.254"))
+        self.assertFalse(
+            netcalc.contains("192.168.31.0", "255.255.255.0", "192.168.3.1"))
+
+    def test__cidr(self):
+        """
+        cidr: address with an optional prefix length, nothing else
+        """
+        self.assertEqual("192.168.10.0/24", netcalc.cidr(u"192.168.10.0/24"))
+        self.assertEqual("192.168.10.1", netcalc.cidr("192.168.10.1"))
+        for value in ["192.168.10.0/24\nroute flush table main",
+                      "192.168.10.0/ 24", "192.168.10.0/33", "eth0"]:
+            with self.assertRaises(ValueError):
+                netcalc.cidr(value)
+
+
+if __name__ == "__main__":
+    unittest.main()
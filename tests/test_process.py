@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import shutil
+import signal
+import tempfile
+import unittest
+from threading import Timer
+from time import time
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from ip import process
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestProcessFunctions(unittest.TestCase):
+
+    def setUp(self):
+        process.reset_stats()
+
+    def test__run(self):
+        """
+        run: return stdout, exit code and duration
+        """
+        result = process.run("sh", "-c", "echo a; echo b; echo c >&2")
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual("a\nb\n", str(result))
+        self.assertEqual(["a", "b"], list(result))
+        self.assertEqual("c\n", result.stderr)
+        self.assertFalse(result.timed_out)
+        self.assertGreaterEqual(result.duration, 0)
+
+    def test__run__input(self):
+        """
+        run: write input to stdin
+        """
+        self.assertEqual("x y\n", str(process.run("cat", input="x y\n")))
+
+    def test__run__error(self):
+        """
+        run: raise CommandError for unexpected exit codes
+        """
+        with self.assertRaises(process.CommandError) as cm:
+            process.run("sh", "-c", "echo failed >&2; exit 2")
+        self.assertEqual(2, cm.exception.exit_code)
+        self.assertEqual("failed\n", cm.exception.stderr)
+
+        result = process.run("sh", "-c", "exit 2", ok=(0, 2))
+        self.assertEqual(2, result.exit_code)
+
+    def test__run__timeout(self):
+        """
+        run: kill the process group after the deadline
+        """
+        start = time()
+        with self.assertRaises(process.CommandTimeout) as cm:
+            process.run("sh", "-c", "sleep 5 | cat", timeout=0.2)
+        self.assertLess(time() - start, 2)
+        self.assertTrue(cm.exception.result.timed_out)
+
+    def test__run__not_found(self):
+        """
+        run: raise OSError if the command does not exist
+        """
+        with self.assertRaises(OSError):
+            process.run("/nonexistent/command")
+
+    def test__stats(self):
+        """
+        stats: count calls, errors and timeouts per command
+        """
+        process.run("sh", "-c", "true")
+        with self.assertRaises(process.CommandError):
+            process.run("sh", "-c", "false")
+        with self.assertRaises(process.CommandTimeout):
+            process.run("sleep", "5", timeout=0.1, name="probe")
+
+        stats = process.stats()
+        self.assertEqual(2, stats["sh"]["count"])
+        self.assertEqual(1, stats["sh"]["errors"])
+        self.assertEqual(0, stats["sh"]["timeouts"])
+        self.assertEqual(1, stats["probe"]["timeouts"])
+        self.assertGreaterEqual(stats["probe"]["max"], 100)
+
+        process.reset_stats()
+        self.assertEqual({}, process.stats())
+
+    def test__name(self):
+        """
+        _name: program and the first subcommand
+        """
+        self.assertEqual("ip route",
+                         process._name(["/sbin/ip", "-6", "route", "show"]))
+        self.assertEqual("dhclient", process._name(["dhclient", "-r"]))
+
+    def test__stream(self):
+        """
+        stream: yield lines until the command exits
+        """
+        self.assertEqual(
+            ["1", "2"], list(process.stream("sh", "-c", "echo 1; echo 2")))
+
+
+class TestSpawner(unittest.TestCase):
+
+    def setUp(self):
+        process.reset_stats()
+        process.start_spawner()
+
+    def tearDown(self):
+        process.stop_spawner()
+
+    def test__run(self):
+        """
+        run: fork the commands from the spawner
+        """
+        result = process.run("sh", "-c", "echo $PPID; cat", input="x\n")
+        self.assertEqual([str(process._spawner.pid), "x"], list(result))
+
+        with self.assertRaises(process.CommandError) as cm:
+            process.run("sh", "-c", "echo failed >&2; exit 3")
+        self.assertEqual(3, cm.exception.exit_code)
+        self.assertEqual("failed\n", cm.exception.stderr)
+
+        with self.assertRaises(OSError):
+            process.run("/nonexistent/command")
+
+    def test__run__timeout(self):
+        """
+        run: the spawner kills the command after the deadline
+        """
+        with self.assertRaises(process.CommandTimeout):
+            process.run("sleep", "5", timeout=0.2)
+        self.assertEqual(1, process.stats()["sleep"]["timeouts"])
+
+    def test__run__fallback(self):
+        """
+        run: fork directly if the spawner is gone
+        """
+        os.kill(process._spawner.pid, 9)
+        os.waitpid(process._spawner.pid, 0)
+        self.assertEqual("ok\n", str(process.run("echo", "ok")))
+
+    def test__run__lost(self):
+        """
+        run: never run a command again if the spawner exits during it
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        output = os.path.join(path, "runs")
+        killer = Timer(0.3, os.kill, [process._spawner.pid, signal.SIGKILL])
+        killer.start()
+        with self.assertRaises(process.CommandError) as cm:
+            process.run("sh", "-c", "echo run >> %s; sleep 1" % output)
+        killer.join()
+        self.assertEqual(-1, cm.exception.exit_code)
+        with open(output) as f:
+            self.assertEqual("run\n", f.read())
+
+    def test__private(self):
+        """
+        spawner: not reachable by other processes through a socket name
+        """
+        with open("/proc/net/unix") as f:
+            self.assertNotIn("sanji-route-spawn", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
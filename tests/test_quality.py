@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.quality import LinkStats
+    from route.quality import LinkQuality
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestLinkStatsClass(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = LinkStats(window=4, alpha=0.5)
+
+    def test__add(self):
+        """
+        add: track EWMA of RTT, jitter and loss
+        """
+        self.stats.add(10.0)
+        self.stats.add(20.0)
+        self.assertEqual(15.0, self.stats.rtt)
+        self.assertEqual(5.0, self.stats.jitter)
+        self.assertEqual(0.0, self.stats.loss)
+
+        self.stats.add(None)
+        self.assertEqual(0.5, self.stats.loss)
+        self.assertEqual(15.0, self.stats.rtt)
+
+    def test__add__window(self):
+        """
+        add: keep only the latest samples in the window
+        """
+        for rtt in [None, None, 10.0, 30.0, 20.0, 40.0]:
+            self.stats.add(rtt)
+        self.assertEqual(4, self.stats.samples())
+        self.assertEqual(0.0, self.stats.window_loss())
+        self.assertEqual((10.0, 40.0), self.stats.window_rtt())
+        self.assertEqual(4, len(self.stats._rtts))
+
+    def test__score(self):
+        """
+        score: weighted cost, None without samples
+        """
+        weights = {"rtt": 1, "jitter": 2, "loss": 5}
+        self.assertIsNone(self.stats.score(weights))
+        self.stats.add(None)
+        self.assertEqual(500.0, self.stats.score(weights))
+        self.stats.add(10.0)
+        self.assertEqual(260.0, self.stats.score(weights))
+
+
+class TestLinkQualityClass(unittest.TestCase):
+
+    def setUp(self):
+        self.quality = LinkQuality(
+            window=4, alpha=0.5, weights={"rtt": 1}, tolerance=10)
+
+    def test__rank(self):
+        """
+        rank: lowest score first, unscored links last
+        """
+        self.quality.add("eth0", 100.0)
+        self.quality.add("eth1", 20.0)
+        self.assertEqual(
+            ["eth1", "eth0", "wwan0"],
+            self.quality.rank(["wwan0", "eth0", "eth1"]))
+
+    def test__rank__tie(self):
+        """
+        rank: priority list breaks ties within tolerance
+        """
+        self.quality.add("eth0", 25.0)
+        self.quality.add("eth1", 20.0)
+        self.assertEqual(["eth0", "eth1"],
+                         self.quality.rank(["eth0", "eth1"]))
+
+    def test__rank__no_samples(self):
+        """
+        rank: keep the priority list without samples
+        """
+        self.assertEqual(["eth1", "eth0"],
+                         self.quality.rank(["eth1", "eth0"]))
+
+    def test__configure(self):
+        """
+        configure: drop samples if the window is changed
+        """
+        self.quality.add("eth0", 25.0)
+        self.quality.configure(window=4, weights={"rtt": 1})
+        self.assertIn("eth0", self.quality.snapshot())
+        self.quality.configure(window=8, weights={"rtt": 1})
+        self.assertEqual({}, self.quality.snapshot())
+
+    def test__prune(self):
+        """
+        prune: drop links not listed
+        """
+        self.quality.add("eth0", 25.0)
+        self.quality.add("eth1", 25.0)
+        self.quality.prune(["eth1"])
+        self.assertEqual(["eth1"], self.quality.snapshot().keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.ratelimit import Backoff
+    from route.ratelimit import TokenBucket
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucketClass(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+
+    def test__take(self):
+        """
+        take: allow a burst, then refill by rate
+        """
+        self.assertEqual([True, True, True, False],
+                         [self.bucket.take() for i in xrange(4)])
+        self.assertEqual(0.5, self.bucket.delay())
+
+        self.clock.now += 0.5
+        self.assertTrue(self.bucket.take())
+        self.assertFalse(self.bucket.take())
+
+        self.clock.now += 100
+        self.assertEqual(0, self.bucket.delay())
+        self.assertEqual(3, sum(self.bucket.take() for i in xrange(5)))
+
+
+class TestBackoffClass(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.backoff = Backoff(base=1, cap=5, clock=self.clock)
+
+    def test__failure(self):
+        """
+        failure: double the delay up to the cap
+        """
+        self.assertEqual([1, 2, 4, 5, 5],
+                         [self.backoff.failure() for i in xrange(5)])
+        self.assertEqual(5, self.backoff.delay())
+        self.clock.now += 3
+        self.assertEqual(2, self.backoff.delay())
+
+    def test__success(self):
+        """
+        success: clear the backoff
+        """
+        self.backoff.failure()
+        self.backoff.success()
+        self.assertEqual(0, self.backoff.delay())
+        self.assertEqual(1, self.backoff.failure())
+
+
+if __name__ == "__main__":
+    unittest.main()
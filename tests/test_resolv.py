@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route import resolv
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestResolvFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test__nameservers(self):
+        """
+        nameservers: default interface first, then the others in order
+        """
+        interfaces = {
+            "eth0": {"dns": ["8.8.8.8", "8.8.4.4"]},
+            "eth1": {"dns": ["1.1.1.1", "8.8.8.8"]},
+            "wwan0": {}
+        }
+        self.assertEqual(
+            ["1.1.1.1", "8.8.8.8", "8.8.4.4"],
+            resolv.nameservers(["eth0", "wwan0", "eth1"], "eth1", interfaces))
+        self.assertEqual(
+            ["8.8.8.8", "8.8.4.4", "1.1.1.1"],
+            resolv.nameservers(["eth0", "eth1"], None, interfaces))
+
+    def test__nameservers__invalid(self):
+        """
+        nameservers: skip the entries other than IPv4 or IPv6 addresses
+        """
+        interfaces = {
+            "eth0": {"dns": ["8.8.8.8\noptions ndots:15", "dns.google",
+                             "1.1.1.1 ", "8.8.4.4%eth0", u"fe80::1%eth0",
+                             "2001:4860:4860::8888", "8.8.8.8"]}
+        }
+        self.assertEqual(
+            [u"fe80::1%eth0", "2001:4860:4860::8888", "8.8.8.8"],
+            resolv.nameservers(["eth0"], "eth0", interfaces))
+
+    def test__write(self):
+        """
+        write: replace the file only if the content is changed
+        """
+        path = os.path.join(self.path, "resolv.conf")
+        content = resolv.render(["8.8.8.8"])
+        self.assertTrue(resolv.write(path, content))
+        with open(path) as f:
+            self.assertEqual(content, f.read())
+
+        with patch("route.resolv.os.rename") as mock_rename:
+            self.assertFalse(resolv.write(path, content))
+            mock_rename.assert_not_called()
+
+        self.assertTrue(resolv.write(path, resolv.render(["1.1.1.1"])))
+        self.assertEqual(["resolv.conf"], os.listdir(self.path))
+
+    def test__write__symlink(self):
+        """
+        write: replace the target of a symbolic link
+        """
+        target = os.path.join(self.path, "run.conf")
+        link = os.path.join(self.path, "resolv.conf")
+        os.symlink(target, link)
+        resolv.write(link, resolv.render(["8.8.8.8"]))
+        self.assertTrue(os.path.islink(link))
+        with open(target) as f:
+            self.assertIn("nameserver 8.8.8.8\n", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
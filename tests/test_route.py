@@ -4,10 +4,16 @@
 
 import os
 import sys
+import shutil
 import logging
+import tempfile
 import unittest
 
 from mock import patch
+from threading import Event
+from threading import Thread
+from time import sleep
+from time import time
 
 try:
     sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
@@ -32,7 +38,11 @@ def mock_ip_addr_ifaddresses(iface):
                     "broadcast": "192.168.31.255",
                     "ip": "192.168.31.36",
                     "netmask": "255.255.255.0",
-                    "subnet": "192.168.31.0"}]}
+                    "subnet": "192.168.31.0"}],
+                "inet6": [{
+                    "ip": "2001:db8::36",
+                    "netmask": "ffff:ffff:ffff:ffff::",
+                    "scope": "global"}]}
     elif "eth1" == iface:
         return {"mac": "78:ac:c0:c1:a8:ff",
                 "link": False,
@@ -62,16 +72,19 @@ class TestIPRouteClass(unittest.TestCase):
         self.bundle = IPRoute(name=self.name, path=self.path)
 
     def tearDown(self):
+        # cancel the deferred convergence timers
+        self.bundle.stop()
         self.bundle = None
-        try:
-            os.remove("{}/data/{}.json".format(self.path, self.name))
-        except OSError:
-            pass
+        for name in [self.name, "policy", "quality"]:
+            try:
+                os.remove("{}/data/{}.json".format(self.path, name))
+            except OSError:
+                pass
 
-        try:
-            os.remove("{}/data/{}.json.backup".format(self.path, self.name))
-        except OSError:
-            pass
+            try:
+                os.remove("{}/data/{}.json.backup".format(self.path, name))
+            except OSError:
+                pass
 
     @patch("route.ip.addr.ifaddresses")
     @patch("route.ip.addr.interfaces")
@@ -97,15 +110,27 @@ class TestIPRouteClass(unittest.TestCase):
         self.assertIn("eth0", ifaces)
         self.assertIn("ppp0", ifaces)
 
+        ifaces, ifaces6 = self.bundle.list_interfaces(ipv6=True)
+        self.assertEqual(["eth0"], ifaces6)
+
+    @patch("route.ip.addr.ifaddresses")
     @patch("route.ip.addr.interfaces")
-    def test__list_interfaces__failed_get_ifaces(self, mock_interfaces):
+    def test__list_interfaces__candidates(self, mock_interfaces,
+                                          mock_ifaddresses):
         """
-        list_interfaces: failed to list the available interfaces
+        list_interfaces: inspect the WAN candidates only
         """
-        mock_interfaces.side_effect = IOError
+        mock_ifaddresses.side_effect = mock_ip_addr_ifaddresses
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True},
+            "eth1": {"status": True, "wan": False},
+            "ppp0": {"status": True, "wan": True}
+        }
 
-        ifaces = self.bundle.list_interfaces()
-        self.assertEqual({}, ifaces)
+        ifaces = self.bundle.list_interfaces(["eth1", "eth0", "vlan1"])
+        self.assertEqual(["eth0"], ifaces)
+        mock_ifaddresses.assert_called_once_with("eth0")
+        mock_interfaces.assert_not_called()
 
     @patch("route.ip.addr.ifaddresses")
     @patch("route.ip.addr.interfaces")
@@ -177,6 +202,942 @@ class TestIPRouteClass(unittest.TestCase):
         default = self.bundle.get_default()
         self.assertEqual({}, default)
 
+    @patch("route.ip.route.show")
+    def test__get_default__cached(self, mock_gateways):
+        """
+        get_default: reuse the kernel default route within DEFAULT_TTL
+        """
+        mock_gateways.return_value = [
+            {"default": "192.168.3.254", "dev": "eth0"}]
+
+        version = self.bundle.get_version()
+        default = self.bundle.get_default()
+        default["interface"] = "eth1"
+        self.assertEqual("eth0", self.bundle.get_default()["interface"])
+        self.assertEqual(version, self.bundle.get_version())
+        self.assertEqual(1, mock_gateways.call_count)
+
+    @patch("route.ip.route.show")
+    def test__get_default__expired(self, mock_gateways):
+        """
+        get_default: bump the version if the kernel default route changed
+        """
+        mock_gateways.return_value = [
+            {"default": "192.168.3.254", "dev": "eth0"}]
+        version = self.bundle.get_version()
+
+        mock_gateways.return_value = [
+            {"default": "192.168.4.254", "dev": "eth1"}]
+        self.bundle._default_ts = 0
+
+        self.assertEqual("eth1", self.bundle.get_default()["interface"])
+        self.assertGreater(self.bundle.get_version(), version)
+
+    @patch.object(IPRoute, "try_update_default")
+    def test__update_iface_db__version(self, mock_try_update_default):
+        """
+        update_iface_db: bump the version only if the record changed
+        """
+        self.bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.1"})
+        version = self.bundle._version
+        db = self.bundle.get_iface_db()
+        self.assertEqual("192.168.4.1", db["eth1"]["gateway"])
+
+        self.bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.1"})
+        self.assertEqual(version, self.bundle._version)
+
+        self.bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.2"})
+        self.assertGreater(self.bundle._version, version)
+        db = self.bundle.get_iface_db()
+        self.assertEqual("192.168.4.2", db["eth1"]["gateway"])
+
+    def test__bump_version__concurrent(self):
+        """
+        _bump_version: no increment is lost between threads
+        """
+        version = self.bundle._version
+
+        def bump():
+            for _ in range(2000):
+                self.bundle._bump_version()
+        threads = [Thread(target=bump) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(version + 16000, self.bundle._version)
+
+    @patch.object(IPRoute, "_get_default")
+    def test__observe_default__stale(self, mock_get_default):
+        """
+        observe_default: a slow read never overwrites a later one
+        """
+        deltas = []
+        self.bundle.set_delta_event_cb(deltas.append)
+        old = {"interface": "eth0", "gateway": "192.168.3.254"}
+        new = {"interface": "eth1", "gateway": "192.168.4.254"}
+        reading = Event()
+        release = Event()
+
+        def get_default():
+            if not reading.is_set():
+                reading.set()
+                release.wait()
+                return old
+            return new
+        mock_get_default.side_effect = get_default
+
+        # e.g. a GET handler, forked before the switch
+        handler = Thread(target=self.bundle._current_default)
+        handler.start()
+        reading.wait()
+        self.assertEqual(new, self.bundle._refresh_default())
+        release.set()
+        handler.join()
+
+        self.assertEqual(new, self.bundle._default)
+        self.assertEqual([], deltas)
+
+    @patch.object(IPRoute, "_get_priority_list")
+    @patch.object(IPRoute, "try_update_default")
+    def test__set_priority_list__aliases(self, mock_try_update_default,
+                                         mock_get_priority_list):
+        """
+        set_priority_list: a view cached before the aliases are resolved is
+        not served after
+        """
+        self.bundle._default = {"interface": "ppp0", "gateway": ""}
+        self.bundle._default_ts = time()
+
+        def get_priority_list():
+            # a GET in between
+            self.assertEqual("ppp0", self.bundle.get_default()["interface"])
+            self.bundle._alias = {"ppp0": "wwan0"}
+            return ["ppp0"]
+        mock_get_priority_list.side_effect = get_priority_list
+
+        self.bundle.set_priority_list(["wwan0"])
+        self.assertEqual("wwan0", self.bundle.get_default()["interface"])
+
+    @patch.object(IPRoute, "_get_priority_list")
+    @patch.object(IPRoute, "try_update_default")
+    def test__update_iface_db__noop(self, mock_try_update_default,
+                                    mock_get_priority_list):
+        """
+        update_iface_db: converge only if routing fields changed
+        """
+        mock_get_priority_list.return_value = ["eth1"]
+        self.bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.1"})
+        self.assertEqual(1, mock_try_update_default.call_count)
+
+        self.bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.1"})
+        self.bundle.update_iface_db(
+            {"name": "eth1", "mac": "78:ac:c0:c1:a8:ff", "dns": ["8.8.8.8"]})
+        self.assertEqual(1, mock_try_update_default.call_count)
+        self.assertEqual(1, mock_get_priority_list.call_count)
+        self.assertEqual(
+            ["8.8.8.8"], self.bundle.get_iface_db()["eth1"]["dns"])
+
+        self.bundle.update_iface_db({"name": "eth1", "status": False})
+        self.assertEqual(2, mock_try_update_default.call_count)
+
+    @patch("route.ip.process.run")
+    def test__get_priority_list__concurrent(self, mock_run):
+        """
+        get_priority_list: resolve the mappings concurrently with timeout
+        """
+        def mapping(*args, **kwargs):
+            sleep(0.2)
+            self.assertEqual(self.bundle.MAPPING_TIMEOUT, kwargs["timeout"])
+            return "ppp%s\n" % args[2].split()[2]
+        mock_run.side_effect = mapping
+        self.bundle.model.db = ["wwan0", "wwan1", "eth0", "wwan0"]
+
+        start = time()
+        self.assertEqual(["ppp0", "ppp1", "eth0", "ppp0"],
+                         self.bundle._get_priority_list())
+        self.assertLess(time() - start, 0.35)
+        self.assertEqual(2, mock_run.call_count)
+        self.assertEqual({"ppp0": "wwan0", "ppp1": "wwan1"},
+                         self.bundle._alias)
+
+    @patch.object(IPRoute, "try_update_default")
+    def test__update_iface_db__delta(self, mock_try_update_default):
+        """
+        update_iface_db: publish changed fields only
+        """
+        deltas = []
+        self.bundle.set_delta_event_cb(deltas.append)
+        self.bundle._interfaces = {
+            "ppp0": {
+                "status": True,
+                "wan": True,
+                "gateway": "192.168.7.254",
+                "alias": "wwan0"
+            }
+        }
+
+        self.bundle.update_iface_db(
+            {"name": "wwan0", "actualIface": "ppp0", "status": False})
+        self.bundle.update_iface_db(
+            {"name": "wwan0", "actualIface": "ppp0", "status": False})
+
+        self.assertEqual(1, len(deltas))
+        self.assertEqual(1, deltas[0]["seq"])
+        self.assertEqual(
+            [{"type": "iface",
+              "name": "wwan0",
+              "set": {"status": False, "actualIface": "ppp0"}}],
+            deltas[0]["changes"])
+
+    @patch("route.ip.route.show")
+    def test__get_default__delta(self, mock_gateways):
+        """
+        get_default: publish the changes of default route
+        """
+        deltas = []
+        self.bundle.set_delta_event_cb(deltas.append)
+        mock_gateways.return_value = [
+            {"default": "192.168.3.254", "dev": "eth0"}]
+        self.bundle.get_default()
+        self.assertEqual([], deltas)
+
+        mock_gateways.return_value = [
+            {"default": "192.168.3.254", "dev": "eth1"}]
+        self.bundle._default_ts = 0
+        snapshot = self.bundle.get_snapshot()
+
+        self.assertEqual(
+            [{"type": "default", "set": {"interface": "eth1"}}],
+            deltas[0]["changes"])
+        self.assertEqual(deltas[0]["seq"], snapshot["seq"])
+        self.assertEqual("eth1", snapshot["default"]["interface"])
+
+    @patch("route.ip.route.show")
+    def test__get_metrics(self, mock_gateways):
+        """
+        get_metrics: instrument the commands and convergence
+        """
+        mock_gateways.return_value = []
+        self.bundle.get_default()
+        self.bundle.try_update_default([])
+
+        names = [(hist["name"], hist["labels"]) for hist in
+                 self.bundle.get_metrics()["histograms"]]
+        self.assertIn(("route_command_seconds", {"cmd": "ip.route.show"}),
+                      names)
+        self.assertIn(("route_convergence_seconds", {}), names)
+        self.assertIn("route_convergence_seconds_count 1",
+                      self.bundle.get_metrics("prometheus"))
+
+        self.bundle.set_metrics(enable=False, reset=True)
+        self.bundle.get_default()
+        self.assertEqual([], self.bundle.get_metrics()["histograms"])
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__get_trace(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default):
+        """
+        get_trace: record each convergence as a span tree
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_get_default.return_value = {}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+
+        self.bundle.try_update_default(["eth0"])
+        mock_list_interfaces.return_value = ([], [])
+        self.bundle.try_update_default(["eth0"])
+
+        records = self.bundle.get_trace()
+        self.assertEqual(2, len(records))
+        self.assertEqual("failed", records[0]["attrs"]["outcome"])
+        self.assertEqual("convergence", records[1]["name"])
+        self.assertEqual("updated", records[1]["attrs"]["outcome"])
+        self.assertEqual(
+            ["list_interfaces", "mutation"],
+            [child["name"] for child in records[1]["children"]])
+        self.assertEqual(
+            ["get_default", "update_default"],
+            [child["name"]
+             for child in records[1]["children"][1]["children"]])
+        self.assertEqual(
+            ["eth0"], records[1]["children"][0]["attrs"]["interfaces"])
+        self.assertEqual(1, len(self.bundle.get_trace(limit=1)))
+
+    @patch.object(IPRoute, "try_update_default")
+    def test__update_iface_db__loop(self, mock_try_update_default):
+        """
+        update_iface_db: queue a coalesced convergence to the event loop
+        """
+        bundle = IPRoute(name=self.name, path=self.path, engine="loop")
+        bundle.update_iface_db({"name": "eth0", "gateway": "192.168.3.254"})
+        bundle.update_iface_db({"name": "eth1", "gateway": "192.168.4.254"})
+        mock_try_update_default.assert_not_called()
+        self.assertEqual(1, bundle._loop.pending())
+
+        bundle._loop.post(bundle._loop.stop)
+        bundle._loop.run()
+        mock_try_update_default.assert_called_once_with(["eth0"])
+        self.assertEqual(2, len(bundle.get_iface_db()))
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__lock(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default):
+        """
+        try_update_default: publish WAN without lock, skip stale snapshot
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_get_default.return_value = {}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+        locked = []
+        self.bundle.set_wan_event_cb(
+            lambda iface: locked.append(self.bundle._lock.locked()))
+
+        self.bundle._applied_version = self.bundle._version + 1
+        self.assertEqual(
+            "superseded", self.bundle._try_update_default(["eth0"]))
+        mock_update_default.assert_not_called()
+
+        self.bundle._applied_version = 0
+        self.assertEqual("updated", self.bundle._try_update_default(["eth0"]))
+        self.assertEqual([False], locked)
+
+    @patch("route.ip.route.replace")
+    @patch("route.ip.route.delete")
+    @patch("route.ip.route.show")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__ipv6(
+            self,
+            mock_list_interfaces,
+            mock_show,
+            mock_delete,
+            mock_replace):
+        """
+        try_update_default: converge IPv6 default route in the same pass
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], ["eth1"])
+        routes6 = [{"default": "fe80::2", "dev": "eth0", "metric": 1024}]
+
+        def show(table=None, family=4):
+            if 6 == family:
+                return list(routes6)
+            return [{"default": "192.168.3.254", "dev": "eth0"}]
+        mock_show.side_effect = show
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254",
+                     "gateway6": "fe80::1"}
+        }
+        self.bundle._default6 = {}
+        deltas = []
+        self.bundle.set_delta_event_cb(deltas.append)
+
+        def replace(dest, dev="", src="", table=None, family=4, metric=None):
+            routes6.insert(0, {"default": src, "dev": dev, "metric": metric})
+        mock_replace.side_effect = replace
+
+        self.assertEqual(
+            "unchanged", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_delete.assert_not_called()
+        mock_replace.assert_called_once_with(
+            "default", "eth1", "fe80::1", family=6,
+            metric=IPRoute.DEFAULT6_METRIC)
+        self.assertEqual("default6", deltas[0]["changes"][0]["type"])
+        self.assertEqual(
+            {"interface": "eth1", "gateway": "fe80::1",
+             "wan": True, "status": True},
+            self.bundle.get_default()["ipv6"])
+
+        # nothing to do once applied
+        self.bundle._try_update_default(["eth0", "eth1"])
+        self.assertEqual(1, mock_replace.call_count)
+
+    @patch("route.ip.addr.ifaddresses")
+    @patch("route.ip.route.replace")
+    @patch("route.ip.route.show")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__ipv6_ra_gateway(
+            self,
+            mock_list_interfaces,
+            mock_show,
+            mock_replace,
+            mock_ifaddresses):
+        """
+        try_update_default: use the router advertised gateway, never bind
+        the IPv6 default route to a broadcast link only
+        """
+        mock_list_interfaces.return_value = (
+            ["eth0", "eth1", "ppp0"], ["eth0", "eth1", "ppp0"])
+        routes6 = [{"default": "fe80::2", "dev": "eth1", "metric": 1024}]
+        mock_show.side_effect = lambda table=None, family=4: (
+            routes6 if 6 == family else
+            [{"default": "192.168.3.254", "dev": "eth0"}])
+        mock_ifaddresses.side_effect = mock_ip_addr_ifaddresses
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"},
+            "ppp0": {"status": True, "wan": True}
+        }
+
+        # eth0 has neither gateway6 nor a router advertisement
+        self.bundle._try_update_default(["eth0", "eth1"])
+        mock_replace.assert_called_once_with(
+            "default", "eth1", "fe80::2", family=6,
+            metric=IPRoute.DEFAULT6_METRIC)
+
+        mock_replace.reset_mock()
+        self.bundle._try_update_default(["ppp0", "eth1"])
+        mock_replace.assert_called_once_with(
+            "default", "ppp0", "", family=6, metric=IPRoute.DEFAULT6_METRIC)
+
+    @patch.object(IPRoute, "_defer")
+    @patch("route.ip.route.replace")
+    @patch("route.ip.route.show")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__ipv6_failed(
+            self,
+            mock_list_interfaces,
+            mock_show,
+            mock_replace,
+            mock_defer):
+        """
+        try_update_default: a failed IPv6 write backs off, not recorded
+        """
+        mock_list_interfaces.return_value = (["eth0"], ["eth0"])
+        mock_show.side_effect = lambda table=None, family=4: (
+            [] if 6 == family else
+            [{"default": "192.168.3.254", "dev": "eth0"}])
+        mock_replace.side_effect = Exception("RTNETLINK answers: No route")
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254",
+                     "gateway6": "fe80::1"}
+        }
+
+        self.bundle._try_update_default(["eth0"])
+        mock_replace.assert_called_once()
+        self.assertEqual(1, self.bundle._backoff.failures)
+        mock_defer.assert_called_once()
+        self.assertEqual(
+            [], [record for record in self.bundle.get_history()
+                 if 6 == record.get("family")])
+
+    @patch("route.ip.route.delete")
+    @patch("route.ip.route.show")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__ipv6_not_managed(
+            self,
+            mock_list_interfaces,
+            mock_show,
+            mock_delete):
+        """
+        try_update_default: keep IPv6 default route of other interfaces
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_show.side_effect = lambda table=None, family=4: (
+            [{"default": "fe80::1", "dev": "eth9"}] if 6 == family else
+            [{"default": "192.168.3.254", "dev": "eth0"}])
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+        self.bundle._default6 = {"interface": "eth9", "gateway": "fe80::1"}
+
+        self.bundle._try_update_default(["eth0"])
+        mock_delete.assert_not_called()
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__quality(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default):
+        """
+        try_update_default: choose the link with the best score
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.bundle._links.add("eth0", 300.0)
+        self.bundle._links.add("eth1", 20.0)
+
+        self.bundle._try_update_default(["eth0", "eth1"])
+        self.assertEqual(
+            "eth0", mock_update_default.call_args[0][0]["interface"])
+
+        mock_update_default.reset_mock()
+        self.bundle._quality.model.db["enable"] = True
+        self.bundle._try_update_default(["eth0", "eth1"])
+        self.assertEqual(
+            "eth1", mock_update_default.call_args[0][0]["interface"])
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__get_history(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default):
+        """
+        get_history: record the transitions with their trigger
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        self.bundle._routes = ["eth0"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+
+        self.bundle._request_convergence("update_iface_db")
+        history = self.bundle.get_history()
+        self.assertEqual(1, len(history))
+        self.assertEqual("update_iface_db", history[0]["trigger"])
+        self.assertEqual("eth1", history[0]["from"]["interface"])
+        self.assertEqual("eth0", history[0]["to"]["interface"])
+        self.assertEqual("192.168.3.254", history[0]["to"]["gateway"])
+        self.assertEqual([], self.bundle.get_history(
+            since=history[0]["time"] + 1))
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    def test__check_drift__enforce(self, mock_get_default,
+                                   mock_update_default):
+        """
+        check_drift: restore the default route changed by others
+        """
+        desired = {"interface": "eth0", "gateway": "192.168.3.254"}
+        self.bundle._desired = desired
+        mock_get_default.return_value = dict(desired)
+        self.bundle._check_drift()
+        mock_update_default.assert_not_called()
+
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        self.bundle._check_drift()
+        mock_update_default.assert_called_once_with(desired)
+        drift = self.bundle.get_drift()
+        self.assertEqual(1, drift["detected"])
+        self.assertEqual(1, drift["enforced"])
+        self.assertEqual({"eth1": 1}, drift["interfaces"])
+        self.assertEqual("drift", self.bundle.get_history()[0]["trigger"])
+
+    @patch.object(IPRoute, "_defer")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    def test__check_drift__deferred(self, mock_get_default,
+                                    mock_update_default, mock_defer):
+        """
+        check_drift: out of budget, report deferred instead of enforced
+        """
+        self.bundle._desired = {
+            "interface": "eth0", "gateway": "192.168.3.254"}
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        while self.bundle._bucket.take():
+            pass
+
+        self.bundle._check_drift()
+        mock_update_default.assert_not_called()
+        mock_defer.assert_called_once()
+        drift = self.bundle.get_drift()
+        self.assertEqual(0, drift["enforced"])
+        self.assertEqual(1, drift["deferred"])
+        self.assertEqual("deferred", drift["last"]["action"])
+        self.assertEqual([], self.bundle.get_history())
+
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__check_drift__alert(self, mock_list_interfaces,
+                                 mock_get_default, mock_update_default):
+        """
+        check_drift: report the change once, leave it until the interfaces
+        are changed
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        self.bundle._routes = ["eth0", "eth1"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.bundle.set_drift("alert")
+        self.bundle._desired = {
+            "interface": "eth0", "gateway": "192.168.3.254"}
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+
+        self.bundle._check_drift()
+        self.bundle._check_drift()
+        drift = self.bundle.get_drift()
+        self.assertEqual(1, drift["detected"])
+        self.assertEqual(1, drift["alerted"])
+        self.assertEqual(
+            "alerted", self.bundle._try_update_default(self.bundle._routes))
+        mock_update_default.assert_not_called()
+        self.assertEqual([], self.bundle.get_history())
+
+        self.bundle._interfaces = dict(self.bundle._interfaces)
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(self.bundle._routes))
+
+    @patch.object(IPRoute, "_update_resolv")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__check_drift__adopt(self, mock_list_interfaces,
+                                 mock_get_default, mock_update_default,
+                                 mock_update_resolv):
+        """
+        check_drift: keep the change until the interfaces are changed
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        self.bundle._routes = ["eth0", "eth1"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.bundle.set_drift("adopt")
+        self.bundle._desired = {
+            "interface": "eth0", "gateway": "192.168.3.254"}
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+
+        self.bundle._check_drift()
+        self.assertEqual(1, self.bundle.get_drift()["adopted"])
+        mock_update_resolv.assert_called_once_with()
+        self.assertEqual(
+            "adopted", self.bundle._try_update_default(self.bundle._routes))
+        mock_update_default.assert_not_called()
+
+        self.bundle._interfaces = dict(self.bundle._interfaces)
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(self.bundle._routes))
+
+    @patch.object(IPRoute, "_defer")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__rate_limited(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_defer):
+        """
+        try_update_default: defer mutations over the budget
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_get_default.return_value = {}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+        self.bundle._bucket.burst = 2
+        self.bundle._bucket._tokens = 2
+
+        outcomes = [self.bundle._try_update_default(["eth0"])
+                    for i in xrange(3)]
+        self.assertEqual(["updated", "updated", "deferred"], outcomes)
+        self.assertEqual(2, mock_update_default.call_count)
+        self.assertEqual(1, mock_defer.call_count)
+
+    @patch.object(IPRoute, "_defer")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__backoff(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_defer):
+        """
+        try_update_default: back off after a failed update
+        """
+        mock_list_interfaces.return_value = (["eth0"], [])
+        mock_get_default.return_value = {}
+        mock_update_default.side_effect = Exception("RTNETLINK answers")
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"}
+        }
+
+        self.assertEqual(
+            "failed", self.bundle._try_update_default(["eth0"]))
+        mock_defer.assert_called_once_with(self.bundle.BACKOFF_BASE)
+        self.assertEqual(
+            "deferred", self.bundle._try_update_default(["eth0"]))
+        self.assertEqual(1, mock_update_default.call_count)
+
+    @patch.object(IPRoute, "_defer")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__check_drift__own_failure(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_defer):
+        """
+        check_drift: a failed update of the bundle is not a drift
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.bundle._desired = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+
+        # "del" done, "add" failed
+        mock_update_default.side_effect = Exception("RTNETLINK answers")
+        self.assertEqual(
+            "failed", self.bundle._try_update_default(["eth0", "eth1"]))
+        self.assertEqual("eth1", self.bundle._desired["interface"])
+
+        mock_get_default.return_value = {}
+        self.bundle._check_drift()
+        self.assertEqual(1, mock_update_default.call_count)
+        self.assertEqual(0, self.bundle.get_drift()["detected"])
+
+    @patch.object(IPRoute, "_request_convergence")
+    def test__defer(self, mock_request_convergence):
+        """
+        defer: converge once after the delay
+        """
+        self.bundle._defer(0.01)
+        self.bundle._defer(0.01)
+        sleep(0.1)
+        mock_request_convergence.assert_called_once_with("deferred")
+
+    def test__set_drift__invalid(self):
+        """
+        set_drift: invalid policy
+        """
+        with self.assertRaises(IPRouteError):
+            self.bundle.set_drift("ignore")
+
+    @patch("route.ip.route.show")
+    def test__simulate(self, mock_show):
+        """
+        simulate: evaluate configurations without touching the kernel
+        """
+        self.bundle._routes = ["eth0"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": False, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.assertEqual(
+            [{"interface": "eth0", "gateway": "192.168.3.254"}, {}],
+            self.bundle.simulate([{}, {"priorityList": ["eth1"]}]))
+        self.assertEqual(
+            [{"interface": "eth1", "gateway": "192.168.4.254"}],
+            self.bundle.simulate([{
+                "priorityList": ["eth1"],
+                "interfaces": {"eth1": {"status": True}}}]))
+        mock_show.assert_not_called()
+
+    @patch.object(IPRoute, "try_update_default")
+    @patch("route.ip.ping.ping")
+    def test__probe_links(self, mock_ping, mock_try_update_default):
+        """
+        probe_links: probe the gateways, converge if the best link changed
+        """
+        self.bundle._routes = ["eth0", "eth1"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        mock_ping.side_effect = lambda iface, target, timeout: \
+            None if "eth0" == iface else 20.0
+
+        self.bundle.probe_links()
+        mock_ping.assert_any_call("eth0", "192.168.3.254", 1)
+        mock_try_update_default.assert_not_called()
+
+        self.bundle.set_quality({"enable": True})
+        mock_try_update_default.reset_mock()
+        self.bundle.probe_links()
+        mock_try_update_default.assert_not_called()
+        self.assertEqual([], self.bundle.get_trace())
+
+        self.bundle._links.prune([])
+        self.bundle.probe_links()
+        mock_try_update_default.assert_called_once_with(["eth0", "eth1"])
+        self.assertEqual(["probe_links"],
+                         [record["name"] for record in
+                          self.bundle.get_trace()])
+        self.assertEqual(
+            1, self.bundle.get_quality()["links"]["eth1"]["samples"])
+
+    @patch.object(IPRoute, "try_update_default")
+    @patch("route.ip.addr.ifaddresses")
+    @patch("route.ip.rule")
+    @patch("route.ip.route")
+    @patch("route.ip.ping.ping")
+    def test__probe_links__target(self, mock_ping, mock_route, mock_rule,
+                                  mock_ifaddresses, mock_try_update_default):
+        """
+        probe_links: route the target through the gateway of each link
+        """
+        self.bundle._routes = ["eth0", "eth1", "eth2", "ppp0"]
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"},
+            "eth2": {"status": True, "wan": True},
+            "ppp0": {"status": True, "wan": True}
+        }
+        mock_ifaddresses.side_effect = lambda iface: \
+            {"mac": "" if "ppp0" == iface else "78:ac:c0:c1:a8:fe"}
+        mock_ping.return_value = 20.0
+        self.bundle.set_quality({"target": "8.8.8.8"})
+
+        self.bundle.probe_links()
+        self.assertEqual(
+            ["eth0", "eth1", "ppp0"],
+            [args[0][0] for args in mock_ping.call_args_list])
+        mock_ping.assert_any_call("eth1", "8.8.8.8", 1)
+        mock_route.replace.assert_any_call(
+            "default", "eth1", "192.168.4.254", table=1101)
+        mock_rule.add.assert_any_call(1101, 40000, oif="eth1")
+        self.assertEqual(2, mock_rule.add.call_count)
+
+        # applied once
+        self.bundle.probe_links()
+        self.assertEqual(2, mock_route.replace.call_count)
+
+        self.bundle._clear_probe_routes()
+        mock_rule.delete.assert_any_call(1101, 40000, oif="eth1")
+        mock_route.delete.assert_any_call("default", 1101)
+
+    @patch("route.ip.addr.ifaddresses")
+    @patch("route.ip.ping.ping")
+    @patch("route.ip.neigh.show")
+    def test__refresh_neighbors(self, mock_show, mock_ping, mock_ifaddresses):
+        """
+        refresh_neighbors: probe the standby gateways without usable entry
+        """
+        self.bundle._routes = ["eth0", "eth1", "eth2", "ppp0"]
+        self.bundle._desired = {"interface": "eth0"}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"},
+            "eth2": {"status": True, "wan": True, "gateway": "192.168.5.254"},
+            "ppp0": {"status": True, "wan": True, "gateway": "10.64.64.64"}
+        }
+        mock_ifaddresses.side_effect = lambda iface: {
+            "mac": "" if "ppp0" == iface else "78:ac:c0:00:00:00"}
+        entries = [
+            {"ip": "192.168.4.254", "dev": "eth1",
+             "lladdr": "00:00:00:00:00:01", "state": "REACHABLE"},
+            {"ip": "192.168.5.254", "dev": "eth2", "lladdr": "",
+             "state": "FAILED"}]
+        mock_show.side_effect = lambda: [dict(entry) for entry in entries]
+
+        def ping(iface, target, timeout):
+            entries[1].update(lladdr="00:00:00:00:00:02", state="REACHABLE")
+        mock_ping.side_effect = ping
+
+        neighbors = self.bundle.refresh_neighbors()
+        mock_ping.assert_called_once_with("eth2", "192.168.5.254", 1)
+        self.assertEqual(2, mock_show.call_count)
+        self.assertNotIn("eth0", neighbors)
+        self.assertEqual("REACHABLE", neighbors["eth2"]["state"])
+        self.assertEqual("NOARP", neighbors["ppp0"]["state"])
+        self.assertEqual(
+            {"gateway": "192.168.5.254", "lladdr": "00:00:00:00:00:02",
+             "state": "REACHABLE"},
+            self.bundle.get_iface("eth2")["neighbor"])
+
+        mock_ping.reset_mock()
+        self.bundle.refresh_neighbors()
+        mock_ping.assert_not_called()
+
+    @patch("route.ip.route.batch")
+    @patch.object(IPRoute, "_get_iface_name")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__set_policies(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_get_iface_name,
+            mock_batch):
+        """
+        set_policies: install rules and the default route of each table
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {}
+        mock_get_iface_name.side_effect = lambda name: name
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        policies = [
+            {"table": 100, "source": "192.168.10.0/24",
+             "priorityList": ["eth1", "eth0"]},
+            {"table": 101, "iif": "eth2", "priority": 2000,
+             "priorityList": ["wwan1"]}
+        ]
+
+        self.bundle.set_policies(policies)
+
+        self.assertEqual(policies, self.bundle.get_policies())
+        calls = [call[0][0] for call in mock_batch.call_args_list]
+        self.assertIn(
+            ["rule", "add", "from", "192.168.10.0/24", "priority", "1100",
+             "table", "100"], calls[1])
+        self.assertIn(
+            ["rule", "add", "from", "all", "iif", "eth2", "priority", "2000",
+             "table", "101"], calls[1])
+        self.assertEqual(
+            [["route", "replace", "default", "dev", "eth1",
+              "via", "192.168.4.254", "table", "100"],
+             ["route", "flush", "table", "101"]], calls[2])
+
+        # nothing changed, nothing to apply
+        self.bundle.try_update_default(self.bundle._routes)
+        self.assertEqual(3, mock_batch.call_count)
+
+        # failover of table 100 only
+        mock_list_interfaces.return_value = (["eth0"], [])
+        self.bundle.try_update_default(self.bundle._routes)
+        self.assertEqual(
+            [["route", "replace", "default", "dev", "eth0",
+              "via", "192.168.3.254", "table", "100"]],
+            mock_batch.call_args[0][0])
+
+    def test__set_policies__duplicated(self):
+        """
+        set_policies: table should be unique
+        """
+        with self.assertRaises(IPRouteError):
+            self.bundle.set_policies([
+                {"table": 100, "priorityList": ["eth0"]},
+                {"table": 100, "priorityList": ["eth1"]}])
+
     @patch("route.ip.route.delete")
     @patch("route.ip.route.add")
     def test__update_default(self, mock_ip_route_add, mock_ip_route_del):
@@ -266,7 +1227,7 @@ class TestIPRouteClass(unittest.TestCase):
         """
         try_update_default: no interfaces
         """
-        mock_list_interfaces.return_value = []
+        mock_list_interfaces.return_value = ([], [])
 
         with self.assertRaises(IPRouteError):
             self.bundle._try_update_default(self.bundle.model.db)
@@ -282,7 +1243,7 @@ class TestIPRouteClass(unittest.TestCase):
         """
         try_update_default: update by default
         """
-        mock_list_interfaces.return_value = ["eth0", "eth1", "wwan0"]
+        mock_list_interfaces.return_value = (["eth0", "eth1", "wwan0"], [])
         mock_get_default.return_value = {
             "interface": "eth1",
             "gateway": "192.168.4.254"
@@ -320,7 +1281,7 @@ class TestIPRouteClass(unittest.TestCase):
         """
         try_update_default: update by default (same with current setting)
         """
-        mock_list_interfaces.return_value = ["eth0", "eth1", "wwan0"]
+        mock_list_interfaces.return_value = (["eth0", "eth1", "wwan0"], [])
         mock_get_default.return_value = {
             "interface": "eth0",
             "gateway": "192.168.3.254"
@@ -356,7 +1317,7 @@ class TestIPRouteClass(unittest.TestCase):
         try_update_default: update by secondary
         """
         # arrange
-        mock_list_interfaces.return_value = ["eth1", "wwan0"]
+        mock_list_interfaces.return_value = (["eth1", "wwan0"], [])
         mock_get_default.return_value = {
             "interface": "wwan0",
             "gateway": "192.168.4.254"
@@ -390,6 +1351,261 @@ class TestIPRouteClass(unittest.TestCase):
         default["interface"] = "wwan0"
         mock_update_default.assert_called_once_with(default)
 
+    @patch.object(IPRoute, "_background")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__flush_flows(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_background):
+        """
+        try_update_default: flush the flows of the previous WAN if enabled
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_background.assert_not_called()
+
+        self.bundle._flush_conntrack = True
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_background.assert_called_once_with(
+            self.bundle.flush_flows, "eth1")
+
+    @patch("route.ip.conntrack")
+    @patch("route.ip.rule")
+    @patch("route.ip.route.delete")
+    @patch("route.ip.route.replace")
+    @patch.object(IPRoute, "_background")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__graceful_failback(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_background,
+            mock_route_replace,
+            mock_route_delete,
+            mock_rule,
+            mock_conntrack):
+        """
+        try_update_default: keep the flows of the backup WAN on failback
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        # marked without the instance lock
+        mock_conntrack.mark.side_effect = \
+            lambda address, mark: 0 if self.bundle._lock.locked() else 3
+        mock_conntrack.count.return_value = 1
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254",
+                     "ip": "192.168.4.127"}
+        }
+        self.bundle._flush_conntrack = True
+        self.bundle.set_failback("graceful")
+        self.bundle.FAILBACK_CHECK = 0.05
+
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_route_replace.assert_called_once_with(
+            "default", "eth1", "192.168.4.254", table=1000)
+        mock_rule.add.assert_called_once_with(
+            1000, 900, fwmark="0x100/0x100")
+        mock_conntrack.restore_mark.assert_called_once_with(
+            True, "eth1", 0x100)
+        mock_conntrack.mark.assert_called_once_with("192.168.4.127", 0x100)
+        mock_background.assert_not_called()
+        self.assertEqual(
+            3, self.bundle.get_failback()["active"]["flows"])
+
+        # still one flow left
+        sleep(0.1)
+        self.assertEqual(1, self.bundle.get_failback()["active"]["flows"])
+
+        # drained
+        mock_conntrack.count.return_value = 0
+        sleep(0.1)
+        self.assertIsNone(self.bundle.get_failback()["active"])
+        mock_rule.delete.assert_called_once_with(
+            1000, 900, fwmark="0x100/0x100")
+        mock_route_delete.assert_called_once_with("default", 1000)
+        mock_conntrack.restore_mark.assert_called_with(False, "eth1", 0x100)
+
+    @patch("route.ip.conntrack")
+    @patch("route.ip.rule")
+    @patch("route.ip.route.delete")
+    def test__clear_leftover(
+            self, mock_route_delete, mock_rule, mock_conntrack):
+        """
+        clear_leftover: remove the rules of an interrupted failback and
+        link probes
+        """
+        mock_rule.show.return_value = [
+            {"priority": 0, "from": "all", "table": "local"}]
+        self.bundle._clear_leftover()
+        mock_conntrack.clear_restore_mark.assert_not_called()
+        mock_rule.delete.assert_not_called()
+
+        mock_rule.show.return_value = [
+            {"priority": 0, "from": "all", "table": "local"},
+            {"priority": 900, "from": "all", "fwmark": "0x100/0x100",
+             "table": "1000"}]
+        self.bundle._clear_leftover()
+        mock_conntrack.clear_restore_mark.assert_called_once_with(0x100)
+        mock_route_delete.assert_called_once_with("default", 1000)
+        mock_rule.delete.assert_called_once_with(
+            1000, 900, fwmark="0x100/0x100")
+
+        mock_rule.show.return_value = [
+            {"priority": 40000, "from": "all", "oif": "eth1",
+             "table": "1101"}]
+        self.bundle._clear_leftover()
+        mock_rule.delete.assert_called_with(1101, 40000, oif="eth1")
+        mock_route_delete.assert_called_with("default", 1101)
+
+    @patch("route.ip.conntrack")
+    @patch("route.ip.rule")
+    @patch("route.ip.route")
+    @patch.object(IPRoute, "_defer")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__graceful_deferred(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_defer,
+            mock_route,
+            mock_rule,
+            mock_conntrack):
+        """
+        try_update_default: release the kept flows if the switch is deferred
+        """
+        mock_list_interfaces.return_value = (["eth0", "eth1"], [])
+        mock_get_default.return_value = {
+            "interface": "eth1", "gateway": "192.168.4.254"}
+        mock_conntrack.mark.return_value = 3
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254",
+                     "ip": "192.168.4.127"}
+        }
+        self.bundle.set_failback("graceful")
+        while self.bundle._bucket.take():
+            pass
+
+        self.assertEqual(
+            "deferred", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_update_default.assert_not_called()
+        mock_conntrack.mark.assert_called_once_with("192.168.4.127", 0x100)
+        self.assertIsNone(self.bundle.get_failback()["active"])
+        mock_rule.delete.assert_called_once_with(
+            1000, 900, fwmark="0x100/0x100")
+
+    @patch("route.ip.conntrack")
+    @patch("route.ip.rule")
+    @patch("route.ip.route.add")
+    @patch.object(IPRoute, "_update_default")
+    @patch.object(IPRoute, "_get_default")
+    @patch.object(IPRoute, "list_interfaces")
+    def test__try_update_default__failover_not_graceful(
+            self,
+            mock_list_interfaces,
+            mock_get_default,
+            mock_update_default,
+            mock_route_add,
+            mock_rule,
+            mock_conntrack):
+        """
+        try_update_default: failover to a lower priority WAN is immediate
+        """
+        mock_list_interfaces.return_value = (["eth1"], [])
+        mock_get_default.return_value = {
+            "interface": "eth0", "gateway": "192.168.3.254"}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "gateway": "192.168.3.254",
+                     "ip": "192.168.3.127"},
+            "eth1": {"status": True, "wan": True, "gateway": "192.168.4.254"}
+        }
+        self.bundle.set_failback("graceful")
+
+        self.assertEqual(
+            "updated", self.bundle._try_update_default(["eth0", "eth1"]))
+        mock_route_add.assert_not_called()
+        mock_conntrack.mark.assert_not_called()
+        self.assertIsNone(self.bundle.get_failback()["active"])
+        with self.assertRaises(IPRouteError):
+            self.bundle.set_failback("slow")
+
+    @patch.object(IPRoute, "try_update_default")
+    def test__update_resolv(self, mock_try_update_default):
+        """
+        update_resolv: DNS servers of the default WAN first, written once
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.bundle._resolv_conf = os.path.join(path, "resolv.conf")
+        self.bundle._routes = ["eth0", "eth1"]
+        self.bundle._available = ["eth0", "eth1"]
+        self.bundle._default = {"interface": "eth1",
+                                "gateway": "192.168.4.254"}
+        self.bundle._interfaces = {
+            "eth0": {"status": True, "wan": True, "dns": ["8.8.8.8"]},
+            "eth1": {"status": True, "wan": True}
+        }
+        # only "dns" is changed, no convergence
+        self.bundle.update_iface_db({"name": "eth1", "dns": ["1.1.1.1"]})
+        mock_try_update_default.assert_not_called()
+        with open(self.bundle._resolv_conf) as f:
+            self.assertEqual(
+                ["nameserver 1.1.1.1", "nameserver 8.8.8.8"],
+                [line for line in f.read().splitlines()
+                 if not line.startswith("#")])
+
+        self.assertFalse(self.bundle._update_resolv())
+        self.bundle._default = {"interface": "eth0",
+                                "gateway": "192.168.3.254"}
+        self.assertTrue(self.bundle._update_resolv())
+
+    @patch("route.ip.conntrack.delete")
+    def test__flush_flows(self, mock_delete):
+        """
+        flush_flows: delete the flows NATed to each address of the interface
+        """
+        mock_delete.side_effect = lambda address: \
+            {"192.168.4.127": 3, "192.168.4.128": 2}[address]
+        self.bundle._addresses = {"eth1": ["192.168.4.127"]}
+        self.bundle._interfaces = {"eth1": {"ip": "192.168.4.128"}}
+
+        self.assertEqual(5, self.bundle.flush_flows("eth1"))
+        self.assertEqual(2, mock_delete.call_count)
+        self.assertEqual(0, self.bundle.flush_flows("eth2"))
+
+    def test__background__loop(self):
+        """
+        _background: run in a thread, not queued to the event loop
+        """
+        bundle = IPRoute(name=self.name, path=self.path, engine="loop")
+        done = Event()
+        bundle._background(done.set)
+        self.assertTrue(done.wait(1))
+        self.assertEqual(0, bundle._loop.pending())
+
     @patch.object(IPRoute, "_update_default")
     @patch.object(IPRoute, "list_interfaces")
     def test__try_update_default__delete(
@@ -399,7 +1615,7 @@ class TestIPRouteClass(unittest.TestCase):
         """
         try_update_default: delete default gateway
         """
-        mock_list_interfaces.return_value = ["eth1"]
+        mock_list_interfaces.return_value = (["eth1"], [])
 
         routes = ["wwan0", "eth0"]
 
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+
+import os
+import sys
+import unittest
+
+try:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)) + '/../')
+    from route.tracing import Tracer
+except ImportError as e:
+    print os.path.dirname(os.path.realpath(__file__)) + '/../'
+    print sys.path
+    print e
+    print "Please check the python PATH for import test module. (%s)" \
+        % __file__
+    exit(1)
+
+
+class TestTracerClass(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = Tracer(size=2)
+
+    def test__span(self):
+        """
+        span: nested spans are recorded as a tree
+        """
+        with self.tracer.span("convergence", routes=["eth0"]) as span:
+            with self.tracer.span("list_interfaces"):
+                pass
+            span.set(outcome="unchanged")
+
+        record = self.tracer.records()[0]
+        self.assertEqual("convergence", record["name"])
+        self.assertEqual(
+            {"routes": ["eth0"], "outcome": "unchanged"}, record["attrs"])
+        self.assertEqual("list_interfaces", record["children"][0]["name"])
+
+    def test__span__error(self):
+        """
+        span: record the exception raised in span
+        """
+        with self.assertRaises(IOError):
+            with self.tracer.span("update_default"):
+                raise IOError("failed")
+        self.assertEqual(
+            "IOError: failed", self.tracer.records()[0]["attrs"]["error"])
+
+    def test__records__bounded(self):
+        """
+        records: keep only the latest records
+        """
+        for name in ["a", "b", "c"]:
+            with self.tracer.span(name):
+                pass
+        self.assertEqual(
+            ["c", "b"], [record["name"] for record in self.tracer.records()])
+
+    def test__disabled(self):
+        """
+        enabled: nothing is recorded if disabled
+        """
+        self.tracer.enabled = False
+        with self.tracer.span("convergence") as span:
+            span.set(outcome="updated")
+        self.assertEqual([], self.tracer.records())
+
+
+if __name__ == "__main__":
+    unittest.main()